@@ -0,0 +1,16 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Directory where offline training publishes model artifacts for the API to load.
+MODEL_DIR = Path(os.getenv("MODEL_DIR", str(ROOT / "models")))
+
+# How often (seconds) the API checks MODEL_DIR for a newly published model.
+MODEL_RELOAD_INTERVAL_S = float(os.getenv("MODEL_RELOAD_INTERVAL_S", "30"))
+
+# Verify the CRC32 of neighbor artifacts when mapping them (reads the file once).
+MODEL_VERIFY_CHECKSUM = os.getenv("MODEL_VERIFY_CHECKSUM", "true").lower() in ("1", "true", "yes")
@@ -1,12 +1,43 @@
 import os
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+# Pool / connection settings shared by the sync and async engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = server default
+
+# Serve /recommend/* through asyncpg-backed AsyncSessions
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "false").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+
+def _pool_kwargs():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_S,
+        "pool_recycle": DB_POOL_RECYCLE_S,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _sync_connect_args():
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return {}
+
+
+engine = create_engine(DATABASE_URL, echo=False, future=True,
+                       connect_args=_sync_connect_args(), **_pool_kwargs())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 
 def get_db():
@@ -14,4 +45,53 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# ------------------------------
+# Async engine (optional, needs asyncpg)
+# ------------------------------
+_async_engine = None
+_async_sessionmaker = None
+
+
+def async_database_url(url: str | None = None) -> str:
+    """``DATABASE_URL`` rewritten for the asyncpg driver unless ASYNC_DATABASE_URL is set."""
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    u = make_url(url or DATABASE_URL)
+    if u.drivername in ("postgresql", "postgresql+psycopg2", "postgres"):
+        u = u.set(drivername="postgresql+asyncpg")
+    return u.render_as_string(hide_password=False)
+
+
+def get_async_engine():
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+        connect_args = {}
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        _async_engine = create_async_engine(async_database_url(), echo=False,
+                                            connect_args=connect_args, **_pool_kwargs())
+        _async_sessionmaker = async_sessionmaker(_async_engine, class_=AsyncSession,
+                                                 autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_sessionmaker()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _async_sessionmaker = None
@@ -1,8 +1,31 @@
 import os
+import time
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from app.routers.recommendations import router as recommendations_router
+from app.db import ASYNC_DB_ENABLED, SessionLocal, dispose_async_engine, engine, get_async_engine
+from app.routers.events import router as events_router
+from app.services.candidate_index import (
+    CANDIDATE_PRUNING_ENABLED,
+    get_candidate_index,
+    load_candidate_index,
+    start_candidate_index_refresher,
+)
+from app.services.event_ingest import start_event_buffer, stop_event_buffer
+from app.services.metrics import (
+    METRICS_ENABLED,
+    PROMETHEUS_CONTENT_TYPE,
+    instrument_engine,
+    metrics_middleware,
+    render_metrics,
+)
+from app.services.scoring import get_weight_profile
+from app.services.shop_locator import get_shop_locator, start_shop_locator_refresher
+from app.services.similarity_index import get_item_index, load_item_index, start_item_index_watcher
+from app.services.user_cf import get_user_cf_model, load_user_cf_model, start_user_cf_watcher
+from app.services.user_topn import USER_TOPN_ENABLED, get_user_topn, load_user_topn, start_user_topn_watcher
 
 app = FastAPI(title="Grocery AI Recommendations API")
 
@@ -14,12 +37,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if METRICS_ENABLED:
+    # request latency + optional Server-Timing header; statement timings via engine events
+    app.middleware("http")(metrics_middleware)
+    instrument_engine(engine)
+    if ASYNC_DB_ENABLED:
+        instrument_engine(get_async_engine().sync_engine)
+
+if ASYNC_DB_ENABLED:
+    from app.routers.recommendations_async import router as recommendations_router
+else:
+    from app.routers.recommendations import router as recommendations_router
+
 app.include_router(recommendations_router)
+app.include_router(events_router)
 
 @app.get("/")
 def root():
     return {"status": "ok", "service": "recommendations"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; empty while METRICS_ENABLED is off
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+# ------------------------------
+# Model preload + background tasks
+# ------------------------------
+# Set by preload_models(); workers forked by app.serve inherit it and skip loading
+_preload = None
+# Extra /ready fields (worker generation, ...) set by app.serve in each worker
+serve_info = {}
+# app.serve turns this off: its parent reloads the models and rolls the workers instead
+MODEL_WATCHERS_ENABLED = True
+
+def preload_models():
+    """Load every served model and snapshot; returns the /ready load report."""
+    global _preload
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        # Load the item-similarity index once so requests skip the item_similarity query
+        load_item_index(db)
+        get_shop_locator().refresh(db)
+        # user-CF is only preloaded when its weight is on (RECO_WEIGHTS=...,user_cf=0.1)
+        if get_weight_profile().user_cf > 0:
+            load_user_cf_model(db)
+        if USER_TOPN_ENABLED:
+            load_user_topn()
+        if CANDIDATE_PRUNING_ENABLED:
+            load_candidate_index(db)
+    finally:
+        db.close()
+    _preload = {"loaded_by_pid": os.getpid(), "loaded_at": time.time(), "load_s": time.perf_counter() - t0}
+    return _preload
+
+def model_versions():
+    item_index, user_cf, topn = get_item_index(), get_user_cf_model(), get_user_topn()
+    candidates = get_candidate_index()
+    locator = get_shop_locator()
+    return {
+        "item_index": None if item_index is None else item_index.version,
+        "user_cf": None if user_cf is None else user_cf.version,
+        "user_topn": None if topn is None else topn.version,
+        "candidate_index": None if candidates is None else len(candidates),
+        "shop_locator": locator.name,
+    }
+
+def start_background_tasks():
+    if MODEL_WATCHERS_ENABLED:
+        start_item_index_watcher()
+        if get_weight_profile().user_cf > 0:
+            start_user_cf_watcher(SessionLocal)
+        if USER_TOPN_ENABLED:
+            start_user_topn_watcher()
+    if CANDIDATE_PRUNING_ENABLED:
+        start_candidate_index_refresher(SessionLocal)
+    start_shop_locator_refresher(SessionLocal)
+    start_event_buffer(SessionLocal)
+
+@app.get("/ready")
+def ready():
+    # 503 until the models are in memory; load-balancer health checks poll this
+    if _preload is None:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True, "pid": os.getpid(), **serve_info, **_preload, "models": model_versions()}
+
 @app.on_event("startup")
 def on_startup():
-    return None
\ No newline at end of file
+    if _preload is None:
+        preload_models()
+    start_background_tasks()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # write the buffered events before the pools go away (runs off the event loop)
+    await run_in_threadpool(stop_event_buffer)
+    await dispose_async_engine()
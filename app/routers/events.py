@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from app.services.event_ingest import get_event_buffer
+from app.schemas.event import EventAccepted, PurchaseEventIn, ViewEventIn
+
+# Events are buffered and written in batches by app.services.event_ingest; 202 means
+# "queued", the rows appear within EVENT_FLUSH_INTERVAL_S. No DB access here, so the
+# handlers run on the event loop in both serving modes.
+router = APIRouter(prefix="/events", tags=["events"])
+
+def _accepted(ok):
+    if not ok:
+        # buffer full (database slow or down) or shutting down: shed load, the client retries
+        raise HTTPException(status_code=503, detail="Event buffer full, retry later",
+                            headers={"Retry-After": "1"})
+    return EventAccepted(pending=get_event_buffer().pending())
+
+def _buffer():
+    buffer = get_event_buffer()
+    if buffer is None:
+        raise HTTPException(status_code=503, detail="Event ingestion is not running")
+    return buffer
+
+@router.post("/view", response_model=EventAccepted, status_code=202)
+async def post_view(event: ViewEventIn):
+    return _accepted(_buffer().add_view(event.user_id, event.product_id))
+
+@router.post("/purchase", response_model=EventAccepted, status_code=202)
+async def post_purchase(event: PurchaseEventIn):
+    return _accepted(_buffer().add_purchase(event.user_id, event.product_id, event.quantity,
+                                            event.price_at_purchase))
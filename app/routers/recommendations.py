@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db import get_db
 from app.services.recommendation_service import (
     get_nearby_shops_service,
     recommend_products_hybrid
 )
-from app.schemas.recommendation import ShopOut, ProductRecommendationsResponse
+from app.services.batch_recommendation import BATCH_MAX_REQUESTS, recommend_products_batch_results
+from app.schemas.recommendation import (
+    BatchRecommendationRequest,
+    BatchRecommendationResponse,
+    ProductRecommendationsResponse,
+    ShopOut,
+)
 
 router = APIRouter(prefix="/recommend", tags=["recommendations"])
 
@@ -16,4 +22,12 @@ def get_shops(lat: float, lon: float, radius_km: float = 5.0, db: Session = Depe
 @router.get("/products", response_model=ProductRecommendationsResponse)
 def get_products(user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit: int = 20, db: Session = Depends(get_db)):
     shops, recs = recommend_products_hybrid(db, user_id, lat, lon, radius_km, limit)
-    return ProductRecommendationsResponse(shops=shops, recommended_products=recs)
\ No newline at end of file
+    return ProductRecommendationsResponse(shops=shops, recommended_products=recs)
+
+@router.post("/products:batch", response_model=BatchRecommendationResponse)
+def get_products_batch(body: BatchRecommendationRequest, db: Session = Depends(get_db)):
+    if len(body.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    requests = [(r.user_id, r.lat, r.lon, r.radius_km) for r in body.requests]
+    results = recommend_products_batch_results(db, requests, body.limit, body.include_shops)
+    return BatchRecommendationResponse(results=results)
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.db import get_async_db
+from app.services.async_recommendation_service import (
+    get_nearby_shops_service_async,
+    recommend_products_hybrid_async
+)
+from app.services.batch_recommendation import BATCH_MAX_REQUESTS, recommend_products_batch_results
+from app.schemas.recommendation import (
+    BatchRecommendationRequest,
+    BatchRecommendationResponse,
+    ProductRecommendationsResponse,
+    ShopOut,
+)
+
+# Same endpoints as app.routers.recommendations, served on the event loop (ASYNC_DB_ENABLED=true)
+router = APIRouter(prefix="/recommend", tags=["recommendations"])
+
+@router.get("/shops", response_model=list[ShopOut])
+async def get_shops(lat: float, lon: float, radius_km: float = 5.0, db=Depends(get_async_db)):
+    return await get_nearby_shops_service_async(db, lat, lon, radius_km)
+
+@router.get("/products", response_model=ProductRecommendationsResponse)
+async def get_products(user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit: int = 20, db=Depends(get_async_db)):
+    shops, recs = await recommend_products_hybrid_async(db, user_id, lat, lon, radius_km, limit)
+    return ProductRecommendationsResponse(shops=shops, recommended_products=recs)
+
+@router.post("/products:batch", response_model=BatchRecommendationResponse)
+async def get_products_batch(body: BatchRecommendationRequest, db=Depends(get_async_db)):
+    if len(body.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    requests = [(r.user_id, r.lat, r.lon, r.radius_km) for r in body.requests]
+    # CPU-bound scoring over a handful of shared queries: run the sync path on this connection
+    results = await db.run_sync(
+        lambda session: recommend_products_batch_results(session, requests, body.limit, body.include_shops))
+    return BatchRecommendationResponse(results=results)
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class ViewEventIn(BaseModel):
+    user_id: int
+    product_id: int
+
+class PurchaseEventIn(BaseModel):
+    user_id: int
+    product_id: int
+    quantity: int = Field(1, ge=1)
+    price_at_purchase: Optional[float] = Field(None, ge=0)
+
+class EventAccepted(BaseModel):
+    accepted: bool = True
+    # events waiting to be written (buffered + in the batch being written)
+    pending: int
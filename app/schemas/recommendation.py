@@ -16,8 +16,29 @@ class ProductOut(BaseModel):
     category_id: Optional[int] = None
     score: float
     cf_score: float
+    user_cf_score: Optional[float] = None
     reasons: Optional[List[str]] = None
 
 class ProductRecommendationsResponse(BaseModel):
     shops: List[ShopOut]
-    recommended_products: List[ProductOut]
\ No newline at end of file
+    recommended_products: List[ProductOut]
+class BatchRecommendationItem(BaseModel):
+    user_id: int
+    lat: float
+    lon: float
+    radius_km: float = 5.0
+
+class BatchRecommendationRequest(BaseModel):
+    requests: List[BatchRecommendationItem]
+    limit: int = 20
+    include_shops: bool = False
+
+class BatchRecommendationResult(BaseModel):
+    user_id: int
+    lat: float
+    lon: float
+    shops: Optional[List[ShopOut]] = None
+    recommended_products: List[ProductOut]
+
+class BatchRecommendationResponse(BaseModel):
+    results: List[BatchRecommendationResult]
@@ -0,0 +1,234 @@
+"""
+Functionality of this module:
+Pre-forking server for the API. The parent process loads every model and snapshot once
+(app.main.preload_models), binds the listening socket and forks --workers uvicorn workers that
+inherit both: memory-mapped artifacts (item/user neighbors, user top-N) are shared through the
+page cache, and the in-memory snapshots (shop index, candidate lists, user-CF interactions) are
+shared copy-on-write; gc.freeze() keeps the collector from writing to their pages. The parent:
+    - restarts workers that exit unexpectedly,
+    - polls the model artifacts every MODEL_RELOAD_INTERVAL_S; on a change (or SIGHUP) it
+      reloads them itself and replaces the workers one at a time: a new worker is forked from
+      the reloaded parent, and only once it reports ready is an old one sent SIGTERM (it
+      finishes its in-flight requests and flushes its event buffer). The listening socket stays
+      open throughout, so no request is refused during a reload,
+    - on SIGTERM/SIGINT stops all workers gracefully and exits.
+Workers do not run the model watchers; GET /ready reports the worker's generation, pid, model
+versions and the parent's load time.
+Usage:
+    python -m app.serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+"""
+
+import argparse
+import gc
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import uvicorn
+from app.config import MODEL_RELOAD_INTERVAL_S
+from app.services.similarity_index import item_index_path
+from app.services.user_cf import user_index_path
+from app.services.user_topn import user_topn_path
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+# a replacement worker that is not ready after this long is killed and the reload aborted
+SERVE_READY_TIMEOUT_S = float(os.getenv("SERVE_READY_TIMEOUT_S", "60"))
+# in-flight requests a stopping worker may still finish
+SERVE_GRACEFUL_TIMEOUT_S = float(os.getenv("SERVE_GRACEFUL_TIMEOUT_S", "30"))
+
+def model_mtimes():
+    """mtimes of the published artifacts; a change triggers a rolling reload."""
+    out = []
+    for path in (item_index_path(), user_index_path(), user_topn_path()):
+        try:
+            out.append(path.stat().st_mtime)
+        except FileNotFoundError:
+            out.append(None)
+    return tuple(out)
+
+def preload():
+    """(Re)load the models in the parent, then make the heap fork-friendly."""
+    import app.main as main
+    from app.db import engine
+
+    gc.unfreeze()
+    report = main.preload_models()
+    # connections must not be shared with the children; each worker opens its own
+    engine.dispose()
+    gc.collect()
+    gc.freeze()
+    print(f"[serve {os.getpid()}] models loaded in {report['load_s']:.2f}s: {main.model_versions()}", flush=True)
+
+def make_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+class _ReadyServer(uvicorn.Server):
+    """uvicorn server that tells the parent (through a pipe) when it accepts requests."""
+
+    def __init__(self, config, ready_fd):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+def run_worker(sock, generation, ready_fd, args):
+    """Child side of the fork: serve on the inherited socket until SIGTERM."""
+    import app.main as main
+    from app.db import engine
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+    # drop pool state copied from the parent without closing its sockets
+    engine.dispose(close=False)
+    main.MODEL_WATCHERS_ENABLED = False
+    main.serve_info.update({"generation": generation, "workers": args.workers})
+    config = uvicorn.Config(main.app, lifespan="on", log_level=args.log_level,
+                            timeout_graceful_shutdown=SERVE_GRACEFUL_TIMEOUT_S)
+    _ReadyServer(config, ready_fd).run(sockets=[sock])
+
+class Supervisor:
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.generation = 0
+        self.workers = {}     # pid -> generation of the live workers
+        self.retiring = set() # pids sent SIGTERM by a reload; not restarted when they exit
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        """Fork one worker of the current generation; returns ``(pid, ready read fd)``."""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                run_worker(self.sock, self.generation, ready_w, self.args)
+            except BaseException as exc:
+                print(f"[worker {os.getpid()}] crashed: {exc!r}", file=sys.stderr, flush=True)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        self.workers[pid] = self.generation
+        return pid, ready_r
+
+    def wait_ready(self, pid, ready_r):
+        try:
+            readable, _, _ = select.select([ready_r], [], [], SERVE_READY_TIMEOUT_S)
+            ok = bool(readable) and os.read(ready_r, 1) == b"1"
+        finally:
+            os.close(ready_r)
+        if not ok:
+            print(f"[serve] worker {pid} did not become ready; killing it", file=sys.stderr, flush=True)
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGKILL)
+        return ok
+
+    def start(self):
+        for _ in range(self.args.workers):
+            self.wait_ready(*self.spawn())
+
+    def rolling_reload(self):
+        """Replace every worker with one forked after a fresh preload, one at a time."""
+        old = [pid for pid in self.workers if pid not in self.retiring]
+        try:
+            preload()
+        except Exception as exc:  # keep the current workers and models
+            print(f"[serve] reload failed, keeping generation {self.generation}: {exc}", file=sys.stderr, flush=True)
+            return
+        self.generation += 1
+        for pid in old:
+            if self.stopping:
+                return
+            if not self.wait_ready(*self.spawn()):
+                print(f"[serve] reload aborted; generation {self.generation - 1} workers keep serving",
+                      file=sys.stderr, flush=True)
+                return
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+        print(f"[serve] generation {self.generation} serving ({len(old)} workers replaced)", flush=True)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif not self.stopping:
+                print(f"[serve] worker {pid} exited (status {status}); starting a replacement",
+                      file=sys.stderr, flush=True)
+                self.wait_ready(*self.spawn())
+
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT_S + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+        self.reap()
+
+    def run(self):
+        def on_stop(signum, frame):
+            self.stopping = True
+
+        def on_hup(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_hup)
+
+        mtimes = model_mtimes()
+        self.start()
+        next_check = time.monotonic() + MODEL_RELOAD_INTERVAL_S
+        while not self.stopping:
+            self.reap()
+            if MODEL_RELOAD_INTERVAL_S > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + MODEL_RELOAD_INTERVAL_S
+                current = model_mtimes()
+                if current != mtimes:
+                    mtimes = current
+                    self.reload_requested = True
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_reload()
+            time.sleep(0.2)
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    preload()
+    sock = make_socket(args.host, args.port)
+    print(f"[serve {os.getpid()}] listening on {args.host}:{args.port} with {args.workers} workers", flush=True)
+    Supervisor(sock, args).run()
@@ -0,0 +1,145 @@
+# app/services/async_recommendation_service.py
+import asyncio
+
+from app.db import AsyncSessionLocal
+from app.services.candidate_index import get_candidate_index
+from app.services.metrics import inc, stage
+from app.services.pushdown_engine import recommend_products_pushdown
+from app.services.response_cache import get_response_cache
+from app.services.recommendation_service import (
+    RECO_ENGINE,
+    CANDIDATES_QUERY,
+    CF_QUERY,
+    CandidateColumns,
+    _cf_from_index,
+    _cf_from_rows,
+    _candidate_pool,
+    _cf_params,
+    _rank_candidates,
+    _pool_params,
+    _rank_topn,
+    record_candidates,
+)
+from app.services.scoring import get_weight_profile
+from app.services.shop_locator import get_shop_locator
+from app.services.user_cf import user_cf_scores
+from app.services.user_topn import TOPN_CANDIDATES_QUERY, topn_params, user_topn_entry
+from app.services.user_profile import get_user_profile_async, get_user_profile_cache
+
+
+# ------------------------------
+# Async variants of the service functions
+# ------------------------------
+async def get_nearby_shops_service_async(db, lat: float, lon: float, radius_km: float = 5.0):
+    return await get_shop_locator().nearby_async(db, lat, lon, radius_km)
+
+
+async def get_user_top_categories_async(db, user_id: int):
+    return (await get_user_profile_async(db, user_id)).category_weights
+
+
+async def _fetch_candidates_async(db, shop_ids):
+    rows = (await db.execute(CANDIDATES_QUERY, {"shops": shop_ids})).fetchall()
+    return CandidateColumns(rows)
+
+
+async def _fetch_pool_async(db, shops, profile, weights, limit):
+    shop_ids = [s["id"] for s in shops]
+    pool = _candidate_pool(shops, profile, weights, limit)
+    if pool is None:
+        return await _fetch_candidates_async(db, shop_ids)
+    rows = (await db.execute(TOPN_CANDIDATES_QUERY, _pool_params(pool, shop_ids))).fetchall()
+    return CandidateColumns(rows)
+
+
+async def _load_profile_concurrently(user_id: int):
+    # an AsyncSession is not safe for concurrent use, so a cache miss runs on
+    # its own pooled connection while the request session fetches candidates
+    profile = get_user_profile_cache().get(user_id)
+    if profile is not None:
+        return profile
+    async with AsyncSessionLocal() as db:
+        return await get_user_profile_async(db, user_id)
+
+
+async def _cf_scores_async(db, seen, candidate_ids):
+    cf = _cf_from_index(seen, candidate_ids)
+    if cf is None:
+        sim_rows = (await db.execute(CF_QUERY, _cf_params(seen, candidate_ids))).fetchall()
+        cf = _cf_from_rows(candidate_ids, sim_rows)
+    return cf
+
+
+async def recommend_products_hybrid_async(db, user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit=20):
+    cache = get_response_cache()
+    if cache is None:
+        return await _recommend_products_async(db, user_id, lat, lon, radius_km, limit)
+    key, (clat, clon) = cache.key(user_id, lat, lon, radius_km, limit)
+    return await cache.get_or_compute_async(
+        key, lambda: _recommend_products_async(db, user_id, clat, clon, radius_km, limit))
+
+
+async def _recommend_products_async(db, user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit=20):
+    if RECO_ENGINE == "pushdown":
+        inc("reco_requests_total", path="pushdown")
+        # one statement, nothing to overlap: run the sync engine over this connection
+        with stage("pushdown"):
+            return await db.run_sync(
+                lambda session: recommend_products_pushdown(session, user_id, lat, lon, radius_km, limit))
+
+    # 1) Nearby shops
+    with stage("shops"):
+        shops = await get_nearby_shops_service_async(db, lat, lon, radius_km)
+    if not shops:
+        inc("reco_requests_total", path="no_shops")
+        return [], []
+
+    shop_ids = [s["id"] for s in shops]
+    weights = get_weight_profile()
+
+    # Returning users: re-rank their precomputed top-N (live path when too few are nearby)
+    entry = user_topn_entry(user_id)
+    if entry is not None:
+        with stage("topn_candidates"):
+            rows = (await db.execute(TOPN_CANDIDATES_QUERY, topn_params(entry, shop_ids))).fetchall()
+            cands = CandidateColumns(rows)
+        if len(cands) >= limit:
+            inc("reco_requests_total", path="topn")
+            with stage("user_cf"):
+                user_cf = user_cf_scores(user_id, cands.ids, weights)
+            with stage("score"):
+                recs = _rank_topn(cands, entry, shops, radius_km, limit, weights, user_cf)
+            inc("reco_candidates_total", len(cands))
+            return shops, recs
+    inc("reco_requests_total", path="live")
+
+    if get_candidate_index() is not None:
+        # 2) then 3): the pruned candidate pool depends on the profile
+        with stage("profile"):
+            profile = await _load_profile_concurrently(user_id)
+        with stage("candidates"):
+            cands = await _fetch_pool_async(db, shops, profile, weights, limit)
+    else:
+        # 2) + 3) User profile (category weights + seen items) and candidate
+        # products are independent once the shop ids are known
+        with stage("profile_candidates"):
+            profile, cands = await asyncio.gather(
+                _load_profile_concurrently(user_id),
+                _fetch_candidates_async(db, shop_ids),
+            )
+
+    # 4) CF score (in memory when the item index is loaded)
+    with stage("cf"):
+        cf = await _cf_scores_async(db, profile.seen_items, cands.ids)
+
+    # 5) User-CF (in memory, skipped when off or over budget)
+    with stage("user_cf"):
+        user_cf = user_cf_scores(user_id, cands.ids, weights)
+
+    # 6) Final scoring
+    with stage("score"):
+        recs = _rank_candidates(cands, shops, profile.category_weights, cf, radius_km, limit,
+                                weights=weights, user_cf=user_cf)
+    record_candidates(cands, cf)
+
+    return shops, recs
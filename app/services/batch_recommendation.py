@@ -0,0 +1,108 @@
+# app/services/batch_recommendation.py
+import os
+from collections import defaultdict
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.geo import snap_to_cell
+from app.services.recommendation_service import _fetch_candidates, _rank_candidates
+from app.services.scoring import get_weight_profile
+from app.services.shop_locator import PostgisShopLocator, get_shop_locator
+from app.services.similarity_index import ItemSimilarityIndex, get_item_index
+from app.services.user_cf import user_cf_scores
+from app.services.user_profile import get_user_profiles
+
+# Requests whose points fall in the same BATCH_CELL_DEG cell (and share a
+# radius) are scored together against one candidate fetch.
+BATCH_CELL_DEG = float(os.getenv("BATCH_CELL_DEG", "0.05"))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "1000"))
+# users per dense (users x candidates) CF block
+BATCH_CF_ROWS = int(os.getenv("BATCH_CF_ROWS", "256"))
+
+CF_BATCH_QUERY = text("""
+    SELECT item_id, similar_item_id, score
+    FROM item_similarity
+    WHERE item_id = ANY(:seen)
+    AND similar_item_id = ANY(:cands);
+""")
+
+
+def _batch_locator():
+    # per-request PostGIS round trips are what batching avoids: use a batch-local
+    # geo-cell cache instead, which loads each cell's shop superset once
+    locator = get_shop_locator()
+    if isinstance(locator, PostgisShopLocator):
+        from app.services.geo_cache import GeoCellCache
+        return GeoCellCache(cell_deg=BATCH_CELL_DEG, ttl_s=float("inf"), max_entries=1 << 20)
+    return locator
+
+
+def _cf_matrix(db: Session, seen_lists, candidate_ids):
+    """``(users, candidates)`` item-CF matrix, from the loaded index or one shared query."""
+    index = get_item_index()
+    if index is None:
+        seen = sorted({i for s in seen_lists for i in s})
+        if not seen or len(candidate_ids) == 0:
+            return np.zeros((len(seen_lists), len(candidate_ids)), dtype=np.float32)
+        rows = db.execute(CF_BATCH_QUERY, {"seen": seen, "cands": [int(c) for c in candidate_ids]}).fetchall()
+        arr = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        index = ItemSimilarityIndex.from_triplets(arr[:, 0], arr[:, 1], arr[:, 2])
+    return index.max_similarity_many(seen_lists, candidate_ids)
+
+
+def recommend_products_batch(db: Session, requests, limit=20):
+    """Score many ``(user_id, lat, lon, radius_km)`` requests together.
+
+    Yields ``(position, shops, recs)`` per request, grouped by geo cell rather
+    than in input order. Profiles of all users come from one query, each cell
+    fetches its candidates once, and item-CF is aggregated for all users of a
+    cell in one vectorized pass. Always uses the in-process scoring path.
+    """
+    weights = get_weight_profile()
+    locator = _batch_locator()
+    profiles = get_user_profiles(db, [r[0] for r in requests])
+
+    groups = defaultdict(list)
+    for pos, (user_id, lat, lon, radius_km) in enumerate(requests):
+        groups[(snap_to_cell(lat, lon, BATCH_CELL_DEG), float(radius_km))].append(pos)
+
+    for (_, radius_km), members in groups.items():
+        shops = [locator.nearby(db, requests[p][1], requests[p][2], radius_km) for p in members]
+        shop_ids = sorted({s["id"] for ss in shops for s in ss})
+        if not shop_ids:
+            for p in members:
+                yield p, [], []
+            continue
+
+        cands = _fetch_candidates(db, shop_ids)
+        for lo in range(0, len(members), BATCH_CF_ROWS):
+            block = members[lo:lo + BATCH_CF_ROWS]
+            cf = _cf_matrix(db, [profiles[int(requests[p][0])].seen_items for p in block], cands.ids)
+
+            for row, p in enumerate(block):
+                own_shops = shops[lo + row]
+                if not own_shops:
+                    yield p, [], []
+                    continue
+                user_id = int(requests[p][0])
+                own = np.flatnonzero(np.isin(cands.shop_ids, [s["id"] for s in own_shops]))
+                sub = cands.take(own)
+                user_cf = user_cf_scores(user_id, sub.ids, weights)
+                recs = _rank_candidates(sub, own_shops, profiles[user_id].category_weights,
+                                        cf[row, own].astype(np.float64), radius_km, limit,
+                                        weights=weights, user_cf=user_cf)
+                yield p, own_shops, recs
+
+
+def recommend_products_batch_results(db: Session, requests, limit=20, include_shops=False):
+    """:func:`recommend_products_batch` collected back into input order (for the API)."""
+    results = [None] * len(requests)
+    for p, shops, recs in recommend_products_batch(db, requests, limit):
+        user_id, lat, lon, _ = requests[p]
+        results[p] = {
+            "user_id": user_id, "lat": lat, "lon": lon,
+            "shops": shops if include_shops else None,
+            "recommended_products": recs,
+        }
+    return results
@@ -0,0 +1,197 @@
+# app/services/candidate_index.py
+import heapq
+import logging
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.scoring import TRENDING_SQL, WeightProfile, lookup, proximity_component
+
+logger = logging.getLogger(__name__)
+
+# Bounded candidate generation for the python engine: instead of scoring every
+# product of the nearby shops, pull products from per-(shop, category) lists
+# pre-ranked by trending until no unpulled product can reach the top `limit`.
+CANDIDATE_PRUNING_ENABLED = os.getenv("CANDIDATE_PRUNING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Pull at least this many products before the early stop may fire; absorbs
+# trending drift between the snapshot and the live rows that are re-scored.
+CANDIDATE_MIN_POOL = int(os.getenv("CANDIDATE_MIN_POOL", "200"))
+# Hard cap on products pulled per request (the stop is then approximate)
+CANDIDATE_MAX_POOL = int(os.getenv("CANDIDATE_MAX_POOL", "5000"))
+# How often (seconds) the snapshot is rebuilt from `products`; 0 disables
+CANDIDATE_REFRESH_S = float(os.getenv("CANDIDATE_REFRESH_S", "300"))
+# Products taken from a list per step of the merge
+CANDIDATE_BLOCK = 16
+
+CANDIDATE_SNAPSHOT_QUERY = text(f"""
+    SELECT p.id, p.shop_id, COALESCE(p.category_id, -1), COALESCE(p.trending_score, {TRENDING_SQL})
+    FROM products p;
+""")
+
+
+# ------------------------------
+# Pre-ranked lists
+# ------------------------------
+class CandidateIndex:
+    """Products grouped into (shop, category) lists, each sorted by trending.
+
+    Products are ordered by ``(shop, category, -trending)``: list ``j`` spans
+    ``product_ids[list_start[j]:list_start[j + 1]]`` and belongs to
+    ``list_category[j]``; the lists of shop ``shop_keys[i]`` are
+    ``shop_lists[i]:shop_lists[i + 1]``. A shop's trending ranking is the merge
+    of its category lists, which :meth:`retrieve` walks lazily.
+    """
+
+    def __init__(self, product_ids, shop_ids, category_ids, trending):
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        shop_ids = np.asarray(shop_ids, dtype=np.int64)
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        trending = np.asarray(trending, dtype=np.float64)
+
+        order = np.lexsort((product_ids, -trending, category_ids, shop_ids))
+        self.product_ids = product_ids[order].astype(np.int32)
+        self.trending = trending[order].astype(np.float32)
+        shops, cats = shop_ids[order], category_ids[order]
+
+        n = len(order)
+        new_list = np.ones(n, dtype=bool)
+        new_list[1:] = (shops[1:] != shops[:-1]) | (cats[1:] != cats[:-1])
+        starts = np.flatnonzero(new_list)
+        self.list_start = np.append(starts, n).astype(np.int64)
+        self.list_category = cats[starts]
+        list_shop = shops[starts]
+
+        new_shop = np.ones(len(starts), dtype=bool)
+        new_shop[1:] = list_shop[1:] != list_shop[:-1]
+        shop_first = np.flatnonzero(new_shop)
+        self.shop_keys = list_shop[shop_first]
+        self.shop_lists = np.append(shop_first, len(starts)).astype(np.int64)
+
+        # product id -> shop, for item-CF candidates
+        by_id = np.argsort(product_ids)
+        self._ids_sorted = product_ids[by_id].astype(np.int32)
+        self._shop_by_id = shop_ids[by_id].astype(np.int32)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    @classmethod
+    def from_db(cls, db: Session):
+        rows = db.execute(CANDIDATE_SNAPSHOT_QUERY).fetchall()
+        arr = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        return cls(arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3])
+
+    def in_shops(self, product_ids, shop_ids):
+        """The subset of ``product_ids`` that belongs to one of ``shop_ids``."""
+        ids = np.asarray(product_ids, dtype=np.int64)
+        if len(ids) == 0 or len(self._ids_sorted) == 0:
+            return ids[:0]
+        pos = np.searchsorted(self._ids_sorted, ids)
+        pos[pos >= len(self._ids_sorted)] = 0
+        known = self._ids_sorted[pos] == ids
+        return ids[known & np.isin(self._shop_by_id[pos], np.asarray(shop_ids, dtype=np.int64))]
+
+    def retrieve(self, shops, category_weights, weights: WeightProfile, limit, slack=0.0,
+                 min_pool=CANDIDATE_MIN_POOL, max_pool=CANDIDATE_MAX_POOL):
+        """Ids of the products that can still reach the top ``limit`` (threshold-algorithm stop).
+
+        For a product of list ``(s, c)`` the category, proximity and trending terms
+        are known here, so every list yields products in descending order of that
+        partial score. Lists are merged best-head-first until the ``limit``-th best
+        pulled score beats the best unpulled head plus ``slack`` (an upper bound of
+        the terms not known here, i.e. the user-CF weight). Item-CF is not bounded:
+        the caller adds the neighbors of the user's seen items explicitly.
+        """
+        if not shops or len(self.shop_keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        shop_ids = np.fromiter((s["id"] for s in shops), dtype=np.int64, count=len(shops))
+        dist = np.fromiter((s["distance_km"] for s in shops), dtype=np.float64, count=len(shops))
+        pos = np.searchsorted(self.shop_keys, shop_ids)
+        pos[pos >= len(self.shop_keys)] = 0
+        known = self.shop_keys[pos] == shop_ids
+        pos, dist = pos[known], dist[known]
+
+        lo = self.shop_lists[pos]
+        counts = self.shop_lists[pos + 1] - lo
+        lists = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        if len(lists) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        static = (weights.category * lookup(self.list_category[lists], category_weights)
+                  + weights.proximity * np.repeat(proximity_component(dist), counts))
+        starts = self.list_start[lists]
+        head = static + weights.trending * self.trending[starts].astype(np.float64)
+
+        static_l, ends_l = static.tolist(), self.list_start[lists + 1].tolist()
+        heap = list(zip((-head).tolist(), range(len(lists)), starts.tolist()))
+        heapq.heapify(heap)
+        best = []  # min-heap of the `limit` best partial scores pulled so far
+        pulled = []
+        n_pulled = 0
+        w_trending, trending = weights.trending, self.trending
+        while heap and n_pulled < max_pool:
+            neg_bound, k, p = heap[0]
+            if n_pulled >= min_pool and len(best) >= limit and best[0] >= slack - neg_bound:
+                break
+            q = min(p + CANDIDATE_BLOCK, ends_l[k])
+            for v in (static_l[k] + w_trending * trending[p:q].astype(np.float64)).tolist():
+                if len(best) < limit:
+                    heapq.heappush(best, v)
+                elif v > best[0]:
+                    heapq.heapreplace(best, v)
+            pulled.append(np.arange(p, q))
+            n_pulled += q - p
+            if q < ends_l[k]:
+                heapq.heapreplace(heap, (-(static_l[k] + w_trending * float(trending[q])), k, q))
+            else:
+                heapq.heappop(heap)
+        return self.product_ids[np.concatenate(pulled)].astype(np.int64)
+
+
+# ------------------------------
+# Process-wide snapshot (refreshed periodically)
+# ------------------------------
+_current = None
+_load_lock = threading.Lock()
+_refresher = None
+
+
+def get_candidate_index():
+    """The snapshot when pruning is enabled and loaded, else None (score every product)."""
+    return _current if CANDIDATE_PRUNING_ENABLED else None
+
+
+def set_candidate_index(index):
+    global _current
+    _current = index
+
+
+def load_candidate_index(db: Session):
+    with _load_lock:
+        # built before the swap; requests keep the snapshot they already hold
+        set_candidate_index(CandidateIndex.from_db(db))
+    return _current
+
+
+def _refresh(session_factory, interval):
+    while True:
+        time.sleep(interval)
+        db = session_factory()
+        try:
+            load_candidate_index(db)
+        except Exception:  # keep serving the previous snapshot
+            logger.exception("candidate index refresh failed")
+        finally:
+            db.close()
+
+
+def start_candidate_index_refresher(session_factory, interval=CANDIDATE_REFRESH_S):
+    global _refresher
+    if _refresher is not None or interval <= 0:
+        return
+    _refresher = threading.Thread(target=_refresh, args=(session_factory, interval),
+                                  name="candidate-index-refresher", daemon=True)
+    _refresher.start()
@@ -0,0 +1,292 @@
+# app/services/event_ingest.py
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy.sql import text
+
+from app.services.interaction_decay import upsert_category_scores
+from app.services.metrics import METRICS_ENABLED, inc, observe
+from app.services.response_cache import invalidate_user_responses
+from app.services.user_profile import invalidate_user_profile
+
+logger = logging.getLogger(__name__)
+
+# Write-behind ingestion of view / purchase events: requests append to an
+# in-memory buffer, a background thread writes it out in batches. One batch is
+# one transaction: multi-row inserts into the event tables plus one aggregated
+# counter UPDATE per touched product, so hot products take one row lock per batch.
+EVENT_FLUSH_MAX_BATCH = int(os.getenv("EVENT_FLUSH_MAX_BATCH", "1000"))
+EVENT_FLUSH_INTERVAL_S = float(os.getenv("EVENT_FLUSH_INTERVAL_S", "1.0"))
+# Events held in memory (buffered + being written) before new ones are refused
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "100000"))
+# Longest wait between retries of a failed flush
+EVENT_RETRY_MAX_S = float(os.getenv("EVENT_RETRY_MAX_S", "30"))
+
+# Events of unknown users / products are dropped here instead of failing the batch;
+# the inserted rows come back so the aggregates only count those
+INSERT_VIEWS_SQL = text("""
+    INSERT INTO product_view_events (user_id, product_id, created_at)
+    SELECT d.user_id, d.product_id, d.created_at
+    FROM unnest(CAST(:users AS integer[]), CAST(:products AS integer[]), CAST(:ts AS timestamptz[]))
+         AS d(user_id, product_id, created_at)
+    WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = d.user_id)
+    AND EXISTS (SELECT 1 FROM products p WHERE p.id = d.product_id)
+    RETURNING user_id, product_id, created_at;
+""")
+
+INSERT_PURCHASES_SQL = text("""
+    INSERT INTO purchase_events (user_id, product_id, quantity, price_at_purchase, created_at)
+    SELECT d.user_id, d.product_id, d.quantity, d.price, d.created_at
+    FROM unnest(CAST(:users AS integer[]), CAST(:products AS integer[]), CAST(:quantities AS integer[]),
+                CAST(:prices AS numeric[]), CAST(:ts AS timestamptz[]))
+         AS d(user_id, product_id, quantity, price, created_at)
+    WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = d.user_id)
+    AND EXISTS (SELECT 1 FROM products p WHERE p.id = d.product_id)
+    RETURNING user_id, product_id, quantity, price_at_purchase, created_at;
+""")
+
+# Per-product deltas of the inserted rows, applied in id order (concurrent flushers of
+# several workers then lock rows in the same order). Bumping updated_at lets
+# scripts/refresh_trending.py pick the products up.
+UPDATE_COUNTERS_SQL = text("""
+    UPDATE products p
+    SET daily_views = p.daily_views + d.views,
+        weekly_sales = p.weekly_sales + d.sales,
+        last_purchased_at = GREATEST(p.last_purchased_at, d.last_purchased_at),
+        updated_at = now()
+    FROM (
+        SELECT *
+        FROM unnest(CAST(:products AS integer[]), CAST(:views AS integer[]), CAST(:sales AS integer[]),
+                    CAST(:last_purchased AS timestamptz[]))
+             AS x(product_id, views, sales, last_purchased_at)
+        ORDER BY x.product_id
+    ) d
+    WHERE p.id = d.product_id;
+""")
+
+
+# ------------------------------
+# Batch writer
+# ------------------------------
+def counter_deltas(views, purchases):
+    """Per-product ``(views, units sold, last purchase time)`` of a batch, ordered by product id."""
+    deltas = defaultdict(lambda: [0, 0, None])
+    for _, product_id, _ in views:
+        deltas[product_id][0] += 1
+    for _, product_id, quantity, _, ts in purchases:
+        d = deltas[product_id]
+        d[1] += quantity
+        d[2] = ts if d[2] is None else max(d[2], ts)
+    return sorted((p, d[0], d[1], d[2]) for p, d in deltas.items())
+
+
+def write_events(db, views, purchases):
+    """Insert one batch and apply its counter / category-score deltas in a single transaction."""
+    if views:
+        views = db.execute(INSERT_VIEWS_SQL, {"users": [v[0] for v in views], "products": [v[1] for v in views],
+                                              "ts": [v[2] for v in views]}).fetchall()
+    if purchases:
+        purchases = db.execute(INSERT_PURCHASES_SQL, {
+            "users": [p[0] for p in purchases], "products": [p[1] for p in purchases],
+            "quantities": [p[2] for p in purchases], "prices": [p[3] for p in purchases],
+            "ts": [p[4] for p in purchases],
+        }).fetchall()
+    # same weights as the profile query: 1 per view, 2 per purchased unit
+    upsert_category_scores(db, [e[0] for e in views] + [e[0] for e in purchases],
+                           [e[1] for e in views] + [e[1] for e in purchases],
+                           [1.0] * len(views) + [2.0 * max(e[2], 1) for e in purchases],
+                           [e[2] for e in views] + [e[4] for e in purchases])
+    deltas = counter_deltas(views, purchases)
+    if deltas:
+        db.execute(UPDATE_COUNTERS_SQL, {"products": [d[0] for d in deltas], "views": [d[1] for d in deltas],
+                                         "sales": [d[2] for d in deltas],
+                                         "last_purchased": [d[3] for d in deltas]})
+    db.commit()
+
+
+# ------------------------------
+# Buffer + background flusher
+# ------------------------------
+class EventBuffer:
+    """Bounded in-memory event queue drained by one flusher thread.
+
+    ``add_*`` never touch the database: they return False when the buffer is
+    full (or stopped) and the caller should shed the request. The flusher wakes
+    when ``max_batch`` events are pending or ``interval_s`` after the oldest one
+    arrived. A failed batch is retried with backoff and keeps counting against
+    ``max_pending`` until it is written, so a database outage turns into
+    backpressure instead of lost events.
+    """
+
+    def __init__(self, session_factory, max_batch=EVENT_FLUSH_MAX_BATCH, interval_s=EVENT_FLUSH_INTERVAL_S,
+                 max_pending=EVENT_BUFFER_MAX, writer=write_events):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.interval_s = interval_s
+        self.max_pending = max_pending
+        self.writer = writer
+        self._views = []      # (user_id, product_id, created_at)
+        self._purchases = []  # (user_id, product_id, quantity, price, created_at)
+        self._inflight = 0    # events of the batch being written
+        self._oldest = None   # monotonic arrival time of the oldest buffered event
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self.written = 0
+        self.rejected = 0
+        self.failures = 0
+
+    def pending(self):
+        with self._cond:
+            return len(self._views) + len(self._purchases) + self._inflight
+
+    def _add(self, kind, event):
+        with self._cond:
+            if self._stopping or len(self._views) + len(self._purchases) + self._inflight >= self.max_pending:
+                self.rejected += 1
+                inc("events_rejected_total", kind=kind)
+                return False
+            # looked up under the lock: _take() swaps the lists out
+            (self._views if kind == "view" else self._purchases).append(event)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._views) + len(self._purchases) >= self.max_batch:
+                self._cond.notify()
+        inc("events_accepted_total", kind=kind)
+        return True
+
+    def add_view(self, user_id, product_id, created_at=None):
+        return self._add("view", (user_id, product_id, created_at or datetime.now(timezone.utc)))
+
+    def add_purchase(self, user_id, product_id, quantity=1, price=None, created_at=None):
+        event = (user_id, product_id, quantity, price, created_at or datetime.now(timezone.utc))
+        return self._add("purchase", event)
+
+    def _take(self):
+        """Swap out up to ``max_batch`` events (caller holds the lock)."""
+        n_views = min(len(self._views), self.max_batch)
+        views, self._views = self._views[:n_views], self._views[n_views:]
+        n_purchases = min(len(self._purchases), self.max_batch - n_views)
+        purchases, self._purchases = self._purchases[:n_purchases], self._purchases[n_purchases:]
+        self._inflight = len(views) + len(purchases)
+        self._oldest = time.monotonic() if self._views or self._purchases else None
+        return views, purchases
+
+    def _write(self, views, purchases):
+        t0 = time.perf_counter()
+        db = self.session_factory()
+        try:
+            self.writer(db, views, purchases)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if METRICS_ENABLED:
+            observe("events_flush_duration_seconds", time.perf_counter() - t0)
+        inc("events_written_total", len(views) + len(purchases))
+        # the users' next request must see the new events
+        for user_id in {e[0] for e in views} | {e[0] for e in purchases}:
+            invalidate_user_profile(user_id)
+            invalidate_user_responses(user_id)
+
+    def flush(self):
+        """Write everything buffered now, batch by batch (used on shutdown and by tests)."""
+        while True:
+            with self._cond:
+                if not self._views and not self._purchases:
+                    return
+                views, purchases = self._take()
+            try:
+                self._write(views, purchases)
+                self.written += len(views) + len(purchases)
+            except Exception:
+                with self._cond:
+                    self._views[:0], self._purchases[:0] = views, purchases
+                raise
+            finally:
+                with self._cond:
+                    self._inflight = 0
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    buffered = len(self._views) + len(self._purchases)
+                    if buffered >= self.max_batch:
+                        break
+                    if buffered and time.monotonic() - self._oldest >= self.interval_s:
+                        break
+                    self._cond.wait(self.interval_s if not buffered
+                                    else max(0.0, self._oldest + self.interval_s - time.monotonic()))
+                if self._stopping:
+                    return
+                views, purchases = self._take()
+            while True:
+                try:
+                    self._write(views, purchases)
+                    self.written += len(views) + len(purchases)
+                    backoff = 0.0
+                    break
+                except Exception:
+                    self.failures += 1
+                    inc("events_flush_failures_total")
+                    backoff = min(EVENT_RETRY_MAX_S, max(0.5, backoff * 2))
+                    logger.exception("event flush of %d events failed, retrying in %.1fs",
+                                     len(views) + len(purchases), backoff)
+                    with self._cond:
+                        if self._stopping:
+                            # hand the batch back so stop() makes a last attempt
+                            self._views[:0], self._purchases[:0] = views, purchases
+                            self._inflight = 0
+                            return
+                        self._cond.wait(backoff)
+            with self._cond:
+                self._inflight = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Refuse new events, let the flusher finish its batch, then write what is left."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("event flush on shutdown failed, %d events lost", self.pending())
+
+
+# ------------------------------
+# Process-wide buffer
+# ------------------------------
+_buffer = None
+
+
+def get_event_buffer():
+    return _buffer
+
+
+def start_event_buffer(session_factory, **kwargs):
+    global _buffer
+    if _buffer is None:
+        _buffer = EventBuffer(session_factory, **kwargs)
+        _buffer.start()
+    return _buffer
+
+
+def stop_event_buffer(timeout=30.0):
+    global _buffer
+    if _buffer is not None:
+        _buffer.stop(timeout)
+        _buffer = None
@@ -0,0 +1,90 @@
+# app/services/geo.py
+import math
+import numpy as np
+
+# WGS84 ellipsoid, the same one PostGIS uses for geography(POINT,4326)
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+EARTH_RADIUS_M = 6371008.8
+
+
+# ------------------------------
+# Distances
+# ------------------------------
+def geodesic_distance_m(lat, lon, lats, lons, max_iter=100, tol=1e-12):
+    """Ellipsoidal (Vincenty inverse) distance in meters from one point to many.
+
+    Matches PostGIS ``ST_Distance(geography, geography)`` (spheroid) to well
+    under a millimeter for the distances this service deals with.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    f, a, b = WGS84_F, WGS84_A, WGS84_B
+    L = np.radians(lons - lon)
+    U1 = math.atan((1 - f) * math.tan(math.radians(lat)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    sinU1, cosU1 = math.sin(U1), math.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    sin_sigma = cos_sigma = sigma = cos_sq_alpha = cos_2sm = None
+    for _ in range(max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sm = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos_sq_alpha)
+        C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lam_prev = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2))
+        )
+        if np.all(np.abs(lam - lam_prev) < tol):
+            break
+
+    u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2)
+        - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)
+    ))
+    return b * A * (sigma - delta_sigma)
+
+
+def haversine_distance_m(lat, lon, lats, lons):
+    """Spherical distance in meters; cheap, within ~0.5% of the ellipsoidal one."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+# ------------------------------
+# Grid cells
+# ------------------------------
+def snap_to_cell(lat: float, lon: float, cell_deg: float):
+    """Integer (row, col) of the lat/lon grid cell containing the point."""
+    return math.floor(lat / cell_deg), math.floor(lon / cell_deg)
+
+
+def cell_center(cell, cell_deg: float):
+    row, col = cell
+    return (row + 0.5) * cell_deg, (col + 0.5) * cell_deg
+
+
+def cell_radius_m(cell, cell_deg: float):
+    """Distance from the cell center to its farthest corner."""
+    row, col = cell
+    clat, clon = cell_center(cell, cell_deg)
+    corner_lats = np.array([row, row, row + 1, row + 1], dtype=np.float64) * cell_deg
+    corner_lons = np.array([col, col + 1, col, col + 1], dtype=np.float64) * cell_deg
+    return float(geodesic_distance_m(clat, clon, corner_lats, corner_lons).max())
@@ -0,0 +1,101 @@
+# app/services/geo_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.geo import cell_center, cell_radius_m, snap_to_cell
+from app.services.shop_locator import ShopColumns, ShopLocator, _wkt_point, get_shop_locator
+
+GEO_CACHE_CELL_DEG = float(os.getenv("GEO_CACHE_CELL_DEG", "0.01"))
+GEO_CACHE_TTL_S = float(os.getenv("GEO_CACHE_TTL_S", "60"))
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "4096"))
+
+# slack added to the cell radius so shops sitting exactly on the boundary are kept
+_MARGIN_M = 1.0
+
+
+class GeoCellCache(ShopLocator):
+    """Caches the shop candidate set per (grid cell, radius).
+
+    The candidate set for a cell is every shop within ``radius + cell radius``
+    of the cell center, so by the triangle inequality it contains every shop
+    within ``radius`` of any point in the cell. Exact distances are then
+    recomputed for the precise point. Entries expire after ``ttl_s`` which
+    bounds how stale the view of ``shops`` can get.
+    """
+
+    name = "geo_cache"
+
+    def __init__(self, cell_deg=GEO_CACHE_CELL_DEG, ttl_s=GEO_CACHE_TTL_S, max_entries=GEO_CACHE_MAX_ENTRIES):
+        self.cell_deg = cell_deg
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (cell, radius_m) -> (expires_at, ShopColumns)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def nearby(self, db: Session, lat: float, lon: float, radius_km: float):
+        radius_m = float(radius_km) * 1000
+        cell = snap_to_cell(lat, lon, self.cell_deg)
+        key = (cell, radius_m)
+
+        cands = self._get(key)
+        if cands is None:
+            cands = self._load(db, cell, radius_m)
+            self._put(key, cands)
+        return cands.nearest(lat, lon, radius_m)
+
+    def _load(self, db: Session, cell, radius_m):
+        clat, clon = cell_center(cell, self.cell_deg)
+        reach = radius_m + cell_radius_m(cell, self.cell_deg) + _MARGIN_M
+        q = text("""
+            SELECT s.id, s.name, s.address,
+                   ST_Y(ST_Transform(s.location::geometry, 4326)) AS lat,
+                   ST_X(ST_Transform(s.location::geometry, 4326)) AS lon
+            FROM shops s
+            WHERE ST_DWithin(s.location, ST_GeogFromText(:wkt), :radius);
+        """)
+        rows = db.execute(q, {
+            "wkt": _wkt_point(clon, clat),
+            "radius": reach,
+        }).mappings().all()
+        return ShopColumns(rows)
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _put(self, key, cands):
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, cands)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def refresh(self, db: Session | None = None):
+        self.clear()
+
+
+def invalidate_geo_cache():
+    """Drop all cached cells; call after writing to ``shops``."""
+    locator = get_shop_locator()
+    if isinstance(locator, GeoCellCache):
+        locator.clear()
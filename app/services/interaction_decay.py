@@ -0,0 +1,134 @@
+# app/services/interaction_decay.py
+import math
+import os
+import numpy as np
+from sqlalchemy.sql import text
+
+# Exponential time decay and a lookback window for interaction weights, shared by
+# the online profiles (category weights, seen items) and the offline trainers:
+# an event of age a weighs w * 2^(-a / half-life), events older than the window
+# are ignored. 0 disables either (the default: lifetime history, no decay).
+INTERACTION_HALF_LIFE_DAYS = float(os.getenv("INTERACTION_HALF_LIFE_DAYS", "0"))
+INTERACTION_WINDOW_DAYS = float(os.getenv("INTERACTION_WINDOW_DAYS", "0"))
+# Serve category weights from the incrementally maintained user_category_scores
+# table instead of aggregating the user's events on every profile load
+USER_CATEGORY_SCORES_ENABLED = os.getenv("USER_CATEGORY_SCORES_ENABLED", "false").lower() in ("1", "true", "yes")
+# Aggregates that decayed below this (a fraction of one view) are deleted
+USER_CATEGORY_MIN_SCORE = float(os.getenv("USER_CATEGORY_MIN_SCORE", "0.001"))
+
+
+# ------------------------------
+# Weights
+# ------------------------------
+def decay_rate(half_life_days=INTERACTION_HALF_LIFE_DAYS):
+    """Per-second rate ``r`` of ``exp(-r * age)``; 0 without decay."""
+    return math.log(2) / (half_life_days * 86400) if half_life_days > 0 else 0.0
+
+
+def window_seconds(window_days=INTERACTION_WINDOW_DAYS):
+    """Lookback window in seconds, or None for the whole history."""
+    return window_days * 86400 if window_days > 0 else None
+
+
+def decay_factor(age_s, half_life_days=INTERACTION_HALF_LIFE_DAYS):
+    """NumPy twin of :func:`decay_sql` for ages in seconds."""
+    age_s = np.maximum(np.asarray(age_s, dtype=np.float64), 0.0)
+    return np.exp(-decay_rate(half_life_days) * age_s)
+
+
+def decay_sql(column, ref="now()", half_life_days=INTERACTION_HALF_LIFE_DAYS):
+    """SQL factor ``exp(-r * age)`` of a timestamp column at ``ref``; ``1.0`` without decay."""
+    rate = decay_rate(half_life_days)
+    if rate == 0:
+        return "1.0"
+    return f"exp({-rate!r} * GREATEST(CAST(EXTRACT(EPOCH FROM {ref} - {column}) AS float8), 0))"
+
+
+def window_sql(column, ref="now()", window_days=INTERACTION_WINDOW_DAYS):
+    """SQL predicate keeping rows inside the lookback window; ``TRUE`` without one.
+
+    Rendered as a plain range on ``column`` so the ``(user_id, created_at DESC)``
+    indexes bound the scan.
+    """
+    seconds = window_seconds(window_days)
+    if seconds is None:
+        return "TRUE"
+    return f"{column} >= {ref} - make_interval(secs => {float(seconds)!r})"
+
+
+# ------------------------------
+# Incremental per-user category aggregates
+# ------------------------------
+# user_category_scores holds, per (user, category), the decayed sum of the
+# user's event weights as of ``as_of`` (same weights as the profile query). New
+# events are folded in by the event writer; the score read at time t is
+# score * decay(t - as_of).
+def _events_sql(where, ref):
+    return f"""
+        SELECT user_id, product_id, created_at, 1.0 * {decay_sql("created_at", ref)} AS weight
+        FROM product_view_events
+        WHERE {where}
+        UNION ALL
+        SELECT user_id, product_id, created_at, GREATEST(quantity, 1) * 2.0 * {decay_sql("created_at", ref)} AS weight
+        FROM purchase_events
+        WHERE {where}
+    """
+
+
+# ``weights`` are the raw event weights (1 per view, 2 * quantity per purchase);
+# rows are grouped and ordered so concurrent writers lock keys in one order
+UPSERT_CATEGORY_SCORES_SQL = text(f"""
+    INSERT INTO user_category_scores AS s (user_id, category_id, score, as_of)
+    SELECT d.user_id, p.category_id, SUM(d.weight * {decay_sql("d.created_at")}), now()
+    FROM unnest(CAST(:users AS integer[]), CAST(:products AS integer[]), CAST(:weights AS float8[]),
+                CAST(:ts AS timestamptz[]))
+         AS d(user_id, product_id, weight, created_at)
+    JOIN products p ON p.id = d.product_id
+    WHERE p.category_id IS NOT NULL
+    AND {window_sql("d.created_at")}
+    AND EXISTS (SELECT 1 FROM users u WHERE u.id = d.user_id)
+    GROUP BY d.user_id, p.category_id
+    ORDER BY d.user_id, p.category_id
+    ON CONFLICT (user_id, category_id) DO UPDATE
+    SET score = s.score * {decay_sql("s.as_of", "EXCLUDED.as_of")} + EXCLUDED.score,
+        as_of = EXCLUDED.as_of;
+""")
+
+# Full rebuild from the events inside the window
+REBUILD_CATEGORY_SCORES_SQL = text(f"""
+    INSERT INTO user_category_scores (user_id, category_id, score, as_of)
+    SELECT x.user_id, p.category_id, SUM(x.weight), CAST(:as_of AS timestamptz)
+    FROM ({_events_sql(window_sql("created_at", "CAST(:as_of AS timestamptz)"), "CAST(:as_of AS timestamptz)")}) x
+    JOIN products p ON p.id = x.product_id
+    WHERE p.category_id IS NOT NULL
+    GROUP BY x.user_id, p.category_id;
+""")
+
+# Subtract the events that left the window since the previous run: created_at in
+# [:since, :until). Decayed to :as_of like the stored scores.
+EXPIRE_CATEGORY_SCORES_SQL = text(f"""
+    UPDATE user_category_scores s
+    SET score = GREATEST(s.score * {decay_sql("s.as_of", "CAST(:as_of AS timestamptz)")} - e.score, 0),
+        as_of = CAST(:as_of AS timestamptz)
+    FROM (
+        SELECT x.user_id, p.category_id, SUM(x.weight) AS score
+        FROM ({_events_sql("created_at >= CAST(:since AS timestamptz) AND created_at < CAST(:until AS timestamptz)",
+                           "CAST(:as_of AS timestamptz)")}) x
+        JOIN products p ON p.id = x.product_id
+        WHERE p.category_id IS NOT NULL
+        GROUP BY x.user_id, p.category_id
+    ) e
+    WHERE s.user_id = e.user_id AND s.category_id = e.category_id;
+""")
+
+PRUNE_CATEGORY_SCORES_SQL = text(f"""
+    DELETE FROM user_category_scores
+    WHERE score * {decay_sql("as_of", "CAST(:as_of AS timestamptz)")} < :min_score;
+""")
+
+
+def upsert_category_scores(db, users, products, weights, created_at):
+    """Fold new events (parallel lists) into user_category_scores; no-op when disabled."""
+    if USER_CATEGORY_SCORES_ENABLED and users:
+        db.execute(UPSERT_CATEGORY_SCORES_SQL, {"users": users, "products": products, "weights": weights,
+                                                "ts": created_at})
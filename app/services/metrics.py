@@ -0,0 +1,222 @@
+# app/services/metrics.py
+import contextvars
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from sqlalchemy import event
+
+# Hot-path instrumentation: stage timers, counters and per-statement SQL timings.
+# Disabled by default; stage() and inc() are then a no-op context / early return.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+# Add a Server-Timing header (per-stage durations, SQL time) to every response
+SERVER_TIMING_ENABLED = METRICS_ENABLED and os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, upper bounds of the histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route and status"),
+    "reco_stage_duration_seconds": ("histogram", "Latency of each recommendation pipeline stage"),
+    "reco_db_statement_duration_seconds": ("histogram", "SQL statement latency by enclosing stage"),
+    "reco_requests_total": ("counter", "Product recommendation requests by serving path"),
+    "reco_candidates_total": ("counter", "Candidate products scored"),
+    "reco_cf_hits_total": ("counter", "Candidates with a non-zero item-CF score"),
+    "reco_pruned_candidates_total": ("counter", "Products pulled from the pre-ranked candidate lists"),
+    "events_accepted_total": ("counter", "Ingested events queued for writing, by kind"),
+    "events_rejected_total": ("counter", "Ingested events refused because the buffer was full"),
+    "events_written_total": ("counter", "Ingested events written to the database"),
+    "events_flush_failures_total": ("counter", "Failed event batch writes (retried)"),
+    "events_flush_duration_seconds": ("histogram", "Duration of one event batch write"),
+}
+
+
+# ------------------------------
+# Registry
+# ------------------------------
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> _Histogram
+_counters = {}    # (name, labels) -> float
+
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = _Histogram()
+        hist.observe(seconds)
+
+
+def inc(name, value=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        hists = {k: (list(h.buckets), h.sum, h.count) for k, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name in sorted({k[0] for k in hists} | {k[0] for k in counters}):
+        kind, doc = METRIC_HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {doc}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+        for (n, labels), (buckets, total, count) in sorted(hists.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, c in zip(LATENCY_BUCKETS, buckets):
+                cumulative += c
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "".join(line + "\n" for line in lines)
+
+
+# ------------------------------
+# Per-request trace + stage timers
+# ------------------------------
+class RequestTrace:
+    """Stage durations and SQL totals of one request (for Server-Timing)."""
+
+    __slots__ = ("stages", "db_s", "db_count")
+
+    def __init__(self):
+        self.stages = {}
+        self.db_s = 0.0
+        self.db_count = 0
+
+    def server_timing(self, total_s):
+        parts = [f"{name};dur={s * 1000:.2f}" for name, s in self.stages.items()]
+        parts.append(f'db;dur={self.db_s * 1000:.2f};desc="{self.db_count} queries"')
+        parts.append(f"total;dur={total_s * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_trace = contextvars.ContextVar("reco_trace", default=None)
+_stage = contextvars.ContextVar("reco_stage", default=None)
+_NOOP = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("name", "t0", "token")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.token = _stage.set(self.name)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        _stage.reset(self.token)
+        observe("reco_stage_duration_seconds", elapsed, stage=self.name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages[self.name] = trace.stages.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name):
+    """``with stage("candidates"): ...`` times a pipeline stage (no-op when disabled)."""
+    return _Stage(name) if METRICS_ENABLED else _NOOP
+
+
+# ------------------------------
+# SQL statement timings
+# ------------------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_t0"].pop()
+    # labelled by the pipeline stage it runs in; statements outside a stage are "other"
+    observe("reco_db_statement_duration_seconds", elapsed, stage=_stage.get() or "other")
+    trace = _trace.get()
+    if trace is not None:
+        trace.db_s += elapsed
+        trace.db_count += 1
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("metrics_t0"):
+        conn.info["metrics_t0"].pop()
+
+
+def instrument_engine(engine):
+    """Time every statement of a (sync) engine; pass ``async_engine.sync_engine`` for asyncpg."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# ------------------------------
+# HTTP middleware
+# ------------------------------
+async def metrics_middleware(request, call_next):
+    trace = RequestTrace()
+    token = _trace.set(trace)
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _trace.reset(token)
+    elapsed = time.perf_counter() - t0
+    route = request.scope.get("route")
+    observe("http_request_duration_seconds", elapsed, method=request.method,
+            route=getattr(route, "path", "unmatched"), status=response.status_code)
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = trace.server_timing(elapsed)
+    return response
@@ -0,0 +1,133 @@
+# app/services/model_artifact.py
+import os
+import struct
+import zlib
+import numpy as np
+
+# Binary neighbor artifact ("*.knn"), little-endian, laid out so that every
+# section can be mapped straight into a NumPy array:
+#
+#   header (HEADER_SIZE bytes, see _HEADER)
+#   keys         int32[n_keys]      sorted ids of the rows (items or users)
+#   indptr       int64[n_keys + 1]  CSR row pointers into the neighbor arrays
+#   neighbor_ids int32[nnz]
+#   scores       float32[nnz]
+#   aux          float32[nnz]       optional second score per neighbor (format 2)
+#
+# Each section starts on a SECTION_ALIGN boundary. The header carries the
+# section offsets and a CRC32 of everything after the header, so a truncated
+# or half-copied file is rejected instead of serving garbage.
+MAGIC = b"RKNNIDX\0"
+FORMAT_VERSION = 2
+READABLE_FORMATS = (1, 2)
+HEADER_SIZE = 256
+SECTION_ALIGN = 64
+KINDS = {"item": 1, "user": 2, "user_topn": 3}
+
+# magic, format, kind, n_keys, nnz, 4 section offsets, crc32, model version (utf-8, NUL padded),
+# aux section offset (0 = no aux section; format 1 headers read it as 0 from the padding)
+_HEADER = struct.Struct("<8sIIQQQQQQI64sQ")
+_SECTIONS = (
+    ("keys", np.dtype("<i4")),
+    ("indptr", np.dtype("<i8")),
+    ("neighbor_ids", np.dtype("<i4")),
+    ("scores", np.dtype("<f4")),
+    ("aux", np.dtype("<f4")),
+)
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def _align(offset):
+    return (offset + SECTION_ALIGN - 1) // SECTION_ALIGN * SECTION_ALIGN
+
+
+def _layout(n_keys, nnz, has_aux=False):
+    counts = {"keys": n_keys, "indptr": n_keys + 1, "neighbor_ids": nnz, "scores": nnz}
+    if has_aux:
+        counts["aux"] = nnz
+    offsets, pos = {}, HEADER_SIZE
+    for name, dtype in _SECTIONS:
+        if name not in counts:
+            continue
+        pos = _align(pos)
+        offsets[name] = pos
+        pos += counts[name] * dtype.itemsize
+    return counts, offsets, pos
+
+
+def write_artifact(path, kind, keys, indptr, neighbor_ids, scores, version=None, aux=None):
+    """Write a neighbor artifact atomically (temp file + rename)."""
+    arrays = {
+        "keys": np.ascontiguousarray(keys, dtype="<i4"),
+        "indptr": np.ascontiguousarray(indptr, dtype="<i8"),
+        "neighbor_ids": np.ascontiguousarray(neighbor_ids, dtype="<i4"),
+        "scores": np.ascontiguousarray(scores, dtype="<f4"),
+    }
+    if aux is not None:
+        arrays["aux"] = np.ascontiguousarray(aux, dtype="<f4")
+    n_keys, nnz = len(arrays["keys"]), len(arrays["neighbor_ids"])
+    _, offsets, _ = _layout(n_keys, nnz, has_aux=aux is not None)
+
+    path = os.fspath(path)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    crc = 0
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * HEADER_SIZE)
+        for name in offsets:
+            pad = b"\0" * (offsets[name] - f.tell())
+            data = memoryview(arrays[name]).cast("B")
+            crc = zlib.crc32(data, zlib.crc32(pad, crc))
+            f.write(pad)
+            f.write(data)
+        # the header goes in last, once the checksum of the sections is known
+        f.seek(0)
+        f.write(_HEADER.pack(
+            MAGIC, FORMAT_VERSION, KINDS[kind], n_keys, nnz,
+            *(offsets[name] for name, _ in _SECTIONS[:4]),
+            crc, (version or "").encode()[:64], offsets.get("aux", 0),
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_artifact(path, kind=None, verify=True):
+    """Map an artifact read-only; returns ``(arrays, version)``.
+
+    The arrays are ``np.memmap`` views, so every process mapping the same file
+    shares one copy through the page cache.
+    """
+    path = os.fspath(path)
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < _HEADER.size:
+        raise ArtifactError(f"{path}: truncated header")
+    magic, fmt, kind_code, n_keys, nnz, *rest = _HEADER.unpack_from(raw)
+    offsets = dict(zip((name for name, _ in _SECTIONS), rest[:4]))
+    crc, version, aux_offset = rest[4], rest[5].rstrip(b"\0").decode() or None, rest[6]
+    if aux_offset:
+        offsets["aux"] = aux_offset
+    if magic != MAGIC:
+        raise ArtifactError(f"{path}: not a neighbor artifact")
+    if fmt not in READABLE_FORMATS:
+        raise ArtifactError(f"{path}: unsupported format version {fmt}")
+    if kind is not None and kind_code != KINDS[kind]:
+        raise ArtifactError(f"{path}: expected a {kind} artifact")
+
+    counts, expected, size = _layout(n_keys, nnz, has_aux=bool(aux_offset))
+    if offsets != expected or os.path.getsize(path) != size:
+        raise ArtifactError(f"{path}: size or layout does not match its header")
+
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if verify and zlib.crc32(mm[HEADER_SIZE:]) != crc:
+        raise ArtifactError(f"{path}: checksum mismatch")
+    arrays = {}
+    for name, dtype in _SECTIONS:
+        if name not in offsets:
+            continue
+        start = offsets[name]
+        arrays[name] = mm[start:start + counts[name] * dtype.itemsize].view(dtype)
+    return arrays, version
@@ -0,0 +1,164 @@
+# app/services/pushdown_engine.py
+from sqlalchemy import JSON
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.interaction_decay import decay_sql, window_sql
+from app.services.scoring import TRENDING_SQL, WeightProfile, get_weight_profile
+from app.services.shop_locator import NEARBY_SHOPS_LIMIT, _wkt_point
+
+# The whole hybrid pipeline as one statement: nearby shops, user events,
+# category affinity, candidates, CF max-similarity, user-CF (only when its
+# weight is positive) and scoring all run server-side, and a single row comes
+# back holding the shops and the top `limit` products (with their score
+# components) as JSON arrays.
+PUSHDOWN_QUERY = text(f"""
+    WITH nearby AS (
+        SELECT s.id, s.name, s.address,
+               ST_Distance(s.location, ST_GeogFromText(:wkt)) AS distance_m,
+               ST_Y(ST_Transform(s.location::geometry, 4326)) AS lat,
+               ST_X(ST_Transform(s.location::geometry, 4326)) AS lon
+        FROM shops s
+        WHERE ST_DWithin(s.location, ST_GeogFromText(:wkt), :radius)
+        ORDER BY distance_m, s.id
+        LIMIT :shop_limit
+    ),
+    shop_dist AS (
+        SELECT id, round((distance_m / 1000)::numeric, 3)::float8 AS distance_km
+        FROM nearby
+    ),
+    events AS (
+        SELECT product_id, 1.0 * {decay_sql("created_at")} AS weight
+        FROM product_view_events
+        WHERE user_id = :u AND {window_sql("created_at")}
+        UNION ALL
+        SELECT product_id, GREATEST(quantity, 1) * 2.0 * {decay_sql("created_at")} AS weight
+        FROM purchase_events
+        WHERE user_id = :u AND {window_sql("created_at")}
+    ),
+    cat_raw AS (
+        SELECT p.category_id, SUM(e.weight) AS score
+        FROM events e
+        JOIN products p ON p.id = e.product_id
+        WHERE p.category_id IS NOT NULL
+        GROUP BY p.category_id
+    ),
+    cat AS (
+        SELECT category_id, (score / MAX(score) OVER ())::float8 AS weight
+        FROM cat_raw
+    ),
+    cands AS (
+        SELECT p.id, p.name, p.category_id, p.shop_id,
+               COALESCE(p.trending_score, {TRENDING_SQL}) AS trending,
+               1.0 / (1.0 + (d.distance_km / 0.5)) AS proximity
+        FROM products p
+        JOIN shop_dist d ON d.id = p.shop_id
+    ),
+    cf AS (
+        SELECT sim.similar_item_id AS id, MAX(sim.score) AS cf
+        FROM item_similarity sim
+        WHERE sim.item_id IN (SELECT DISTINCT product_id FROM events)
+          AND sim.similar_item_id IN (SELECT id FROM cands)
+        GROUP BY sim.similar_item_id
+    ),
+    ucf_nbrs AS (
+        SELECT us.similar_user_id AS uid, us.score
+        FROM user_similarity us
+        WHERE CAST(:w_user_cf AS float8) > 0
+          AND us.user_id = :u AND us.score > 0
+    ),
+    ucf_pairs AS (
+        SELECT n.uid, e.product_id, n.score
+        FROM ucf_nbrs n JOIN product_view_events e ON e.user_id = n.uid
+        WHERE {window_sql("e.created_at")}
+        UNION
+        SELECT n.uid, e.product_id, n.score
+        FROM ucf_nbrs n JOIN purchase_events e ON e.user_id = n.uid
+        WHERE {window_sql("e.created_at")}
+    ),
+    ucf AS (
+        SELECT p.product_id AS id,
+               LEAST(SUM(p.score) / NULLIF((SELECT SUM(score) FROM ucf_nbrs), 0), 1.0)::float8 AS user_cf
+        FROM ucf_pairs p
+        WHERE p.product_id IN (SELECT id FROM cands)
+        GROUP BY p.product_id
+    ),
+    scored AS (
+        SELECT c.id, c.name, c.category_id, c.shop_id,
+               COALESCE(cat.weight, 0) AS category,
+               c.trending,
+               c.proximity,
+               COALESCE(cf.cf, 0) AS cf,
+               COALESCE(ucf.user_cf, 0) AS user_cf,
+               CAST(:w_category AS float8) * COALESCE(cat.weight, 0)
+                 + CAST(:w_trending AS float8) * c.trending
+                 + CAST(:w_proximity AS float8) * c.proximity
+                 + CAST(:w_cf AS float8) * COALESCE(cf.cf, 0)
+                 + CAST(:w_user_cf AS float8) * COALESCE(ucf.user_cf, 0) AS score
+        FROM cands c
+        LEFT JOIN cat ON cat.category_id = c.category_id
+        LEFT JOIN cf ON cf.id = c.id
+        LEFT JOIN ucf ON ucf.id = c.id
+    ),
+    top AS (
+        SELECT * FROM scored
+        ORDER BY score DESC, id
+        LIMIT :limit
+    )
+    SELECT
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'id', n.id, 'name', n.name, 'address', n.address,
+                    'distance_km', d.distance_km, 'latitude', n.lat, 'longitude', n.lon)
+                 ORDER BY n.distance_m, n.id), '[]'::json)
+         FROM nearby n JOIN shop_dist d ON d.id = n.id) AS shops,
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'product_id', t.id, 'product_name', t.name, 'shop_id', t.shop_id,
+                    'category_id', t.category_id, 'score', t.score, 'cf_score', t.cf, 'user_cf_score', t.user_cf,
+                    'category', t.category, 'trending', t.trending, 'proximity', t.proximity)
+                 ORDER BY t.score DESC, t.id), '[]'::json)
+         FROM top t) AS products;
+""").columns(shops=JSON, products=JSON)
+
+
+def recommend_products_pushdown(db: Session, user_id: int, lat: float, lon: float, radius_km: float = 5.0,
+                                limit=20, weights: WeightProfile | None = None, with_components=False):
+    """Single round-trip variant of ``recommend_products_hybrid`` (PostGIS + item_similarity).
+
+    Returns the same ``(shops, recs)`` pair; with ``with_components`` each rec also
+    carries its ``category``/``trending``/``proximity`` terms.
+    """
+    weights = weights or get_weight_profile()
+    row = db.execute(PUSHDOWN_QUERY, {
+        "wkt": _wkt_point(lon, lat),
+        "radius": float(radius_km) * 1000,
+        "shop_limit": NEARBY_SHOPS_LIMIT,
+        "u": user_id,
+        "limit": int(limit),
+        "w_category": weights.category,
+        "w_trending": weights.trending,
+        "w_proximity": weights.proximity,
+        "w_cf": weights.cf,
+        "w_user_cf": weights.user_cf,
+    }).one()
+
+    shops = row.shops or []
+    if not shops:
+        return [], []
+
+    recs = []
+    for r in row.products or []:
+        rec = {
+            "product_id": r["product_id"],
+            "product_name": r["product_name"],
+            "shop_id": r["shop_id"],
+            "category_id": r["category_id"],
+            "score": float(r["score"]),
+            "cf_score": float(r["cf_score"]),
+            "user_cf_score": float(r["user_cf_score"]) if weights.user_cf > 0 else None,
+        }
+        if with_components:
+            rec["category"] = float(r["category"])
+            rec["trending"] = float(r["trending"])
+            rec["proximity"] = float(r["proximity"])
+        recs.append(rec)
+    return shops, recs
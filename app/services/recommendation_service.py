@@ -1,172 +1,272 @@
 # app/services/recommendation_service.py
-import math
+import os
+import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import text
-from collections import defaultdict
 
+from app.services.candidate_index import get_candidate_index
+from app.services.metrics import inc, stage
+from app.services.pushdown_engine import recommend_products_pushdown
+from app.services.response_cache import get_response_cache
+from app.services.scoring import (
+    COMPONENTS,
+    TRENDING_SQL,
+    WeightProfile,
+    get_weight_profile,
+    lookup,
+    proximity_component,
+    score,
+    top_k,
+)
+from app.services.shop_locator import get_shop_locator
+from app.services.similarity_index import get_item_index
+from app.services.user_cf import user_cf_scores
+from app.services.user_profile import get_user_profile
+from app.services.user_topn import TOPN_CANDIDATES_QUERY, topn_params, user_topn_entry
 
-# ------------------------------
-# Utility functions
-# ------------------------------
-def _wkt_point(lon: float, lat: float) -> str:
-    return f"SRID=4326;POINT({lon} {lat})"
-
-def _trending_score(daily_views, weekly_sales):
-    return math.log1p(daily_views or 0) + math.log1p(weekly_sales or 0)
-
-def _proximity_factor(distance_km: float) -> float:
-    return 1.0 / (1.0 + (distance_km / 0.5))
+# python: shops, profile and candidates are fetched and scored in-process (default)
+# pushdown: the whole pipeline runs as one SQL statement (PostGIS locator only)
+RECO_ENGINE = os.getenv("RECO_ENGINE", "python").lower()
+if RECO_ENGINE not in ("python", "pushdown"):
+    raise ValueError(f"Unknown RECO_ENGINE '{RECO_ENGINE}' (expected python or pushdown)")
 
 
 # ------------------------------
-# Nearby shops (PostGIS)
+# Nearby shops
 # ------------------------------
 def get_nearby_shops_service(db: Session, lat: float, lon: float, radius_km: float = 5.0):
-    q = text("""
-        SELECT s.id, s.name, s.address,
-               ST_Distance(s.location, ST_GeogFromText(:wkt)) AS distance_m,
-               ST_Y(ST_Transform(s.location::geometry, 4326)) AS lat,
-               ST_X(ST_Transform(s.location::geometry, 4326)) AS lon
-        FROM shops s
-        WHERE ST_DWithin(s.location, ST_GeogFromText(:wkt), :radius)
-        ORDER BY distance_m
-        LIMIT 200;
-    """)
-
-    rows = db.execute(q, {
-        "wkt": _wkt_point(lon, lat),
-        "radius": float(radius_km) * 1000
-    }).mappings().all()
-
-    out = []
-    for r in rows:
-        out.append({
-            "id": r["id"],
-            "name": r["name"],
-            "address": r["address"],
-            "distance_km": round(float(r["distance_m"]) / 1000, 3),
-            "latitude": float(r["lat"]),
-            "longitude": float(r["lon"])
-        })
-    return out
+    # PostGIS by default; SHOP_LOCATOR selects the grid index or the geo-cell cache
+    return get_shop_locator().nearby(db, lat, lon, radius_km)
 
 
 # ------------------------------
 # User category preferences
 # ------------------------------
 def get_user_top_categories(db: Session, user_id: int):
-    q = text("""
-        WITH views AS (
-            SELECT p.category_id, COUNT(*)::float AS score
-            FROM product_view_events e
-            JOIN products p ON p.id = e.product_id
-            WHERE e.user_id = :u AND p.category_id IS NOT NULL
-            GROUP BY p.category_id
-        ),
-        purchases AS (
-            SELECT p.category_id, SUM(GREATEST(pe.quantity, 1)) * 2.0 AS score
-            FROM purchase_events pe
-            JOIN products p ON p.id = pe.product_id
-            WHERE pe.user_id = :u AND p.category_id IS NOT NULL
-            GROUP BY p.category_id
-        ),
-        merged AS (
-            SELECT category_id, SUM(score) AS score
-            FROM (
-                SELECT * FROM views
-                UNION ALL
-                SELECT * FROM purchases
-            ) x
-            GROUP BY category_id
-        )
-        SELECT category_id, score
-        FROM merged
-        ORDER BY score DESC;
-    """)
-
-    rows = db.execute(q, {"u": user_id}).fetchall()
-    if not rows:
-        return {}
-
-    max_score = max(r[1] for r in rows)
-    return {r[0]: float(r[1]) / max_score for r in rows}
+    # category_id -> weight normalized to the user's strongest category
+    return get_user_profile(db, user_id).category_weights
 
 
 # ------------------------------
 # Hybrid product recommender
 # ------------------------------
+class CandidateColumns:
+    """Candidate products as parallel columns (one entry per product)."""
+
+    __slots__ = ("ids", "names", "category_ids", "shop_ids", "trending")
+
+    def __init__(self, rows):
+        n = len(rows)
+        self.ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+        self.names = [r[1] for r in rows]
+        # -1 stands in for a NULL category so the column stays integral
+        self.category_ids = np.fromiter((-1 if r[2] is None else r[2] for r in rows), dtype=np.int64, count=n)
+        self.shop_ids = np.fromiter((r[3] for r in rows), dtype=np.int64, count=n)
+        # already squashed to t / (1 + t)
+        self.trending = np.fromiter((r[4] for r in rows), dtype=np.float64, count=n)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, idx):
+        """Subset of the candidates at positions ``idx``."""
+        sub = object.__new__(CandidateColumns)
+        sub.ids = self.ids[idx]
+        sub.names = [self.names[i] for i in idx]
+        sub.category_ids = self.category_ids[idx]
+        sub.shop_ids = self.shop_ids[idx]
+        sub.trending = self.trending[idx]
+        return sub
+
+
+# trending_score is precomputed by scripts/refresh_trending.py; rows it has
+# not reached yet are computed inline
+CANDIDATES_QUERY = text(f"""
+    SELECT p.id,
+           p.name,
+           p.category_id,
+           p.shop_id,
+           COALESCE(p.trending_score, {TRENDING_SQL}) AS trending
+    FROM products p
+    WHERE p.shop_id = ANY(:shops);
+""")
+
+CF_QUERY = text("""
+    SELECT similar_item_id AS cid, MAX(score) AS sc
+    FROM item_similarity
+    WHERE similar_item_id = ANY(:cands)
+    AND item_id = ANY(:seen)
+    GROUP BY similar_item_id;
+""")
+
+
+def _fetch_candidates(db: Session, shop_ids):
+    return CandidateColumns(db.execute(CANDIDATES_QUERY, {"shops": shop_ids}).fetchall())
+
+
+def _candidate_pool(shops, profile, weights: WeightProfile, limit):
+    """Ids of a bounded candidate set, or None to score every product of the nearby shops.
+
+    Pre-ranked list products that can reach the top ``limit`` plus the item-CF
+    neighbors of the user's seen items that sit in the nearby shops. Needs the
+    in-memory item index: without it the CF candidates are unknown.
+    """
+    index, item_index = get_candidate_index(), get_item_index()
+    if index is None or item_index is None:
+        return None
+    pool = index.retrieve(shops, profile.category_weights, weights, limit, slack=weights.user_cf)
+    cf_ids = index.in_shops(item_index.neighbors(profile.seen_items), [s["id"] for s in shops])
+    inc("reco_pruned_candidates_total", len(pool))
+    return np.union1d(pool, cf_ids)
+
+
+def _pool_params(pool, shop_ids):
+    # products are re-read live, so a product moved to another shop since the snapshot drops out
+    return {"ids": [int(i) for i in pool], "shops": shop_ids}
+
+
+def _cf_from_index(seen, candidate_ids):
+    """CF scores from the in-memory index, or None when no index is loaded."""
+    if len(candidate_ids) == 0 or not seen:
+        return np.zeros(len(candidate_ids), dtype=np.float64)
+    index = get_item_index()
+    if index is None:
+        return None
+    sims, _ = index.max_similarity(seen, candidate_ids)
+    return sims.astype(np.float64)
+
+
+def _cf_params(seen, candidate_ids):
+    return {"cands": [int(c) for c in candidate_ids], "seen": list(seen)}
+
+
+def _cf_from_rows(candidate_ids, sim_rows):
+    return lookup(candidate_ids, {r[0]: float(r[1]) for r in sim_rows})
+
+
+def _cf_scores(db: Session, seen, candidate_ids):
+    """Max item-item similarity of each candidate to the user's seen items."""
+    cf = _cf_from_index(seen, candidate_ids)
+    if cf is None:
+        sim_rows = db.execute(CF_QUERY, _cf_params(seen, candidate_ids)).fetchall()
+        cf = _cf_from_rows(candidate_ids, sim_rows)
+    return cf
+
+
+def _rank_candidates(cands: CandidateColumns, shops, user_cat_weights, cf, radius_km, limit,
+                     weights: WeightProfile | None = None, user_cf=None, category=None):
+    weights = weights or get_weight_profile()
+    dist_by_shop = {s["id"]: s["distance_km"] for s in shops}
+
+    components = np.empty((len(cands), len(COMPONENTS)), dtype=np.float64)
+    # a precomputed per-candidate category column (top-N store) replaces the lookup
+    components[:, 0] = lookup(cands.category_ids, user_cat_weights) if category is None else category
+    components[:, 1] = cands.trending
+    components[:, 2] = proximity_component(lookup(cands.shop_ids, dist_by_shop, default=radius_km))
+    components[:, 3] = cf
+    # user-CF is optional: None when its weight is 0, no model is loaded or it was dropped under load
+    components[:, 4] = 0.0 if user_cf is None else user_cf
+    scores = score(components, weights)
+
+    recs = []
+    for i in top_k(scores, limit):
+        cat = int(cands.category_ids[i])
+        recs.append({
+            "product_id": int(cands.ids[i]),
+            "product_name": cands.names[i],
+            "shop_id": int(cands.shop_ids[i]),
+            "category_id": None if cat < 0 else cat,
+            "score": float(scores[i]),
+            "cf_score": float(cf[i]),
+            "user_cf_score": None if user_cf is None else float(user_cf[i]),
+        })
+    return recs
+
+
+def _rank_topn(cands: CandidateColumns, entry, shops, radius_km, limit, weights, user_cf=None):
+    """Re-rank stored top-N candidates: stored category/CF terms plus live trending and proximity."""
+    ids, category, cf = entry
+    stored = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(stored)
+    pos = order[np.searchsorted(stored, cands.ids, sorter=order)]
+    return _rank_candidates(cands, shops, None, cf[pos].astype(np.float64), radius_km, limit,
+                            weights=weights, user_cf=user_cf, category=category[pos].astype(np.float64))
+
+
 def recommend_products_hybrid(db: Session, user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit=20):
+    cache = get_response_cache()
+    if cache is None:
+        return _recommend_products(db, user_id, lat, lon, radius_km, limit)
+    # computed at the cell center so every request sharing the key gets the same answer
+    key, (clat, clon) = cache.key(user_id, lat, lon, radius_km, limit)
+    return cache.get_or_compute(key, lambda: _recommend_products(db, user_id, clat, clon, radius_km, limit))
+
+
+def _recommend_products(db: Session, user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit=20):
+    if RECO_ENGINE == "pushdown":
+        inc("reco_requests_total", path="pushdown")
+        with stage("pushdown"):
+            return recommend_products_pushdown(db, user_id, lat, lon, radius_km, limit)
+    return recommend_products_python(db, user_id, lat, lon, radius_km, limit)
+
+
+def record_candidates(cands, cf):
+    # candidates scored and how many of them the item-CF channel had an opinion on
+    inc("reco_candidates_total", len(cands))
+    inc("reco_cf_hits_total", int(np.count_nonzero(cf)))
+
+
+def recommend_products_python(db: Session, user_id: int, lat: float, lon: float, radius_km: float = 5.0, limit=20):
     # 1) Nearby shops
-    shops = get_nearby_shops_service(db, lat, lon, radius_km)
+    with stage("shops"):
+        shops = get_nearby_shops_service(db, lat, lon, radius_km)
     if not shops:
+        inc("reco_requests_total", path="no_shops")
         return [], []
 
     shop_ids = [s["id"] for s in shops]
-    dist_by_shop = {s["id"]: s["distance_km"] for s in shops}
+    weights = get_weight_profile()
 
-    # 2) User category preference
-    user_cat_weights = get_user_top_categories(db, user_id)
+    # Returning users: re-rank their precomputed top-N inside the nearby shops.
+    # Too few of them nearby -> fall through to the live path.
+    entry = user_topn_entry(user_id)
+    if entry is not None:
+        with stage("topn_candidates"):
+            cands = CandidateColumns(db.execute(TOPN_CANDIDATES_QUERY, topn_params(entry, shop_ids)).fetchall())
+        if len(cands) >= limit:
+            inc("reco_requests_total", path="topn")
+            with stage("user_cf"):
+                user_cf = user_cf_scores(user_id, cands.ids, weights)
+            with stage("score"):
+                recs = _rank_topn(cands, entry, shops, radius_km, limit, weights, user_cf)
+            inc("reco_candidates_total", len(cands))
+            return shops, recs
+    inc("reco_requests_total", path="live")
 
-    # 3) Candidate products (in nearby shops)
-    q = text("""
-        SELECT p.id,
-               p.name,
-               p.category_id,
-               p.shop_id,
-               COALESCE(p.daily_views,0)  AS daily_views,
-               COALESCE(p.weekly_sales,0) AS weekly_sales
-        FROM products p
-        WHERE p.shop_id = ANY(:shops);
-    """)
+    # 2) User category preference (profile is cached and reused by the CF step)
+    with stage("profile"):
+        profile = get_user_profile(db, user_id)
 
-    rows = db.execute(q, {"shops": shop_ids}).mappings().all()
-    candidate_ids = [r["id"] for r in rows]
+    # 3) Candidate products (in nearby shops); a bounded pre-ranked pool when pruning is on
+    with stage("candidates"):
+        pool = _candidate_pool(shops, profile, weights, limit)
+        if pool is None:
+            cands = _fetch_candidates(db, shop_ids)
+        else:
+            cands = CandidateColumns(db.execute(TOPN_CANDIDATES_QUERY, _pool_params(pool, shop_ids)).fetchall())
 
     # 4) CF score via stored KNN similarities
-    cf_scores = {}
-    if candidate_ids:
-        sim_q = text("""
-            SELECT similar_item_id AS cid, MAX(score) AS sc
-            FROM item_similarity
-            WHERE similar_item_id = ANY(:cands)
-            AND item_id IN (
-                SELECT product_id FROM product_view_events WHERE user_id = :u
-                UNION
-                SELECT product_id FROM purchase_events WHERE user_id = :u
-            )
-            GROUP BY similar_item_id;
-        """)
-        sim_rows = db.execute(sim_q, {"cands": candidate_ids, "u": user_id}).fetchall()
-        cf_scores = {r[0]: float(r[1]) for r in sim_rows}
-
-    # 5) Final scoring
-    recs = []
-    for r in rows:
-        pid = r["id"]
-        cat = r["category_id"]
-        shop = r["shop_id"]
-
-        cat_score = user_cat_weights.get(cat, 0.0)
-        trending = _trending_score(r["daily_views"], r["weekly_sales"])
-        prox = _proximity_factor(dist_by_shop.get(shop, radius_km))
-        cf = cf_scores.get(pid, 0.0)
-
-        final_score = (
-            0.35 * cat_score +
-            0.25 * (trending / (1 + trending)) +
-            0.10 * prox +
-            0.30 * cf
-        )
+    with stage("cf"):
+        cf = _cf_scores(db, profile.seen_items, cands.ids)
 
-        recs.append({
-            "product_id": pid,
-            "product_name": r["name"],
-            "shop_id": shop,
-            "category_id": cat,
-            "score": final_score,
-            "cf_score": cf
-        })
+    # 5) User-CF from the preloaded neighbor structure (skipped when off or over budget)
+    with stage("user_cf"):
+        user_cf = user_cf_scores(user_id, cands.ids, weights)
 
-    recs.sort(key=lambda x: x["score"], reverse=True)
+    # 6) Final scoring: columnar kernel, only the top `limit` rows are materialized
+    with stage("score"):
+        recs = _rank_candidates(cands, shops, profile.category_weights, cf, radius_km, limit,
+                                weights=weights, user_cf=user_cf)
+    record_candidates(cands, cf)
 
-    return shops, recs[:limit]
\ No newline at end of file
+    return shops, recs
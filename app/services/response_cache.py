@@ -0,0 +1,274 @@
+# app/services/response_cache.py
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.services.geo import cell_center, snap_to_cell
+from app.services.scoring import get_weight_profile
+from app.services.similarity_index import get_item_index
+from app.services.user_cf import get_user_cf_model
+from app.services.user_generations import bump_user_generation, user_generation
+from app.services.user_topn import get_user_topn
+
+# Cache whole /recommend/products responses per (user, location cell, radius,
+# limit, model version). Requests are computed at the cell center, so every
+# request in a cell gets the same answer; distances are off by at most half a cell.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "60"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "20000"))
+RESPONSE_CACHE_CELL_DEG = float(os.getenv("RESPONSE_CACHE_CELL_DEG", "0.001"))
+# Shared tier: "" (none), "memory" (in-process stand-in) or "package.module:factory"
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "")
+# Followers give up waiting for an in-flight computation after this long and compute themselves
+RESPONSE_CACHE_COALESCE_TIMEOUT_S = float(os.getenv("RESPONSE_CACHE_COALESCE_TIMEOUT_S", "10"))
+
+
+# ------------------------------
+# Shared tier
+# ------------------------------
+class SharedCache:
+    """Interface of the cross-process tier (wrap a Redis/Memcached client in it).
+
+    Values are bytes. ``incr`` must be atomic across processes; it carries the
+    per-user invalidation generations.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl_s):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+
+class InMemorySharedCache(SharedCache):
+    """Dict-backed stand-in for the shared tier (single process; tests and local runs)."""
+
+    def __init__(self):
+        self._data = {}  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl_s):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_s if ttl_s else None, value)
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            value = int(entry[1]) + 1 if entry is not None else 1
+            self._data[key] = (None, value)
+            return value
+
+
+def make_shared_cache(spec: str = RESPONSE_CACHE_SHARED):
+    if not spec:
+        return None
+    if spec == "memory":
+        return InMemorySharedCache()
+    module, sep, attr = spec.partition(":")
+    if not sep:
+        raise ValueError(f"Unknown RESPONSE_CACHE_SHARED '{spec}' (expected memory or package.module:factory)")
+    return getattr(importlib.import_module(module), attr)()
+
+
+# ------------------------------
+# Two-tier cache with request coalescing
+# ------------------------------
+class _InFlight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def serving_version():
+    """Short hash of everything that changes answers: published models and weights."""
+    parts = []
+    for model in (get_item_index(), get_user_cf_model(), get_user_topn()):
+        parts.append("-" if model is None else str(model.version))
+    parts.append(repr(get_weight_profile()))
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=8).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl_s=RESPONSE_CACHE_TTL_S, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 cell_deg=RESPONSE_CACHE_CELL_DEG, shared: SharedCache | None = None):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.cell_deg = cell_deg
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}            # key -> _InFlight (threads)
+        self._inflight_async = {}      # key -> asyncio.Future (event loop)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _generation(self, user_id):
+        if self.shared is not None:
+            value = self.shared.get(f"reco:gen:{user_id}")
+            return int(value) if value is not None else 0
+        return user_generation(user_id)
+
+    def key(self, user_id, lat, lon, radius_km, limit):
+        """``(key, (lat, lon))``: the cache key and the cell center to compute at."""
+        cell = snap_to_cell(lat, lon, self.cell_deg)
+        key = (f"reco:{user_id}:{self._generation(user_id)}:{cell[0]}:{cell[1]}:"
+               f"{float(radius_km)}:{int(limit)}:{serving_version()}")
+        return key, cell_center(cell, self.cell_deg)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            raw = self.shared.get(key)
+            if raw is not None:
+                value = tuple(json.loads(raw))
+                self._put_local(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.ttl_s <= 0:
+            return
+        self._put_local(key, value)
+        if self.shared is not None:
+            self.shared.set(key, json.dumps(value).encode(), self.ttl_s)
+
+    def _put_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """New generation for ``user_id``: its cached responses become unreachable in every worker."""
+        bump_user_generation(user_id)
+        if self.shared is not None:
+            self.shared.incr(f"reco:gen:{user_id}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_compute(self, key, compute):
+        """Cached value for ``key``; concurrent misses of one key compute it once."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if call.done.wait(RESPONSE_CACHE_COALESCE_TIMEOUT_S) and call.error is None:
+                return call.value
+            return compute()
+        try:
+            call.value = compute()
+            self.put(key, call.value)
+            return call.value
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    async def get_or_compute_async(self, key, compute):
+        """:meth:`get_or_compute` for coroutines (``compute`` returns an awaitable)."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self._inflight_async.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), RESPONSE_CACHE_COALESCE_TIMEOUT_S)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this request itself was cancelled
+            except Exception:
+                pass
+            # the leader failed or is too slow: compute independently
+            return await compute()
+        future = self._inflight_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved: no "never retrieved" warning without followers
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight_async.pop(key, None)
+
+
+# ------------------------------
+# Process-wide cache
+# ------------------------------
+_cache = None
+
+
+def get_response_cache():
+    """The cache when RESPONSE_CACHE_ENABLED, else None."""
+    global _cache
+    if _cache is None and RESPONSE_CACHE_ENABLED:
+        _cache = ResponseCache(shared=make_shared_cache())
+    return _cache
+
+
+def set_response_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def invalidate_user_responses(user_id: int):
+    """Drop ``user_id``'s cached responses; call whenever the user generates a new event."""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate_user(user_id)
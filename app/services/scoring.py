@@ -0,0 +1,126 @@
+# app/services/scoring.py
+import math
+import os
+import numpy as np
+
+# Order of the score components; columns of the component matrix follow it.
+COMPONENTS = ("category", "trending", "proximity", "cf", "user_cf")
+
+
+# ------------------------------
+# Weight profile
+# ------------------------------
+class WeightProfile:
+    """Validated weights of the hybrid score components."""
+
+    __slots__ = COMPONENTS
+
+    def __init__(self, category=0.35, trending=0.25, proximity=0.10, cf=0.30, user_cf=0.0):
+        values = {"category": category, "trending": trending, "proximity": proximity, "cf": cf,
+                  "user_cf": user_cf}
+        for name, value in values.items():
+            value = float(value)
+            if not math.isfinite(value) or value < 0:
+                raise ValueError(f"Weight '{name}' must be a finite, non-negative number (got {value})")
+            setattr(self, name, value)
+        if sum(values.values()) <= 0:
+            raise ValueError("At least one weight must be positive")
+
+    @classmethod
+    def parse(cls, spec: str):
+        """Parse ``"category=0.35,trending=0.25,proximity=0.1,cf=0.3,user_cf=0.1"``; missing keys keep defaults."""
+        values = {}
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            name, sep, value = part.partition("=")
+            name = name.strip()
+            if not sep or name not in COMPONENTS:
+                raise ValueError(f"Invalid weight entry '{part}'; expected one of {', '.join(COMPONENTS)}")
+            values[name] = float(value)
+        return cls(**values)
+
+    def as_vector(self):
+        return np.array([getattr(self, name) for name in COMPONENTS], dtype=np.float64)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in COMPONENTS}
+
+    def __repr__(self):
+        return "WeightProfile(" + ", ".join(f"{k}={v}" for k, v in self.as_dict().items()) + ")"
+
+
+DEFAULT_WEIGHTS = WeightProfile()
+_configured = WeightProfile.parse(os.getenv("RECO_WEIGHTS", ""))
+
+
+def get_weight_profile():
+    return _configured
+
+
+def set_weight_profile(profile: WeightProfile):
+    global _configured
+    _configured = profile
+
+
+# ------------------------------
+# Vectorized components
+# ------------------------------
+def trending_component(daily_views, weekly_sales):
+    """``t / (1 + t)`` with ``t = log1p(daily_views) + log1p(weekly_sales)``."""
+    t = np.log1p(np.asarray(daily_views, dtype=np.float64)) + np.log1p(np.asarray(weekly_sales, dtype=np.float64))
+    return t / (1 + t)
+
+
+# SQL twin of trending_component over a products row aliased ``p``
+TRENDING_SQL = """(
+    (ln(1 + COALESCE(p.daily_views, 0)) + ln(1 + COALESCE(p.weekly_sales, 0)))
+    / (1 + ln(1 + COALESCE(p.daily_views, 0)) + ln(1 + COALESCE(p.weekly_sales, 0)))
+)"""
+
+
+def proximity_component(distance_km):
+    return 1.0 / (1.0 + (np.asarray(distance_km, dtype=np.float64) / 0.5))
+
+
+def lookup(keys, table: dict, default=0.0):
+    """Vectorized ``table.get(key, default)`` for an integer key array (-1 = missing)."""
+    keys = np.asarray(keys, dtype=np.int64)
+    out = np.full(len(keys), default, dtype=np.float64)
+    if not table or len(keys) == 0:
+        return out
+    tkeys = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+    tvals = np.fromiter(table.values(), dtype=np.float64, count=len(table))
+    order = np.argsort(tkeys)
+    tkeys, tvals = tkeys[order], tvals[order]
+    pos = np.searchsorted(tkeys, keys)
+    pos[pos >= len(tkeys)] = 0
+    hit = tkeys[pos] == keys
+    out[hit] = tvals[pos[hit]]
+    return out
+
+
+# ------------------------------
+# Kernel
+# ------------------------------
+def score(components, weights: WeightProfile):
+    """Weighted sum of an ``(n, len(COMPONENTS))`` component matrix."""
+    return np.asarray(components, dtype=np.float64) @ weights.as_vector()
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` best scores, best first.
+
+    Ties keep input order, exactly like a stable ``sort(reverse=True)`` over
+    the full list, but only the winners are ever sorted.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        kth = scores[np.argpartition(scores, n - k)[n - k:]].min()
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(n)
+    return idx[np.lexsort((idx, -scores[idx]))]
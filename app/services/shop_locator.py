@@ -0,0 +1,277 @@
+# app/services/shop_locator.py
+import logging
+import math
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.geo import geodesic_distance_m, haversine_distance_m
+
+logger = logging.getLogger(__name__)
+
+# postgis | grid | geo_cache (GEO_CACHE_ENABLED=true is shorthand for geo_cache)
+_GEO_CACHE_ENABLED = os.getenv("GEO_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SHOP_LOCATOR = os.getenv("SHOP_LOCATOR", "geo_cache" if _GEO_CACHE_ENABLED else "postgis").lower()
+SHOP_GRID_CELL_DEG = float(os.getenv("SHOP_GRID_CELL_DEG", "0.05"))
+# How often (seconds) the grid snapshot is re-read from `shops`; 0 disables
+SHOP_GRID_REFRESH_S = float(os.getenv("SHOP_GRID_REFRESH_S", "300"))
+
+NEARBY_SHOPS_LIMIT = 200
+
+# haversine never differs from the WGS84 distance by more than ~0.56%
+_HAVERSINE_SLACK = 1.01
+# smallest length of one degree of latitude / of longitude at the equator (WGS84)
+_M_PER_DEG_LAT = 110574.0
+_M_PER_DEG_LON = 111320.0
+
+
+def _wkt_point(lon: float, lat: float) -> str:
+    return f"SRID=4326;POINT({lon} {lat})"
+
+
+# ------------------------------
+# Columnar shop snapshot
+# ------------------------------
+class ShopColumns:
+    """Shops as NumPy columns plus the Python-side name/address lists."""
+
+    __slots__ = ("ids", "lats", "lons", "names", "addresses")
+
+    def __init__(self, rows):
+        self.ids = np.array([r["id"] for r in rows], dtype=np.int64)
+        self.lats = np.array([float(r["lat"]) for r in rows], dtype=np.float64)
+        self.lons = np.array([float(r["lon"]) for r in rows], dtype=np.float64)
+        self.names = [r["name"] for r in rows]
+        self.addresses = [r["address"] for r in rows]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, lat, lon, radius_m, subset=None, limit=NEARBY_SHOPS_LIMIT):
+        """Same rows, order and rounding as the PostGIS query for the exact point."""
+        idx = np.arange(len(self.ids)) if subset is None else np.asarray(subset, dtype=np.int64)
+        dist = geodesic_distance_m(lat, lon, self.lats[idx], self.lons[idx])
+        inside = np.flatnonzero(dist <= radius_m)
+        order = inside[np.lexsort((self.ids[idx[inside]], dist[inside]))][:limit]
+        return [{
+            "id": int(self.ids[idx[k]]),
+            "name": self.names[idx[k]],
+            "address": self.addresses[idx[k]],
+            "distance_km": round(float(dist[k]) / 1000, 3),
+            "latitude": float(self.lats[idx[k]]),
+            "longitude": float(self.lons[idx[k]]),
+        } for k in order]
+
+
+SHOP_SNAPSHOT_QUERY = text("""
+    SELECT s.id, s.name, s.address,
+           ST_Y(ST_Transform(s.location::geometry, 4326)) AS lat,
+           ST_X(ST_Transform(s.location::geometry, 4326)) AS lon
+    FROM shops s;
+""")
+
+
+# ------------------------------
+# Locator backends
+# ------------------------------
+class ShopLocator:
+    """Answers "shops within radius_km of (lat, lon), nearest first, at most 200"."""
+
+    name = "base"
+
+    def nearby(self, db: Session, lat: float, lon: float, radius_km: float):
+        raise NotImplementedError
+
+    async def nearby_async(self, db, lat: float, lon: float, radius_km: float):
+        """Same as :meth:`nearby` for an ``AsyncSession``."""
+        return await db.run_sync(lambda session: self.nearby(session, lat, lon, radius_km))
+
+    def refresh(self, db: Session | None = None):
+        """Re-read ``shops``; a no-op for backends that query live."""
+        return None
+
+
+class PostgisShopLocator(ShopLocator):
+    name = "postgis"
+
+    def nearby(self, db: Session, lat: float, lon: float, radius_km: float):
+        q = text("""
+            SELECT s.id, s.name, s.address,
+                   ST_Distance(s.location, ST_GeogFromText(:wkt)) AS distance_m,
+                   ST_Y(ST_Transform(s.location::geometry, 4326)) AS lat,
+                   ST_X(ST_Transform(s.location::geometry, 4326)) AS lon
+            FROM shops s
+            WHERE ST_DWithin(s.location, ST_GeogFromText(:wkt), :radius)
+            ORDER BY distance_m, s.id
+            LIMIT :limit;
+        """)
+
+        rows = db.execute(q, {
+            "wkt": _wkt_point(lon, lat),
+            "radius": float(radius_km) * 1000,
+            "limit": NEARBY_SHOPS_LIMIT
+        }).mappings().all()
+
+        out = []
+        for r in rows:
+            out.append({
+                "id": r["id"],
+                "name": r["name"],
+                "address": r["address"],
+                "distance_km": round(float(r["distance_m"]) / 1000, 3),
+                "latitude": float(r["lat"]),
+                "longitude": float(r["lon"])
+            })
+        return out
+
+
+class _GridSnapshot:
+    def __init__(self, shops: ShopColumns, cell_deg: float):
+        self.shops = shops
+        self.cell_deg = cell_deg
+        self.n_cols = math.ceil(360.0 / cell_deg)
+        rows = np.floor((shops.lats + 90.0) / cell_deg).astype(np.int64)
+        cols = np.floor((shops.lons + 180.0) / cell_deg).astype(np.int64) % self.n_cols
+        keys = rows * self.n_cols + cols
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, starts = np.unique(keys[self.order], return_index=True)
+        self.starts = np.append(starts, len(keys)).astype(np.int64)
+
+    def candidates(self, lat, lon, radius_m):
+        """Indices of shops in the grid cells covering the radius around the point."""
+        cd = self.cell_deg
+        dlat = radius_m * _HAVERSINE_SLACK / _M_PER_DEG_LAT
+        lat_lo, lat_hi = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        row_lo = math.floor((lat_lo + 90.0) / cd)
+        row_hi = math.floor((lat_hi + 90.0) / cd)
+
+        cos_min = math.cos(math.radians(max(abs(lat_lo), abs(lat_hi))))
+        if cos_min <= 1e-6:
+            col_span = self.n_cols
+        else:
+            dlon = radius_m * _HAVERSINE_SLACK / (_M_PER_DEG_LON * cos_min)
+            col_span = math.floor(dlon / cd) + 2
+
+        n_cells = (row_hi - row_lo + 1) * min(2 * col_span + 1, self.n_cols)
+        if n_cells >= len(self.cell_keys):
+            return self.order
+
+        col0 = math.floor((lon + 180.0) / cd)
+        if 2 * col_span + 1 >= self.n_cols:
+            cols = np.arange(self.n_cols)
+        else:
+            cols = np.arange(col0 - col_span, col0 + col_span + 1) % self.n_cols
+        rows = np.arange(row_lo, row_hi + 1)
+        wanted = (rows[:, None] * self.n_cols + cols[None, :]).ravel()
+        pos = np.searchsorted(self.cell_keys, wanted)
+        ok = pos < len(self.cell_keys)
+        pos, wanted = pos[ok], wanted[ok]
+        pos = pos[self.cell_keys[pos] == wanted]
+        if len(pos) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        starts = self.starts[pos]
+        lengths = self.starts[pos + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.order[offsets + np.arange(int(lengths.sum()))]
+
+
+class GridShopLocator(ShopLocator):
+    """Database-free locator over an in-memory snapshot of ``shops``.
+
+    Shops are bucketed into a lat/lon grid; a query scans only the cells that
+    can intersect the radius, prunes with haversine and ranks by the WGS84
+    distance so the output matches :class:`PostgisShopLocator`.
+    """
+
+    name = "grid"
+
+    def __init__(self, rows=None, cell_deg=SHOP_GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._snapshot = _GridSnapshot(ShopColumns(rows or []), cell_deg)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._snapshot.shops)
+
+    def load_rows(self, rows):
+        # build outside the lock; queries keep using the old snapshot until the swap
+        snapshot = _GridSnapshot(ShopColumns(rows), self.cell_deg)
+        with self._lock:
+            self._snapshot = snapshot
+
+    def refresh(self, db: Session | None = None):
+        if db is None:
+            return None
+        self.load_rows(db.execute(SHOP_SNAPSHOT_QUERY).mappings().all())
+        return len(self)
+
+    def nearby(self, db: Session | None, lat: float, lon: float, radius_km: float):
+        snap = self._snapshot
+        radius_m = float(radius_km) * 1000
+        cand = snap.candidates(lat, lon, radius_m)
+        if len(cand) == 0:
+            return []
+        shops = snap.shops
+        rough = haversine_distance_m(lat, lon, shops.lats[cand], shops.lons[cand])
+        cand = cand[rough <= radius_m * _HAVERSINE_SLACK]
+        return shops.nearest(lat, lon, radius_m, subset=cand)
+
+    async def nearby_async(self, db, lat: float, lon: float, radius_km: float):
+        # pure in-memory lookup, no connection needed
+        return self.nearby(None, lat, lon, radius_km)
+
+
+# ------------------------------
+# Process-wide locator
+# ------------------------------
+_locator = None
+_refresher = None
+
+
+def make_shop_locator(kind: str = SHOP_LOCATOR):
+    if kind == "postgis":
+        return PostgisShopLocator()
+    if kind == "grid":
+        return GridShopLocator()
+    if kind == "geo_cache":
+        from app.services.geo_cache import GeoCellCache
+        return GeoCellCache()
+    raise ValueError(f"Unknown SHOP_LOCATOR '{kind}' (expected postgis, grid or geo_cache)")
+
+
+def get_shop_locator():
+    global _locator
+    if _locator is None:
+        _locator = make_shop_locator()
+    return _locator
+
+
+def set_shop_locator(locator: ShopLocator):
+    global _locator
+    _locator = locator
+
+
+def _refresh(session_factory, interval):
+    while True:
+        time.sleep(interval)
+        db = session_factory()
+        try:
+            get_shop_locator().refresh(db)
+        except Exception:  # keep serving the previous snapshot
+            logger.exception("shop locator refresh failed")
+        finally:
+            db.close()
+
+
+def start_shop_locator_refresher(session_factory, interval=SHOP_GRID_REFRESH_S):
+    """Periodically re-read ``shops`` into the grid snapshot (other backends read live)."""
+    global _refresher
+    if _refresher is not None or interval <= 0 or get_shop_locator().name != "grid":
+        return
+    _refresher = threading.Thread(target=_refresh, args=(session_factory, interval),
+                                  name="shop-locator-refresher", daemon=True)
+    _refresher.start()
@@ -0,0 +1,252 @@
+# app/services/similarity_index.py
+import logging
+import threading
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.config import MODEL_DIR, MODEL_RELOAD_INTERVAL_S, MODEL_VERIFY_CHECKSUM
+from app.services.model_artifact import read_artifact, write_artifact
+
+logger = logging.getLogger(__name__)
+
+ITEM_INDEX_FILE = "item_similarity.knn"
+USER_INDEX_FILE = "user_similarity.knn"
+
+
+# ------------------------------
+# CSR neighbor index
+# ------------------------------
+class ItemSimilarityIndex:
+    """Read-only item -> neighbors index in CSR layout.
+
+    ``item_ids`` is sorted; neighbors of ``item_ids[i]`` live in
+    ``neighbor_ids[indptr[i]:indptr[i + 1]]`` with matching ``scores``.
+    The same layout holds user -> similar users (``kind="user"`` artifacts).
+    Indexes loaded from an artifact are backed by read-only memory maps.
+    """
+
+    def __init__(self, item_ids, indptr, neighbor_ids, scores, version=None):
+        self.item_ids = np.asarray(item_ids, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.neighbor_ids = np.asarray(neighbor_ids, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.version = version
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    @property
+    def nnz(self):
+        return len(self.neighbor_ids)
+
+    @classmethod
+    def from_triplets(cls, item_ids, similar_item_ids, scores, version=None):
+        item_ids = np.asarray(item_ids, dtype=np.int32)
+        similar_item_ids = np.asarray(similar_item_ids, dtype=np.int32)
+        scores = np.asarray(scores, dtype=np.float32)
+
+        order = np.argsort(item_ids, kind="stable")
+        item_ids = item_ids[order]
+        keys, counts = np.unique(item_ids, return_counts=True)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(keys, indptr, similar_item_ids[order], scores[order], version=version)
+
+    @classmethod
+    def from_db(cls, db: Session):
+        rows = db.execute(text("""
+            SELECT item_id, similar_item_id, score
+            FROM item_similarity
+        """)).fetchall()
+        if not rows:
+            return cls.empty(version="db")
+        arr = np.array(rows, dtype=np.float64)
+        return cls.from_triplets(arr[:, 0], arr[:, 1], arr[:, 2], version="db")
+
+    @classmethod
+    def empty(cls, version=None):
+        return cls([], [0], [], [], version=version)
+
+    @classmethod
+    def load(cls, path, kind="item", verify=MODEL_VERIFY_CHECKSUM):
+        arrays, version = read_artifact(path, kind=kind, verify=verify)
+        return cls(arrays["keys"], arrays["indptr"], arrays["neighbor_ids"], arrays["scores"], version=version)
+
+    def save(self, path, kind="item"):
+        # written to a temp file and renamed, so readers never see a partial artifact
+        write_artifact(path, kind, self.item_ids, self.indptr, self.neighbor_ids, self.scores,
+                       version=self.version)
+
+    def triplets(self):
+        """The index back as ``(item_ids, neighbor_ids, scores)`` arrays."""
+        keys = np.repeat(self.item_ids, np.diff(self.indptr))
+        return keys, self.neighbor_ids, self.scores
+
+    def replace_items(self, item_ids, keys, neighbor_ids, scores, version=None):
+        """New index where the neighbor lists of ``item_ids`` are replaced by the given rows."""
+        old_keys, old_nbrs, old_scores = self.triplets()
+        keep = ~np.isin(old_keys, np.asarray(item_ids, dtype=np.int64))
+        return ItemSimilarityIndex.from_triplets(
+            np.concatenate([old_keys[keep], np.asarray(keys, dtype=np.int32)]),
+            np.concatenate([old_nbrs[keep], np.asarray(neighbor_ids, dtype=np.int32)]),
+            np.concatenate([old_scores[keep], np.asarray(scores, dtype=np.float32)]),
+            version=version,
+        )
+
+    def _gather(self, seen_ids):
+        """All ``(neighbor_ids, scores)`` of the seen items, concatenated."""
+        empty = (self.neighbor_ids[:0], self.scores[:0])
+        if len(self.item_ids) == 0:
+            return empty
+        seen = np.unique(np.asarray(list(seen_ids), dtype=np.int64))
+        pos = np.searchsorted(self.item_ids, seen)
+        pos = pos[pos < len(self.item_ids)]
+        pos = pos[np.isin(self.item_ids[pos], seen)]
+        if len(pos) == 0:
+            return empty
+
+        starts = self.indptr[pos]
+        lengths = self.indptr[pos + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return empty
+
+        # gather all neighbor slices of the seen items in one shot
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        gather = offsets + np.arange(total)
+        return self.neighbor_ids[gather], self.scores[gather]
+
+    def neighbors(self, seen_ids):
+        """Sorted ids of every item that is a neighbor of some seen item (CF score > 0 candidates)."""
+        return np.unique(self._gather(seen_ids)[0]).astype(np.int64)
+
+    def max_similarity(self, seen_ids, candidate_ids):
+        """Max similarity of each candidate to any of the seen items.
+
+        Equivalent to ``SELECT similar_item_id, MAX(score) ... WHERE item_id IN seen
+        GROUP BY similar_item_id``; returns ``(scores, found)`` aligned with
+        ``candidate_ids`` where ``found`` marks candidates that had a row.
+        """
+        cands = np.asarray(candidate_ids, dtype=np.int64)
+        out = np.zeros(len(cands), dtype=np.float32)
+        found = np.zeros(len(cands), dtype=bool)
+        if len(cands) == 0:
+            return out, found
+
+        nbrs, scores = self._gather(seen_ids)
+        if len(nbrs) == 0:
+            return out, found
+
+        uniq, inv = np.unique(nbrs, return_inverse=True)
+        best = np.full(len(uniq), -np.inf, dtype=np.float32)
+        np.maximum.at(best, inv, scores)
+
+        cpos = np.searchsorted(uniq, cands)
+        cpos[cpos >= len(uniq)] = 0
+        found = uniq[cpos] == cands
+        out[found] = best[cpos[found]]
+        return out, found
+
+    def max_similarity_many(self, seen_lists, candidate_ids):
+        """:meth:`max_similarity` for many users at once.
+
+        Returns a dense ``(len(seen_lists), len(candidate_ids))`` float32 matrix;
+        candidates without a row score 0. All users' neighbor slices are gathered
+        and reduced in one pass.
+        """
+        cands = np.asarray(candidate_ids, dtype=np.int64)
+        out = np.full((len(seen_lists), len(cands)), -np.inf, dtype=np.float32)
+        lens = np.fromiter((len(s) for s in seen_lists), dtype=np.int64, count=len(seen_lists))
+        if len(cands) and len(self.item_ids) and lens.sum():
+            seen = np.fromiter((i for s in seen_lists for i in s), dtype=np.int64, count=int(lens.sum()))
+            owner = np.repeat(np.arange(len(seen_lists)), lens)
+            pos = np.searchsorted(self.item_ids, seen)
+            pos[pos >= len(self.item_ids)] = 0
+            ok = self.item_ids[pos] == seen
+            pos, owner = pos[ok], owner[ok]
+
+            starts = self.indptr[pos]
+            lengths = self.indptr[pos + 1] - starts
+            total = int(lengths.sum())
+            if total:
+                gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+                nbrs = self.neighbor_ids[gather].astype(np.int64)
+                rows = np.repeat(owner, lengths)
+
+                sorter = np.argsort(cands, kind="stable")
+                cpos = np.searchsorted(cands, nbrs, sorter=sorter)
+                cpos[cpos >= len(cands)] = 0
+                hit = cands[sorter[cpos]] == nbrs
+                np.maximum.at(out, (rows[hit], sorter[cpos[hit]]), self.scores[gather[hit]])
+        out[np.isneginf(out)] = 0.0
+        return out
+
+
+# ------------------------------
+# Process-wide current index (hot-swappable)
+# ------------------------------
+_current = None
+_current_mtime = None
+_load_lock = threading.Lock()
+_watcher = None
+
+
+def item_index_path():
+    return MODEL_DIR / ITEM_INDEX_FILE
+
+
+def get_item_index():
+    """Currently published index, or None if nothing has been loaded."""
+    return _current
+
+
+def set_item_index(index, mtime=None):
+    global _current, _current_mtime
+    # a single reference assignment: in-flight requests keep the index they already hold
+    _current, _current_mtime = index, mtime
+
+
+def load_item_index(db: Session | None = None):
+    """Load the index from the published artifact, falling back to ``item_similarity``."""
+    with _load_lock:
+        path = item_index_path()
+        if path.exists():
+            mtime = path.stat().st_mtime
+            set_item_index(ItemSimilarityIndex.load(path), mtime)
+        elif db is not None:
+            set_item_index(ItemSimilarityIndex.from_db(db))
+    return _current
+
+
+def reload_item_index_if_changed():
+    path = item_index_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if mtime == _current_mtime:
+        return False
+    with _load_lock:
+        if mtime == _current_mtime:
+            return False
+        set_item_index(ItemSimilarityIndex.load(path), mtime)
+    return True
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_item_index_if_changed()
+        except Exception:  # keep serving the previous model
+            logger.exception("item index reload failed")
+
+
+def start_item_index_watcher(interval=MODEL_RELOAD_INTERVAL_S):
+    global _watcher
+    if _watcher is not None or interval <= 0:
+        return
+    _watcher = threading.Thread(target=_watch, args=(interval,), name="item-index-watcher", daemon=True)
+    _watcher.start()
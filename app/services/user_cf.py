@@ -0,0 +1,238 @@
+# app/services/user_cf.py
+import logging
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.config import MODEL_DIR, MODEL_RELOAD_INTERVAL_S
+from app.models.recommendation import UserSimilarity
+from app.services.interaction_decay import window_sql
+from app.services.similarity_index import USER_INDEX_FILE, ItemSimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+# Per-request time budget for the user-CF channel. When its recent cost (an
+# exponential moving average) exceeds the budget, the channel is dropped
+# (scored as 0) for USER_CF_COOLDOWN_S before being tried again.
+USER_CF_BUDGET_MS = float(os.getenv("USER_CF_BUDGET_MS", "15"))
+USER_CF_COOLDOWN_S = float(os.getenv("USER_CF_COOLDOWN_S", "30"))
+# Upper bound on neighbor interactions touched by one request
+USER_CF_MAX_WORK = int(os.getenv("USER_CF_MAX_WORK", "200000"))
+
+NEIGHBOR_INTERACTIONS_QUERY = text(f"""
+    SELECT user_id, product_id FROM product_view_events
+    WHERE user_id = ANY(:users) AND {window_sql("created_at")}
+    UNION
+    SELECT user_id, product_id FROM purchase_events
+    WHERE user_id = ANY(:users) AND {window_sql("created_at")}
+""")
+
+
+# ------------------------------
+# Neighbor + interaction structure
+# ------------------------------
+class UserCFModel:
+    """User neighbors plus the items those neighbors interacted with, in CSR form.
+
+    ``neighbors`` maps a user to its top-K similar users (an
+    ``ItemSimilarityIndex`` over users). ``item_indptr``/``item_ids`` list the
+    distinct items of every user that appears as someone's neighbor, rows
+    aligned with the sorted ``member_ids``.
+    """
+
+    def __init__(self, neighbors: ItemSimilarityIndex, member_ids, item_indptr, item_ids):
+        self.neighbors = neighbors
+        self.member_ids = np.asarray(member_ids, dtype=np.int64)
+        self.item_indptr = np.asarray(item_indptr, dtype=np.int64)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+
+    @property
+    def version(self):
+        return self.neighbors.version
+
+    @classmethod
+    def build(cls, neighbors: ItemSimilarityIndex, db: Session):
+        members = np.unique(neighbors.neighbor_ids).astype(np.int64)
+        rows = db.execute(NEIGHBOR_INTERACTIONS_QUERY, {"users": [int(u) for u in members]}).fetchall()
+        if rows:
+            arr = np.array(rows, dtype=np.int64)
+            order = np.lexsort((arr[:, 1], arr[:, 0]))
+            users, items = arr[order, 0], arr[order, 1]
+        else:
+            users = items = np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(len(members) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.searchsorted(members, users), minlength=len(members)), out=indptr[1:])
+        return cls(neighbors, members, indptr, items)
+
+    def scores(self, user_id, candidate_ids, max_work=USER_CF_MAX_WORK):
+        """Similarity-weighted share of the user's neighbors that interacted with each candidate.
+
+        ``sum(sim(u, v) for neighbors v who touched the item) / sum(sim(u, v))``,
+        in [0, 1]. Returns None when the work would exceed ``max_work``.
+        """
+        cands = np.asarray(candidate_ids, dtype=np.int64)
+        out = np.zeros(len(cands), dtype=np.float64)
+        idx = self.neighbors
+        pos = np.searchsorted(idx.item_ids, user_id)
+        if len(cands) == 0 or pos >= len(idx.item_ids) or idx.item_ids[pos] != user_id:
+            return out
+
+        lo, hi = idx.indptr[pos], idx.indptr[pos + 1]
+        nbrs = np.asarray(idx.neighbor_ids[lo:hi], dtype=np.int64)
+        sims = np.asarray(idx.scores[lo:hi], dtype=np.float64)
+        keep = sims > 0
+        nbrs, sims = nbrs[keep], sims[keep]
+        total_sim = sims.sum()
+        if total_sim <= 0:
+            return out
+
+        rows = np.searchsorted(self.member_ids, nbrs)
+        rows[rows >= len(self.member_ids)] = 0
+        hit = self.member_ids[rows] == nbrs
+        rows, sims = rows[hit], sims[hit]
+        starts = self.item_indptr[rows]
+        lengths = self.item_indptr[rows + 1] - starts
+        work = int(lengths.sum())
+        if work == 0:
+            return out
+        if work > max_work:
+            return None
+
+        # one batched gather + weighted bincount instead of a query per neighbor
+        gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(work)
+        items = self.item_ids[gather]
+        uniq, inv = np.unique(items, return_inverse=True)
+        agg = np.bincount(inv, weights=np.repeat(sims, lengths), minlength=len(uniq)) / total_sim
+
+        cpos = np.searchsorted(uniq, cands)
+        cpos[cpos >= len(uniq)] = 0
+        found = uniq[cpos] == cands
+        out[found] = np.minimum(agg[cpos[found]], 1.0)
+        return out
+
+
+def neighbors_from_db(db: Session):
+    rows = db.execute(select(UserSimilarity.user_id, UserSimilarity.similar_user_id, UserSimilarity.score)).fetchall()
+    if not rows:
+        return ItemSimilarityIndex.empty(version="db")
+    arr = np.array(rows, dtype=np.float64)
+    return ItemSimilarityIndex.from_triplets(arr[:, 0], arr[:, 1], arr[:, 2], version="db")
+
+
+# ------------------------------
+# Latency budget
+# ------------------------------
+class LatencyBudget:
+    """Drops a channel for a cooldown once its moving-average cost exceeds the budget."""
+
+    def __init__(self, budget_ms=USER_CF_BUDGET_MS, cooldown_s=USER_CF_COOLDOWN_S, alpha=0.2):
+        self.budget_ms = budget_ms
+        self.cooldown_s = cooldown_s
+        self.alpha = alpha
+        self.avg_ms = 0.0
+        self.dropped_until = 0.0
+        self.dropped = 0
+
+    def allow(self):
+        if self.budget_ms <= 0:
+            return True
+        if time.monotonic() < self.dropped_until:
+            self.dropped += 1
+            return False
+        return True
+
+    def record(self, elapsed_ms):
+        self.avg_ms += self.alpha * (elapsed_ms - self.avg_ms)
+        if self.budget_ms > 0 and self.avg_ms > self.budget_ms:
+            self.dropped_until = time.monotonic() + self.cooldown_s
+            # start the next probe period from the budget rather than the spike
+            self.avg_ms = self.budget_ms
+
+
+# ------------------------------
+# Process-wide model (hot-swappable)
+# ------------------------------
+_current = None
+_current_mtime = None
+_load_lock = threading.Lock()
+_budget = LatencyBudget()
+_watcher = None
+
+
+def user_index_path():
+    return MODEL_DIR / USER_INDEX_FILE
+
+
+def get_user_cf_model():
+    return _current
+
+
+def set_user_cf_model(model, mtime=None):
+    global _current, _current_mtime
+    _current, _current_mtime = model, mtime
+
+
+def get_user_cf_budget():
+    return _budget
+
+
+def load_user_cf_model(db: Session):
+    """Load user neighbors from the artifact (or ``user_similarity``) plus their interactions."""
+    with _load_lock:
+        path = user_index_path()
+        if path.exists():
+            mtime = path.stat().st_mtime
+            neighbors = ItemSimilarityIndex.load(path, kind="user")
+        else:
+            mtime, neighbors = None, neighbors_from_db(db)
+        set_user_cf_model(UserCFModel.build(neighbors, db), mtime)
+    return _current
+
+
+def user_cf_scores(user_id, candidate_ids, weights):
+    """User-CF column for ``candidate_ids``, or None when the channel is off or dropped."""
+    model = _current
+    if model is None or weights.user_cf <= 0 or not _budget.allow():
+        return None
+    t0 = time.perf_counter()
+    out = model.scores(user_id, candidate_ids)
+    _budget.record((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def reload_user_cf_if_changed(session_factory):
+    path = user_index_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if mtime == _current_mtime:
+        return False
+    db = session_factory()
+    try:
+        load_user_cf_model(db)
+    finally:
+        db.close()
+    return True
+
+
+def _watch(session_factory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_user_cf_if_changed(session_factory)
+        except Exception:  # keep serving the previous model
+            logger.exception("user CF reload failed")
+
+
+def start_user_cf_watcher(session_factory, interval=MODEL_RELOAD_INTERVAL_S):
+    global _watcher
+    if _watcher is not None or interval <= 0:
+        return
+    _watcher = threading.Thread(target=_watch, args=(session_factory, interval),
+                                name="user-cf-watcher", daemon=True)
+    _watcher.start()
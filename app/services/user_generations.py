@@ -0,0 +1,31 @@
+# app/services/user_generations.py
+import mmap
+import os
+import numpy as np
+
+# Per-user invalidation generations shared by every worker of app.serve. The
+# counters live in an anonymous shared mapping created at import, i.e. in the
+# parent before it forks, so a bump in one worker is seen by all of them.
+# Users hash into USER_GENERATION_SLOTS counters; a collision only costs a
+# spurious cache miss. Processes that do not share a parent (`uvicorn --workers`,
+# separate hosts) only see their own bumps: their caches fall back to the TTLs.
+USER_GENERATION_SLOTS = int(os.getenv("USER_GENERATION_SLOTS", str(1 << 20)))
+
+_map = mmap.mmap(-1, USER_GENERATION_SLOTS * 8)
+_slots = np.frombuffer(_map, dtype=np.uint64)
+
+
+def user_generation(user_id: int) -> int:
+    return int(_slots[int(user_id) % USER_GENERATION_SLOTS])
+
+
+def bump_user_generation(user_id: int) -> int:
+    """Invalidate everything cached for ``user_id`` in every worker.
+
+    Not atomic across processes, and it does not need to be: two racing bumps
+    may land as one, but the counter still moves past every value a reader
+    could have read before either event committed.
+    """
+    slot = int(user_id) % USER_GENERATION_SLOTS
+    _slots[slot] += 1
+    return int(_slots[slot])
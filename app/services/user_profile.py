@@ -0,0 +1,234 @@
+# app/services/user_profile.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from app.services.interaction_decay import USER_CATEGORY_SCORES_ENABLED, decay_sql, window_sql
+from app.services.user_generations import bump_user_generation, user_generation
+
+USER_PROFILE_TTL_S = float(os.getenv("USER_PROFILE_TTL_S", "300"))
+USER_PROFILE_MAX_ENTRIES = int(os.getenv("USER_PROFILE_MAX_ENTRIES", "50000"))
+USER_PROFILE_MAX_BYTES = int(os.getenv("USER_PROFILE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+# ------------------------------
+# Profile
+# ------------------------------
+class UserProfile:
+    """Everything the recommenders need from a user's interaction history."""
+
+    __slots__ = ("user_id", "seen_items", "category_weights")
+
+    def __init__(self, user_id, seen_items, category_weights):
+        self.user_id = user_id
+        self.seen_items = frozenset(seen_items)
+        # category_id -> weight in (0, 1], strongest category first
+        self.category_weights = category_weights
+
+    def approx_bytes(self):
+        # rough CPython footprint: set slots + dict entries + boxed ints/floats
+        return 256 + 72 * len(self.seen_items) + 112 * len(self.category_weights)
+
+
+def build_user_profile(user_id, rows):
+    """Build a profile from ``(product_id, category_id, weight)`` rows.
+
+    Views weigh 1 each and purchases ``2 * max(quantity, 1)``, matching the
+    historical ``get_user_top_categories`` query (times the time decay, see
+    ``app.services.interaction_decay``). Rows without a product only carry a
+    category weight.
+    """
+    seen = set()
+    cat_scores = {}
+    for product_id, category_id, weight in rows:
+        if product_id is not None:
+            seen.add(product_id)
+        if category_id is not None:
+            cat_scores[category_id] = cat_scores.get(category_id, 0.0) + float(weight)
+
+    weights = {}
+    if cat_scores:
+        max_score = max(cat_scores.values())
+        for cat, sc in sorted(cat_scores.items(), key=lambda x: x[1], reverse=True):
+            weights[cat] = sc / max_score
+    return UserProfile(user_id, seen, weights)
+
+
+def _profile_query(user_filter, per_user):
+    """Seen items + category weights for the users matched by ``user_filter``.
+
+    Events are limited to the lookback window and weighted by their decay. With
+    USER_CATEGORY_SCORES_ENABLED the category weights come from the maintained
+    aggregates (rows with a NULL product) and the events only supply seen items.
+    """
+    user_col = "user_id, " if per_user else ""
+    group_user = "x.user_id, " if per_user else ""
+    events = f"""
+        SELECT {user_col}product_id, 1.0 * {decay_sql("created_at")} AS weight
+        FROM product_view_events
+        WHERE {user_filter} AND {window_sql("created_at")}
+        UNION ALL
+        SELECT {user_col}product_id, GREATEST(quantity, 1) * 2.0 * {decay_sql("created_at")} AS weight
+        FROM purchase_events
+        WHERE {user_filter} AND {window_sql("created_at")}
+    """
+    if not USER_CATEGORY_SCORES_ENABLED:
+        sql = f"""
+            SELECT {group_user}x.product_id, p.category_id, SUM(x.weight) AS weight
+            FROM ({events}) x
+            JOIN products p ON p.id = x.product_id
+            GROUP BY {group_user}x.product_id, p.category_id
+        """
+    else:
+        sql = f"""
+            SELECT DISTINCT {group_user}x.product_id, CAST(NULL AS integer) AS category_id, 0.0 AS weight
+            FROM ({events}) x
+            UNION ALL
+            SELECT {user_col}NULL, category_id, score * {decay_sql("as_of")}
+            FROM user_category_scores
+            WHERE {user_filter}
+        """
+    return text(sql + (" ORDER BY 1;" if per_user else ";"))
+
+
+USER_PROFILE_QUERY = _profile_query("user_id = :u", per_user=False)
+
+
+def load_user_profile(db: Session, user_id: int):
+    rows = db.execute(USER_PROFILE_QUERY, {"u": user_id}).fetchall()
+    return build_user_profile(user_id, rows)
+
+
+# USER_PROFILE_QUERY for many users at once, ordered so rows group by user
+USER_PROFILES_QUERY = _profile_query("user_id = ANY(:users)", per_user=True)
+
+
+def load_user_profiles(db: Session, user_ids):
+    """Profiles for many users with one query; users without events get empty profiles."""
+    user_ids = sorted({int(u) for u in user_ids})
+    grouped = {u: [] for u in user_ids}
+    if user_ids:
+        for user_id, product_id, category_id, weight in db.execute(USER_PROFILES_QUERY, {"users": user_ids}):
+            grouped[user_id].append((product_id, category_id, weight))
+    return {u: build_user_profile(u, rows) for u, rows in grouped.items()}
+
+
+# ------------------------------
+# TTL + LRU cache
+# ------------------------------
+class UserProfileCache:
+    def __init__(self, ttl_s=USER_PROFILE_TTL_S, max_entries=USER_PROFILE_MAX_ENTRIES,
+                 max_bytes=USER_PROFILE_MAX_BYTES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # user_id -> (expires_at, size, profile, generation)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now or entry[3] != user_generation(user_id):
+                self._pop(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, profile, generation=None):
+        """Cache ``profile``; pass the user's generation read before it was loaded."""
+        if generation is None:
+            generation = user_generation(profile.user_id)
+        size = profile.approx_bytes()
+        if self.ttl_s <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(profile.user_id)
+            self._entries[profile.user_id] = (time.monotonic() + self.ttl_s, size, profile, generation)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._pop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _pop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+_cache = UserProfileCache()
+
+
+def get_user_profile(db: Session, user_id: int):
+    """Cached profile for ``user_id``; loads it with a single query on a miss."""
+    profile = _cache.get(user_id)
+    if profile is None:
+        # read before the query: an event committed meanwhile must not be cached over
+        generation = user_generation(user_id)
+        profile = load_user_profile(db, user_id)
+        _cache.put(profile, generation)
+    return profile
+
+
+def get_user_profiles(db: Session, user_ids):
+    """Cached profiles for ``user_ids``; every miss is loaded by one shared query."""
+    out, missing = {}, []
+    for user_id in {int(u) for u in user_ids}:
+        profile = _cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            out[user_id] = profile
+    generations = {u: user_generation(u) for u in missing}
+    for user_id, profile in load_user_profiles(db, missing).items():
+        _cache.put(profile, generations[user_id])
+        out[user_id] = profile
+    return out
+
+
+async def get_user_profile_async(db, user_id: int):
+    """:func:`get_user_profile` for an ``AsyncSession``."""
+    profile = _cache.get(user_id)
+    if profile is None:
+        generation = user_generation(user_id)
+        rows = (await db.execute(USER_PROFILE_QUERY, {"u": user_id})).fetchall()
+        profile = build_user_profile(user_id, rows)
+        _cache.put(profile, generation)
+    return profile
+
+
+def invalidate_user_profile(user_id: int):
+    """Drop the cached profile in every worker; call whenever the user generates a new event."""
+    bump_user_generation(user_id)
+    _cache.invalidate(user_id)
+
+
+def get_user_profile_cache():
+    return _cache
@@ -0,0 +1,147 @@
+# app/services/user_topn.py
+import logging
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy.sql import text
+
+from app.config import MODEL_DIR, MODEL_RELOAD_INTERVAL_S, MODEL_VERIFY_CHECKSUM
+from app.services.model_artifact import read_artifact, write_artifact
+from app.services.scoring import TRENDING_SQL
+
+logger = logging.getLogger(__name__)
+
+USER_TOPN_FILE = "user_topn.knn"
+# serve returning users from the precomputed store (scripts/build_user_topn.py)
+USER_TOPN_ENABLED = os.getenv("USER_TOPN_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# the given products (top-N store entry, pruned candidate pool) that sit in the nearby shops
+TOPN_CANDIDATES_QUERY = text(f"""
+    SELECT p.id,
+           p.name,
+           p.category_id,
+           p.shop_id,
+           COALESCE(p.trending_score, {TRENDING_SQL}) AS trending
+    FROM products p
+    WHERE p.id = ANY(:ids)
+    AND p.shop_id = ANY(:shops);
+""")
+
+
+# ------------------------------
+# Store
+# ------------------------------
+class UserTopNStore:
+    """Per-user location-agnostic candidates with their user-dependent score terms.
+
+    Rows are users (sorted ``user_ids``); row ``i`` lists ``product_ids`` with the
+    unweighted ``category`` and item-``cf`` components, so the current weight
+    profile applies at serve time. Loaded stores are memory-mapped.
+    """
+
+    def __init__(self, user_ids, indptr, product_ids, category, cf, version=None):
+        self.user_ids = np.asarray(user_ids, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.product_ids = np.asarray(product_ids, dtype=np.int32)
+        self.category = np.asarray(category, dtype=np.float32)
+        self.cf = np.asarray(cf, dtype=np.float32)
+        self.version = version
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def get(self, user_id):
+        """``(product_ids, category, cf)`` of ``user_id``, or None if the user is not stored."""
+        pos = np.searchsorted(self.user_ids, user_id)
+        if pos >= len(self.user_ids) or self.user_ids[pos] != user_id:
+            return None
+        lo, hi = self.indptr[pos], self.indptr[pos + 1]
+        return self.product_ids[lo:hi], self.category[lo:hi], self.cf[lo:hi]
+
+    @classmethod
+    def load(cls, path, verify=MODEL_VERIFY_CHECKSUM):
+        arrays, version = read_artifact(path, kind="user_topn", verify=verify)
+        return cls(arrays["keys"], arrays["indptr"], arrays["neighbor_ids"], arrays["scores"],
+                   arrays["aux"], version=version)
+
+    def save(self, path):
+        write_artifact(path, "user_topn", self.user_ids, self.indptr, self.product_ids, self.category,
+                       version=self.version, aux=self.cf)
+
+
+# ------------------------------
+# Process-wide store (hot-swappable)
+# ------------------------------
+_current = None
+_current_mtime = None
+_load_lock = threading.Lock()
+_watcher = None
+
+
+def user_topn_path():
+    return MODEL_DIR / USER_TOPN_FILE
+
+
+def get_user_topn():
+    return _current
+
+
+def set_user_topn(store, mtime=None):
+    global _current, _current_mtime
+    _current, _current_mtime = store, mtime
+
+
+def load_user_topn():
+    with _load_lock:
+        path = user_topn_path()
+        if path.exists():
+            set_user_topn(UserTopNStore.load(path), path.stat().st_mtime)
+    return _current
+
+
+def reload_user_topn_if_changed():
+    path = user_topn_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if mtime == _current_mtime:
+        return False
+    with _load_lock:
+        if mtime == _current_mtime:
+            return False
+        set_user_topn(UserTopNStore.load(path), mtime)
+    return True
+
+
+def _watch(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_user_topn_if_changed()
+        except Exception:  # keep serving the previous store
+            logger.exception("user top-N reload failed")
+
+
+def start_user_topn_watcher(interval=MODEL_RELOAD_INTERVAL_S):
+    global _watcher
+    if _watcher is not None or interval <= 0:
+        return
+    _watcher = threading.Thread(target=_watch, args=(interval,), name="user-topn-watcher", daemon=True)
+    _watcher.start()
+
+
+def user_topn_entry(user_id):
+    """The user's stored candidates when the store is enabled and has them, else None."""
+    store = _current
+    if not USER_TOPN_ENABLED or store is None:
+        return None
+    entry = store.get(user_id)
+    if entry is None or len(entry[0]) == 0:
+        return None
+    return entry
+
+
+def topn_params(entry, shop_ids):
+    return {"ids": [int(i) for i in entry[0]], "shops": shop_ids}
@@ -0,0 +1,98 @@
+"""
+Functionality of this script:
+Compare the in-process ("python") and single-statement ("pushdown") product recommendation
+engines across search radii. For each radius it samples (user, location) pairs near existing
+shops, times both engines, and reports latency percentiles, the number of candidate products
+in range (the effective catalog size) and how often both engines agree on the top results.
+Run it against databases seeded at different scales to cover catalog size.
+Usage:
+    python -m benchmarks.bench_engines [--radii 1,5,10,20] [--samples 50] [--limit 20]
+                                       [--cold] [--label small] [--out bench_engines.json]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from sqlalchemy import text
+from app.db import SessionLocal
+from app.services.pushdown_engine import recommend_products_pushdown
+from app.services.recommendation_service import recommend_products_python
+from app.services.shop_locator import SHOP_SNAPSHOT_QUERY
+from app.services.user_profile import get_user_profile_cache
+from benchmarks.stats import summarize, write_report
+
+def count_candidates(db, shop_ids):
+    if not shop_ids:
+        return 0
+    return db.execute(text("SELECT COUNT(*) FROM products WHERE shop_id = ANY(:s)"),
+                      {"s": shop_ids}).scalar()
+
+def run(db, radii, samples, limit, cold=False, seed=0):
+    rng = random.Random(seed)
+    shops = db.execute(SHOP_SNAPSHOT_QUERY).mappings().all()
+    users = [r[0] for r in db.execute(text("SELECT id FROM users")).fetchall()]
+    if not shops or not users:
+        raise SystemExit("Need at least one shop and one user to benchmark.")
+
+    engines = {"python": recommend_products_python, "pushdown": recommend_products_pushdown}
+    results = []
+    for radius_km in radii:
+        timings = {name: [] for name in engines}
+        candidates = []
+        agree = 0
+        for _ in range(samples):
+            s = rng.choice(shops)
+            lat = float(s["lat"]) + rng.uniform(-0.01, 0.01)
+            lon = float(s["lon"]) + rng.uniform(-0.01, 0.01)
+            user_id = rng.choice(users)
+
+            outputs = {}
+            for name, fn in engines.items():
+                if cold:
+                    get_user_profile_cache().clear()
+                t0 = time.perf_counter()
+                outputs[name] = fn(db, user_id, lat, lon, radius_km, limit)
+                timings[name].append((time.perf_counter() - t0) * 1000)
+
+            shops_out, recs_py = outputs["python"]
+            candidates.append(count_candidates(db, [x["id"] for x in shops_out]))
+            top_py = {r["product_id"] for r in recs_py}
+            top_pd = {r["product_id"] for r in outputs["pushdown"][1]}
+            agree += top_py == top_pd
+
+        row = {
+            "radius_km": radius_km,
+            "candidates_mean": statistics.fmean(candidates),
+            "candidates_max": max(candidates),
+            "top_k_agreement": agree / samples,
+        }
+        for name, ms in timings.items():
+            row[name] = summarize(ms)
+        results.append(row)
+        print(f"radius={radius_km:>6}km cands~{row['candidates_mean']:.0f} "
+              f"python p50={row['python']['p50_ms']:.1f}ms p95={row['python']['p95_ms']:.1f}ms | "
+              f"pushdown p50={row['pushdown']['p50_ms']:.1f}ms p95={row['pushdown']['p95_ms']:.1f}ms | "
+              f"agree={row['top_k_agreement']:.0%}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--radii", default="1,5,10,20")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--cold", action="store_true", help="clear the user profile cache before each call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", default="bench_engines.json")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    catalog = db.execute(text("SELECT COUNT(*) FROM products")).scalar()
+    results = run(db, [float(r) for r in args.radii.split(",")], args.samples, args.limit,
+                  cold=args.cold, seed=args.seed)
+    db.close()
+
+    write_report(args.out, "engines", args.label,
+                 params={"catalog_size": catalog, "samples": args.samples, "limit": args.limit, "cold": args.cold},
+                 results=results)
@@ -0,0 +1,110 @@
+"""
+Functionality of this script:
+Micro-benchmarks of the service functions behind the API and of the offline trainers, against
+the configured database. Each service function is timed on sampled (user, location) pairs
+with a warm and a cold user-profile cache; the trainers are timed per phase (interaction
+load, matrix build, item KNN, user KNN). Results are written as a JSON report so runs at
+different scales or revisions can be compared.
+Training writes item_similarity / user_similarity and the model artifacts, so it only runs
+with --train (point MODEL_DIR at a scratch directory to keep the served models).
+Usage:
+    python -m benchmarks.bench_micro [--samples 200] [--radius-km 5] [--limit 20] [--train]
+                                     [--engine sklearn] [--label small] [--out bench_micro.json]
+"""
+
+import argparse
+import random
+from sqlalchemy import text
+from app.db import SessionLocal
+from app.services.recommendation_service import (
+    get_nearby_shops_service,
+    get_user_top_categories,
+    recommend_products_hybrid,
+)
+from app.services.shop_locator import SHOP_SNAPSHOT_QUERY, get_shop_locator
+from app.services.similarity_index import load_item_index
+from app.services.user_profile import get_user_profile_cache
+from benchmarks.stats import summarize, timed, write_report
+from scripts.interactions import build_interaction_matrix, load_interactions, peak_rss_mb
+from scripts.knn_engines import ENGINES
+from scripts.train_item_knn import TOP_K, train_item_similarity
+from scripts.train_user_knn import train_user_similarity
+
+def sample_requests(db, samples, seed):
+    rng = random.Random(seed)
+    shops = db.execute(SHOP_SNAPSHOT_QUERY).mappings().all()
+    users = [r[0] for r in db.execute(text("SELECT id FROM users")).fetchall()]
+    if not shops or not users:
+        raise SystemExit("Need at least one shop and one user to benchmark.")
+    out = []
+    for _ in range(samples):
+        s = rng.choice(shops)
+        out.append((rng.choice(users), float(s["lat"]) + rng.uniform(-0.01, 0.01),
+                    float(s["lon"]) + rng.uniform(-0.01, 0.01)))
+    return out
+
+def bench_services(db, requests, radius_km, limit):
+    cache = get_user_profile_cache()
+    cases = {
+        "get_nearby_shops_service": lambda u, lat, lon: get_nearby_shops_service(db, lat, lon, radius_km),
+        "get_user_top_categories": lambda u, lat, lon: get_user_top_categories(db, u),
+        "recommend_products_hybrid": lambda u, lat, lon: recommend_products_hybrid(db, u, lat, lon,
+                                                                                   radius_km, limit),
+    }
+    results = {}
+    for name, fn in cases.items():
+        for mode in ("cold", "warm"):
+            ms = []
+            for u, lat, lon in requests:
+                if mode == "cold":
+                    cache.clear()
+                else:
+                    fn(u, lat, lon)  # the warm call is the second one for the same request
+                ms.append(timed(fn, u, lat, lon)[1])
+            results[f"{name}.{mode}"] = summarize(ms)
+            print(f"{name:<28} {mode:<4} p50={results[f'{name}.{mode}']['p50_ms']:.2f}ms "
+                  f"p95={results[f'{name}.{mode}']['p95_ms']:.2f}ms")
+    return results
+
+def bench_training(db, k_neighbors, engine):
+    phases = {}
+    data, phases["load_interactions"] = timed(load_interactions, db)
+    if not len(data):
+        print("No interaction data found; skipping training benchmarks.")
+        return {"interactions": 0}
+    im, phases["build_interaction_matrix"] = timed(build_interaction_matrix, data)
+    n_events = len(data)
+    del data
+    _, phases["train_item_similarity"] = timed(train_item_similarity, db, im, k_neighbors, engine=engine)
+    _, phases["train_user_similarity"] = timed(train_user_similarity, db, im, k_neighbors, engine=engine)
+    for name, ms in phases.items():
+        print(f"{name:<28} {ms / 1000:.2f}s")
+    return {"interactions": n_events, "users": len(im.user_ids), "items": len(im.item_ids),
+            "engine": engine, "phases_ms": phases, "peak_rss_mb": peak_rss_mb()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--radius-km", type=float, default=5.0)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--train", action="store_true", help="also time both trainers (writes tables/models)")
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--engine", choices=ENGINES, default="sklearn")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", default="bench_micro.json")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    # the API preloads these at startup; do the same so the timings match serving
+    load_item_index(db)
+    get_shop_locator().refresh(db)
+    catalog = db.execute(text("SELECT COUNT(*) FROM products")).scalar()
+    services = bench_services(db, sample_requests(db, args.samples, args.seed), args.radius_km, args.limit)
+    training = bench_training(db, args.k, args.engine) if args.train else None
+    db.close()
+
+    write_report(args.out, "micro", args.label,
+                 params={"catalog_size": catalog, "samples": args.samples, "radius_km": args.radius_km,
+                         "limit": args.limit, "train": args.train},
+                 services=services, training=training)
@@ -0,0 +1,205 @@
+"""
+Functionality of this script:
+Generate a synthetic catalog and event history at a chosen scale, for benchmarking beyond the
+handful of rows in scripts/seed.sql. Shops are scattered around a city center, products are
+spread over shops and categories with Zipf-skewed popularity, and every user leans towards a
+few favourite categories, so the category, trending and CF terms all have signal. Rows are
+bulk-loaded with COPY in chunks. Optionally writes a JSONL of request shapes (user + location
+near a shop) for benchmarks/replay.py.
+Usage:
+    python -m benchmarks.generate_data [--users 10000] [--shops 200] [--products 50000]
+                                       [--categories 40] [--views 1000000] [--purchases 200000]
+                                       [--center 24.8607,67.0011] [--spread-km 15] [--days 90]
+                                       [--seed 0] [--reset] [--requests-out bench_requests.jsonl]
+"""
+
+import argparse
+import io
+import json
+import math
+import time
+import numpy as np
+from sqlalchemy import text
+from app.db import SessionLocal
+
+CHUNK_ROWS = 200_000
+RESET_TABLES = ("users", "categories", "shops", "products", "product_view_events", "purchase_events",
+                "item_similarity", "user_similarity", "recsys_job_state")
+KM_PER_DEG = 111.32
+
+def copy_rows(db, table, columns, rows):
+    """COPY ``rows`` (iterable of CSV lines, no trailing newline) into ``table`` in chunks."""
+    cursor = db.connection().connection.cursor()
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    total = 0
+    buf = []
+    for line in rows:
+        buf.append(line)
+        if len(buf) == CHUNK_ROWS:
+            cursor.copy_expert(sql, io.StringIO("\n".join(buf) + "\n"))
+            total += len(buf)
+            buf = []
+    if buf:
+        cursor.copy_expert(sql, io.StringIO("\n".join(buf) + "\n"))
+        total += len(buf)
+    cursor.close()
+    return total
+
+def new_ids(db, table, after):
+    """Identity ids assigned by the last load (all ids above ``after``), ascending."""
+    rows = db.execute(text(f"SELECT id FROM {table} WHERE id > :after ORDER BY id"), {"after": after})
+    return np.array([r[0] for r in rows], dtype=np.int64)
+
+def max_id(db, table):
+    return db.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar()
+
+def zipf_weights(n, s, rng):
+    # popularity by rank 1/r^s, ranks shuffled so popularity is independent of id order
+    w = 1.0 / np.arange(1, n + 1) ** s
+    rng.shuffle(w)
+    return w / w.sum()
+
+def timestamps(rng, n, days, now):
+    # uniform over the last `days` days, as ISO strings PostgreSQL parses as timestamptz
+    offsets = rng.integers(0, days * 86400, size=n).astype("timedelta64[s]")
+    return np.datetime_as_string(now - offsets, unit="s")
+
+def pick_products(rng, users, favourites, by_category, cat_start, cat_count, popularity, affinity):
+    """Product positions for events of ``users``: favourite-category picks mixed with popular ones."""
+    n = len(users)
+    picks = rng.choice(len(popularity), size=n, p=popularity)
+    cats = favourites[users, rng.integers(0, favourites.shape[1], size=n)]
+    use_fav = (rng.random(n) < affinity) & (cat_count[cats] > 0)
+    offs = (rng.random(use_fav.sum()) * cat_count[cats[use_fav]]).astype(np.int64)
+    picks[use_fav] = by_category[cat_start[cats[use_fav]] + offs]
+    return picks
+
+def generate(args):
+    rng = np.random.default_rng(args.seed)
+    tag = time.strftime("%Y%m%d%H%M%S")
+    center_lat, center_lon = (float(x) for x in args.center.split(","))
+    now = np.datetime64("now", "s")
+    db = SessionLocal()
+    started = time.perf_counter()
+
+    if args.reset:
+        db.execute(text(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY CASCADE"))
+        db.commit()
+        print("Truncated benchmark tables")
+
+    # users / categories / shops
+    before = max_id(db, "users")
+    copy_rows(db, "users", ("email", "name"),
+              (f"bench-{tag}-{i}@example.com,Bench User {i}" for i in range(args.users)))
+    user_ids = new_ids(db, "users", before)
+
+    before = max_id(db, "categories")
+    copy_rows(db, "categories", ("name", "slug"),
+              (f"Bench {tag} {i},bench-{tag}-{i}" for i in range(args.categories)))
+    category_ids = new_ids(db, "categories", before)
+
+    # uniform over a disk of radius spread_km around the center
+    r = args.spread_km * np.sqrt(rng.random(args.shops))
+    theta = rng.random(args.shops) * 2 * math.pi
+    shop_lat = center_lat + r * np.sin(theta) / KM_PER_DEG
+    shop_lon = center_lon + r * np.cos(theta) / (KM_PER_DEG * math.cos(math.radians(center_lat)))
+    before = max_id(db, "shops")
+    copy_rows(db, "shops", ("name", "address", "location"),
+              (f"Bench Shop {i},Bench Street {i},SRID=4326;POINT({lon:.6f} {lat:.6f})"
+               for i, (lat, lon) in enumerate(zip(shop_lat, shop_lon))))
+    shop_ids = new_ids(db, "shops", before)
+    db.commit()
+    print(f"users={len(user_ids)} categories={len(category_ids)} shops={len(shop_ids)}")
+
+    # products: popularity drives both the counters (trending) and the event draws
+    popularity = zipf_weights(args.products, args.zipf, rng)
+    product_cat = rng.integers(0, len(category_ids), size=args.products)
+    product_shop = rng.integers(0, len(shop_ids), size=args.products)
+    daily_views = rng.poisson(popularity * args.products * 5)
+    weekly_sales = rng.poisson(popularity * args.products)
+    before = max_id(db, "products")
+    copy_rows(db, "products", ("name", "category_id", "shop_id", "daily_views", "weekly_sales"),
+              (f"Bench Product {i},{category_ids[c]},{shop_ids[s]},{v},{w}"
+               for i, (c, s, v, w) in enumerate(zip(product_cat, product_shop, daily_views, weekly_sales))))
+    product_ids = new_ids(db, "products", before)
+    db.commit()
+    print(f"products={len(product_ids)}")
+
+    # each user favours a few categories; events pick from them with probability `affinity`
+    favourites = rng.integers(0, len(category_ids), size=(len(user_ids), args.favourites))
+    by_category = np.argsort(product_cat, kind="stable")
+    cat_count = np.bincount(product_cat, minlength=len(category_ids))
+    cat_start = np.concatenate(([0], np.cumsum(cat_count)[:-1]))
+
+    def events(n):
+        for lo in range(0, n, CHUNK_ROWS):
+            m = min(CHUNK_ROWS, n - lo)
+            users = rng.integers(0, len(user_ids), size=m)
+            picks = pick_products(rng, users, favourites, by_category, cat_start, cat_count,
+                                  popularity, args.affinity)
+            yield user_ids[users], product_ids[picks], timestamps(rng, m, args.days, now)
+
+    views = copy_rows(db, "product_view_events", ("user_id", "product_id", "created_at"),
+                      (f"{u},{p},{t}Z" for us, ps, ts in events(args.views) for u, p, t in zip(us, ps, ts)))
+    db.commit()
+    print(f"view events={views}")
+
+    def purchase_lines():
+        for us, ps, ts in events(args.purchases):
+            qty = rng.integers(1, 4, size=len(us))
+            price = rng.uniform(0.5, 50.0, size=len(us))
+            for u, p, t, q, pr in zip(us, ps, ts, qty, price):
+                yield f"{u},{p},{q},{pr:.2f},{t}Z"
+
+    purchases = copy_rows(db, "purchase_events",
+                          ("user_id", "product_id", "quantity", "price_at_purchase", "created_at"),
+                          purchase_lines())
+    db.commit()
+    print(f"purchase events={purchases}")
+
+    for table in RESET_TABLES[:6]:
+        db.execute(text(f"ANALYZE {table}"))
+    db.commit()
+    db.close()
+
+    if args.requests_out:
+        write_requests(args.requests_out, rng, user_ids, shop_lat, shop_lon, args.request_count)
+    print(f"Generated in {time.perf_counter() - started:.1f}s")
+
+def write_requests(path, rng, user_ids, shop_lat, shop_lon, n):
+    """Request shapes for the replay driver: a user at a location within ~1 km of a shop."""
+    shops = rng.integers(0, len(shop_lat), size=n)
+    users = user_ids[rng.integers(0, len(user_ids), size=n)]
+    radii = rng.choice([1.0, 2.0, 5.0, 10.0], size=n, p=[0.2, 0.3, 0.4, 0.1])
+    with open(path, "w") as f:
+        for u, s, radius in zip(users, shops, radii):
+            f.write(json.dumps({
+                "user_id": int(u),
+                "lat": round(float(shop_lat[s] + rng.uniform(-0.01, 0.01)), 6),
+                "lon": round(float(shop_lon[s] + rng.uniform(-0.01, 0.01)), 6),
+                "radius_km": float(radius),
+                "limit": 20,
+            }))
+            f.write("\n")
+    print(f"Wrote {n} request shapes to {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--shops", type=int, default=200)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--views", type=int, default=1_000_000)
+    parser.add_argument("--purchases", type=int, default=200_000)
+    parser.add_argument("--center", default="24.8607,67.0011", help="lat,lon of the city center")
+    parser.add_argument("--spread-km", type=float, default=15.0, help="shops lie within this radius")
+    parser.add_argument("--days", type=int, default=90, help="events are spread over the last N days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew exponent")
+    parser.add_argument("--favourites", type=int, default=3, help="favourite categories per user")
+    parser.add_argument("--affinity", type=float, default=0.6,
+                        help="share of events drawn from the user's favourite categories")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="truncate all tables first (destructive)")
+    parser.add_argument("--requests-out", help="also write replay request shapes to this .jsonl")
+    parser.add_argument("--request-count", type=int, default=10_000)
+    generate(parser.parse_args())
@@ -0,0 +1,155 @@
+"""
+Functionality of this script:
+Replay load test against a running API. Reads a JSONL query log and fires the requests at
+--url from --concurrency worker threads (optionally paced to --rate requests/s), then reports
+per-endpoint latency percentiles, throughput and status counts as a JSON report.
+Each line is either a full request
+    {"method": "GET", "path": "/recommend/products", "params": {...}}
+    {"method": "POST", "path": "/recommend/products:batch", "body": {...}}
+or the shorthand {"user_id", "lat", "lon"[, "radius_km", "limit"]} for GET /recommend/products
+(the format written by benchmarks/generate_data.py --requests-out).
+Usage:
+    python -m benchmarks.replay bench_requests.jsonl [--url http://localhost:8000] [--concurrency 16]
+                                [--duration-s 60] [--rate 0] [--warmup 50] [--label v2]
+                                [--out bench_replay.json]
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.stats import summarize, write_report
+
+SHORTHAND_PARAMS = ("user_id", "lat", "lon", "radius_km", "limit")
+
+def read_log(path):
+    """Normalized ``(method, path, params, body)`` tuples from a JSONL query log."""
+    out = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            if "path" in r:
+                out.append((r.get("method", "GET").upper(), r["path"], r.get("params") or {}, r.get("body")))
+            else:
+                params = {k: r[k] for k in SHORTHAND_PARAMS if k in r}
+                out.append(("GET", "/recommend/products", params, None))
+    if not out:
+        raise SystemExit(f"No requests in {path}")
+    return out
+
+def send(base_url, request, timeout):
+    """``(path, status, elapsed_ms)``; status 0 is a connection error or timeout."""
+    method, path, params, body = request
+    url = base_url + path + ("?" + urllib.parse.urlencode(params) if params else "")
+    data = None if body is None else json.dumps(body).encode()
+    req = urllib.request.Request(url, data=data, method=method,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        status = exc.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return path, status, (time.perf_counter() - t0) * 1000
+
+def replay(base_url, log, concurrency, duration_s, max_requests, rate, timeout):
+    # the log is cycled until the duration or request count runs out
+    source = itertools.cycle(log)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s if duration_s else None
+    interval = 1.0 / rate if rate else 0.0
+    state = {"sent": 0, "next_at": time.perf_counter()}
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+
+    def next_request():
+        with lock:
+            now = time.perf_counter()
+            if (max_requests and state["sent"] >= max_requests) or (deadline and now >= deadline):
+                return None
+            state["sent"] += 1
+            wait = state["next_at"] - now
+            state["next_at"] = max(state["next_at"], now) + interval
+            request = next(source)
+        if wait > 0:
+            time.sleep(wait)
+        return request
+
+    def worker():
+        while True:
+            request = next_request()
+            if request is None:
+                return
+            path, status, ms = send(base_url, request, timeout)
+            with lock:
+                statuses[path][status] += 1
+                if 200 <= status < 300:
+                    latencies[path].append(ms)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for path in sorted(statuses):
+        total = sum(statuses[path].values())
+        endpoints[path] = {
+            **summarize(latencies[path]),
+            "requests": total,
+            "errors": total - len(latencies[path]),
+            "throughput_rps": total / elapsed,
+            "status": {str(k): v for k, v in sorted(statuses[path].items())},
+        }
+    all_ms = [ms for v in latencies.values() for ms in v]
+    overall = {**summarize(all_ms), "requests": state["sent"], "errors": state["sent"] - len(all_ms),
+               "elapsed_s": elapsed, "throughput_rps": state["sent"] / elapsed}
+    return overall, endpoints
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", help="JSONL query log")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration-s", type=float, default=60.0, help="0 = until --requests are sent")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no cap)")
+    parser.add_argument("--rate", type=float, default=0.0, help="target requests/s across workers (0 = open loop)")
+    parser.add_argument("--warmup", type=int, default=50, help="unrecorded requests sent first")
+    parser.add_argument("--timeout-s", type=float, default=30.0)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--out", default="bench_replay.json")
+    args = parser.parse_args()
+    if not args.duration_s and not args.requests:
+        parser.error("set --duration-s or --requests")
+
+    base_url = args.url.rstrip("/")
+    log = read_log(args.log)
+    for request in itertools.islice(itertools.cycle(log), args.warmup):
+        send(base_url, request, args.timeout_s)
+
+    overall, endpoints = replay(base_url, log, args.concurrency, args.duration_s, args.requests,
+                                args.rate, args.timeout_s)
+    print(f"{overall['requests']} requests in {overall['elapsed_s']:.1f}s "
+          f"({overall['throughput_rps']:.0f} req/s), errors={overall['errors']}")
+    for path, row in endpoints.items():
+        if row["p50_ms"] is not None:
+            print(f"  {path:<28} p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms "
+                  f"p99={row['p99_ms']:.1f}ms ({row['requests']} req)")
+    write_report(args.out, "replay", args.label,
+                 params={"url": base_url, "log": args.log, "log_size": len(log),
+                         "concurrency": args.concurrency, "duration_s": args.duration_s,
+                         "requests": args.requests, "rate": args.rate, "warmup": args.warmup},
+                 overall=overall, endpoints=endpoints)
@@ -0,0 +1,57 @@
+"""
+Functionality of this module:
+Latency summaries and JSON report helpers shared by the benchmark scripts. Every report
+carries the same envelope (benchmark name, label, timestamp, git revision, parameters) so
+runs can be diffed against each other.
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[k]
+
+def summarize(ms):
+    return {
+        "n": len(ms),
+        "mean_ms": statistics.fmean(ms) if ms else None,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": max(ms) if ms else None,
+    }
+
+def timed(fn, *args, **kwargs):
+    """``(result, elapsed_ms)`` of one call."""
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - t0) * 1000
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_report(path, benchmark, label="", params=None, **sections):
+    report = {
+        "benchmark": benchmark,
+        "label": label,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "params": params or {},
+        **sections,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {path}")
+    return report
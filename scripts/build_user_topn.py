@@ -0,0 +1,116 @@
+"""
+Functionality of this script:
+Materialize each active user's top-N location-agnostic candidates into MODEL_DIR/user_topn.knn.
+For every user with events in the last --active-days, the user-dependent score terms are
+computed against the whole catalog (category affinity and item-CF max similarity, one
+vectorized block of users at a time). The N products with the best
+    w_category * category + w_cf * cf + w_trending * trending
+are kept together with their unweighted category and CF terms. At request time the API
+(USER_TOPN_ENABLED=true) filters a user's list to the nearby shops and adds live trending and
+proximity; users missing from the store, or with too few stored products nearby, take the
+live path.
+Usage:
+    python -m scripts.build_user_topn [--n 300] [--active-days 90] [--memory-mb 512]
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from sqlalchemy import text
+from app.config import MODEL_DIR
+from app.db import SessionLocal
+from app.services.scoring import TRENDING_SQL, get_weight_profile, lookup
+from app.services.similarity_index import ItemSimilarityIndex, load_item_index
+from app.services.user_profile import load_user_profiles
+from app.services.user_topn import USER_TOPN_FILE, UserTopNStore
+
+TOP_N = 300
+
+ACTIVE_USERS_QUERY = text("""
+    SELECT user_id FROM product_view_events WHERE created_at >= now() - make_interval(days => :days)
+    UNION
+    SELECT user_id FROM purchase_events WHERE created_at >= now() - make_interval(days => :days)
+    ORDER BY 1;
+""")
+
+CATALOG_QUERY = text(f"""
+    SELECT p.id, COALESCE(p.category_id, -1), COALESCE(p.trending_score, {TRENDING_SQL})
+    FROM products p
+    ORDER BY p.id;
+""")
+
+
+def users_per_block(n_products, memory_mb):
+    # category, cf and selection-key rows of n_products float32/float64 each
+    per_user = max(1, n_products) * (4 + 8 + 8) * 2
+    return max(1, int(memory_mb * 1024 * 1024 // per_user))
+
+
+def topn_block(profiles, catalog_ids, catalog_cats, catalog_trending, index, weights, n):
+    """Top-``n`` products per user of the block; returns ``(rows, cols, category, cf)``."""
+    cf = index.max_similarity_many([p.seen_items for p in profiles], catalog_ids)
+    category = np.stack([lookup(catalog_cats, p.category_weights) for p in profiles])
+    key = weights.category * category + weights.cf * cf + weights.trending * catalog_trending
+
+    n = min(n, len(catalog_ids))
+    if n < len(catalog_ids):
+        cols = np.argpartition(-key, n - 1, axis=1)[:, :n]
+    else:
+        cols = np.broadcast_to(np.arange(len(catalog_ids)), key.shape).copy()
+    # best first; equal keys by product position for determinism
+    order = np.lexsort((cols, -np.take_along_axis(key, cols, axis=1)), axis=1)
+    cols = np.take_along_axis(cols, order, axis=1)
+    rows = np.broadcast_to(np.arange(len(profiles))[:, None], cols.shape)
+    return rows.ravel(), cols.ravel(), category[rows, cols].ravel(), cf[rows, cols].ravel()
+
+
+def build(n=TOP_N, active_days=90, memory_mb=512):
+    started = time.perf_counter()
+    db = SessionLocal()
+    weights = get_weight_profile()
+    index = load_item_index(db) or ItemSimilarityIndex.empty()
+
+    users = [r[0] for r in db.execute(ACTIVE_USERS_QUERY, {"days": active_days}).fetchall()]
+    catalog = np.array(db.execute(CATALOG_QUERY).fetchall(), dtype=np.float64).reshape(-1, 3)
+    catalog_ids = catalog[:, 0].astype(np.int64)
+    catalog_cats = catalog[:, 1].astype(np.int64)
+    catalog_trending = catalog[:, 2]
+    print(f"active users={len(users)}, catalog={len(catalog_ids)}, n={n}")
+
+    step = users_per_block(len(catalog_ids), memory_mb)
+    counts, products, category, cf = [], [], [], []
+    for lo in range(0, len(users), step):
+        block = users[lo:lo + step]
+        profiles = load_user_profiles(db, block)
+        rows, cols, cat_b, cf_b = topn_block([profiles[u] for u in block], catalog_ids, catalog_cats,
+                                             catalog_trending, index, weights, n)
+        counts.append(np.bincount(rows, minlength=len(block)))
+        products.append(catalog_ids[cols].astype(np.int32))
+        category.append(cat_b.astype(np.float32))
+        cf.append(cf_b.astype(np.float32))
+        done = lo + len(block)
+        print(f"  {done}/{len(users)} users ({done / (time.perf_counter() - started):.0f} users/s)")
+    db.close()
+
+    def cat(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    indptr = np.zeros(len(users) + 1, dtype=np.int64)
+    np.cumsum(cat(counts, np.int64), out=indptr[1:])
+    store = UserTopNStore(np.asarray(users, dtype=np.int32), indptr, cat(products, np.int32),
+                          cat(category, np.float32), cat(cf, np.float32),
+                          version=time.strftime("%Y%m%dT%H%M%S"))
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    store.save(MODEL_DIR / USER_TOPN_FILE)
+    print(f"Published top-{n} store for {len(store)} users to {MODEL_DIR / USER_TOPN_FILE} "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=TOP_N, help="products kept per user")
+    parser.add_argument("--active-days", type=int, default=90, help="users with events in this window")
+    parser.add_argument("--memory-mb", type=int, default=512, help="budget for one block of users")
+    args = parser.parse_args()
+    build(args.n, args.active_days, args.memory_mb)
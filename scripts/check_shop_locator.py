@@ -0,0 +1,55 @@
+"""
+Functionality of this script:
+Parity check between the PostGIS nearby-shop query and the in-memory locators
+(grid index and geo-cell cache). Samples query points around existing shops and
+reports any difference in returned rows, order or rounded distances.
+Usage:
+    python -m scripts.check_shop_locator [--samples 500] [--radii 0.5,1,5,20]
+"""
+
+import argparse
+import random
+import sys
+from app.db import SessionLocal
+from app.services.geo_cache import GeoCellCache
+from app.services.shop_locator import GridShopLocator, PostgisShopLocator, SHOP_SNAPSHOT_QUERY
+
+def check(db, samples=500, radii=(0.5, 1.0, 5.0, 20.0), jitter_deg=0.05, seed=0):
+    shops = db.execute(SHOP_SNAPSHOT_QUERY).mappings().all()
+    if not shops:
+        print("No shops found. Nothing to check.")
+        return 0
+
+    reference = PostgisShopLocator()
+    grid = GridShopLocator()
+    grid.refresh(db)
+    engines = {"grid": grid, "geo_cache": GeoCellCache()}
+
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(samples):
+        s = rng.choice(shops)
+        lat = float(s["lat"]) + rng.uniform(-jitter_deg, jitter_deg)
+        lon = float(s["lon"]) + rng.uniform(-jitter_deg, jitter_deg)
+        radius_km = rng.choice(radii)
+        expected = reference.nearby(db, lat, lon, radius_km)
+        for name, engine in engines.items():
+            got = engine.nearby(db, lat, lon, radius_km)
+            if got != expected:
+                mismatches += 1
+                print(f"[{name}] mismatch at lat={lat:.6f} lon={lon:.6f} radius_km={radius_km}: "
+                      f"expected {len(expected)} shops, got {len(got)}")
+    print(f"Checked {samples} queries x {len(engines)} engines: {mismatches} mismatches.")
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--radii", default="0.5,1,5,20")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    bad = check(db, args.samples, tuple(float(r) for r in args.radii.split(",")), seed=args.seed)
+    db.close()
+    sys.exit(1 if bad else 0)
@@ -0,0 +1,248 @@
+"""
+Functionality of this module:
+Load view/purchase interactions for the training scripts without per-row Python objects
+surviving the load. Both event tables are streamed through a server-side cursor in chunks;
+each chunk is converted to typed arrays (int32 ids, float32 weights) straight away. Dense
+user/item indices come from np.unique(return_inverse=True), and duplicate (user, item) pairs
+are summed before the CSR matrix is built. Load time and peak memory are reported.
+Event weights follow app.services.interaction_decay: only events inside the lookback window
+are loaded and each is weighted by its decay at the load's reference time (as_of).
+Incremental loads also track the ids missing below their watermarks ("holes"), so rows of
+transactions that commit late are still picked up.
+"""
+
+import resource
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy import text
+from app.services.interaction_decay import decay_sql, window_sql
+
+CHUNK_ROWS = 200_000
+
+AS_OF = "CAST(:as_of AS timestamptz)"
+
+# views weigh 1.0, purchases 3.0 per unit (times their decay at :as_of); src/id only feed the watermarks.
+# :hv / :hp are the ids at or below the watermarks that were missing from earlier loads
+# (see missing_event_ids) and are looked up again.
+INTERACTIONS_QUERY = text(f"""
+    SELECT 0 AS src, id, user_id, product_id, 1.0 * {decay_sql("created_at", AS_OF)} AS weight
+    FROM product_view_events
+    WHERE (id > :wv OR id = ANY(CAST(:hv AS bigint[])))
+      AND {window_sql("created_at", AS_OF)}
+    UNION ALL
+    SELECT 1 AS src, id, user_id, product_id, (quantity * 3.0) * {decay_sql("created_at", AS_OF)} AS weight
+    FROM purchase_events
+    WHERE (id > :wp OR id = ANY(CAST(:hp AS bigint[])))
+      AND {window_sql("created_at", AS_OF)}
+""")
+
+# Already-loaded events (ids up to the watermarks) created in [:since, :until), i.e. the
+# ones that left the lookback window since the previous load; weights are negated
+EXPIRED_INTERACTIONS_QUERY = text(f"""
+    SELECT 0 AS src, id, user_id, product_id, -1.0 * {decay_sql("created_at", AS_OF)} AS weight
+    FROM product_view_events
+    WHERE id <= :wv AND id <> ALL(CAST(:hv AS bigint[]))
+      AND created_at >= CAST(:since AS timestamptz) AND created_at < CAST(:until AS timestamptz)
+    UNION ALL
+    SELECT 1 AS src, id, user_id, product_id, -(quantity * 3.0) * {decay_sql("created_at", AS_OF)} AS weight
+    FROM purchase_events
+    WHERE id <= :wp AND id <> ALL(CAST(:hp AS bigint[]))
+      AND created_at >= CAST(:since AS timestamptz) AND created_at < CAST(:until AS timestamptz)
+""")
+
+EVENT_TABLES = ("product_view_events", "purchase_events")  # src 0 and 1
+
+# Id ranges with no visible row in (:after, :upto], and the created_at of the row that
+# follows each. Ids are drawn before commit, so a gap can be a transaction that is still
+# open (its rows appear later, below the watermark) as well as a rollback or a delete.
+GAPS_SQL = """
+    SELECT id + 1 AS lo, next_id - 1 AS hi
+    FROM (
+        SELECT id, lead(id) OVER (ORDER BY id) AS next_id, lead(created_at) OVER (ORDER BY id) AS next_at
+        FROM (
+            SELECT CAST(:after AS bigint) AS id, CAST(NULL AS timestamptz) AS created_at
+            UNION ALL
+            SELECT id, created_at FROM {table} WHERE id > :after AND id <= :upto
+        ) ids
+    ) x
+    WHERE next_id > id + 1 AND next_at >= to_timestamp(:recent)
+"""
+
+VISIBLE_IDS_SQL = "SELECT id FROM {table} WHERE id = ANY(CAST(:ids AS bigint[]))"
+
+# A gap wider than this is a sequence jump, not in-flight transactions
+HOLE_MAX_GAP = 100_000
+
+
+class Interactions:
+    """Raw interaction arrays plus the highest view/purchase event ids they cover."""
+
+    def __init__(self, user_ids, item_ids, weights, last_view_id=0, last_purchase_id=0,
+                 load_s=0.0, peak_rss_mb=0.0, as_of=None):
+        self.user_ids = user_ids      # int32, one entry per event
+        self.item_ids = item_ids      # int32
+        self.weights = weights        # float32
+        self.last_view_id = last_view_id
+        self.last_purchase_id = last_purchase_id
+        self.load_s = load_s
+        self.peak_rss_mb = peak_rss_mb
+        self.as_of = as_of            # reference time of the decayed weights
+
+    def __len__(self):
+        return len(self.weights)
+
+    @property
+    def nbytes(self):
+        return self.user_ids.nbytes + self.item_ids.nbytes + self.weights.nbytes
+
+
+class InteractionMatrix:
+    """User x item CSR matrix with the ids behind its dense rows and columns."""
+
+    def __init__(self, matrix, user_ids, item_ids):
+        self.matrix = matrix          # csr, float32, duplicates summed
+        self.user_ids = user_ids      # dense row -> users.id (sorted)
+        self.item_ids = item_ids      # dense col -> products.id (sorted)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------
+# Streaming load
+# ------------------------------
+def _ids(values):
+    return [int(v) for v in values]
+
+
+def load_interactions(db, last_view_id=0, last_purchase_id=0, chunk_rows=CHUNK_ROWS, as_of=None,
+                      view_holes=(), purchase_holes=()):
+    """Stream events with ids above the given watermarks, or among the holes, into typed arrays.
+
+    Weights are decayed to ``as_of`` (default: the database's now()).
+    """
+    if as_of is None:
+        as_of = db.execute(text("SELECT now()")).scalar()
+    params = {"wv": int(last_view_id), "wp": int(last_purchase_id), "as_of": as_of,
+              "hv": _ids(view_holes), "hp": _ids(purchase_holes)}
+    return _stream(db, INTERACTIONS_QUERY, params, last_view_id, last_purchase_id, chunk_rows)
+
+
+def load_expired_interactions(db, last_view_id, last_purchase_id, since, until, as_of, chunk_rows=CHUNK_ROWS,
+                              view_holes=(), purchase_holes=()):
+    """Negated interactions of loaded events (ids up to the watermarks, holes excluded)
+    created in ``[since, until)``."""
+    params = {"wv": int(last_view_id), "wp": int(last_purchase_id), "since": since, "until": until,
+              "as_of": as_of, "hv": _ids(view_holes), "hp": _ids(purchase_holes)}
+    return _stream(db, EXPIRED_INTERACTIONS_QUERY, params, last_view_id, last_purchase_id, chunk_rows)
+
+
+def _stream(db, query, params, last_view_id, last_purchase_id, chunk_rows):
+    started = time.perf_counter()
+    result = db.execute(query, params, execution_options={"yield_per": chunk_rows})
+    users, items, weights = [], [], []
+    for part in result.partitions():
+        arr = np.array(part, dtype=np.float64)
+        src, ids = arr[:, 0], arr[:, 1]
+        if (src == 0).any():
+            last_view_id = max(last_view_id, int(ids[src == 0].max()))
+        if (src == 1).any():
+            last_purchase_id = max(last_purchase_id, int(ids[src == 1].max()))
+        users.append(arr[:, 2].astype(np.int32))
+        items.append(arr[:, 3].astype(np.int32))
+        weights.append(arr[:, 4].astype(np.float32))
+        del arr
+    result.close()
+
+    def cat(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    data = Interactions(cat(users, np.int32), cat(items, np.int32), cat(weights, np.float32),
+                        int(last_view_id), int(last_purchase_id), as_of=params["as_of"])
+    data.load_s = time.perf_counter() - started
+    data.peak_rss_mb = peak_rss_mb()
+    print(f"Loaded {len(data)} interactions in {data.load_s:.2f}s "
+          f"({data.nbytes / 2**20:.1f} MiB of arrays, peak RSS {data.peak_rss_mb:.0f} MiB)")
+    return data
+
+
+# ------------------------------
+# Watermark holes
+# ------------------------------
+# An id watermark alone loses rows: ids are drawn before commit, so a transaction that
+# commits late makes rows appear below a watermark that has already moved past them.
+# Incremental loads therefore also track the ids at or below the watermark that were
+# missing when they loaded ("holes") and look them up again on every run, until they
+# show up or have been missing for longer than a TTL (rollbacks, deleted rows).
+def merge_holes(holes, seen, gaps, visible, now, ttl_s, max_gap=HOLE_MAX_GAP):
+    """``(ids, first_missed)`` after a load: old holes still missing plus the new gaps.
+
+    ``holes`` / ``seen`` are the missing ids and when each was first missed (epoch
+    seconds), ``gaps`` new ``(lo, hi)`` id ranges and ``visible`` the old holes that
+    showed up. Gaps wider than ``max_gap`` are sequence jumps and are not tracked.
+    """
+    holes = np.asarray(holes, dtype=np.int64)
+    seen = np.asarray(seen, dtype=np.float64)
+    keep = ~np.isin(holes, np.asarray(visible, dtype=np.int64)) & (now - seen <= ttl_s)
+    new = [np.arange(lo, hi + 1, dtype=np.int64) for lo, hi in gaps if hi - lo + 1 <= max_gap]
+    new = np.setdiff1d(np.concatenate(new) if new else np.zeros(0, dtype=np.int64), holes[keep])
+    ids = np.concatenate([holes[keep], new])
+    first_missed = np.concatenate([seen[keep], np.full(len(new), float(now))])
+    order = np.argsort(ids, kind="stable")
+    return ids[order], first_missed[order]
+
+
+def missing_event_ids(db, src, after_id, upto_id, holes, seen, now, ttl_s):
+    """Holes of one event table (``src`` 0 = views, 1 = purchases) after a load that moved
+    its watermark from ``after_id`` to ``upto_id``; see :func:`merge_holes`.
+
+    Must run in the load's snapshot (REPEATABLE READ), or rows committed in between
+    would be neither loaded nor tracked. Only gaps followed by a row younger than
+    ``ttl_s`` can still be open transactions; older ones are not tracked.
+    """
+    table = EVENT_TABLES[src]
+    gaps = []
+    if upto_id > after_id:
+        gaps = db.execute(text(GAPS_SQL.format(table=table)),
+                          {"after": int(after_id), "upto": int(upto_id), "recent": float(now - ttl_s)}).fetchall()
+        for lo, hi in gaps:
+            if hi - lo + 1 > HOLE_MAX_GAP:
+                print(f"Not tracking {hi - lo + 1} missing {table} ids {lo}..{hi} (sequence jump?)")
+    visible = []
+    if len(holes):
+        visible = [r[0] for r in db.execute(text(VISIBLE_IDS_SQL.format(table=table)), {"ids": _ids(holes)})]
+    return merge_holes(holes, seen, [(int(lo), int(hi)) for lo, hi in gaps], visible, now, ttl_s)
+
+
+# ------------------------------
+# Matrix construction
+# ------------------------------
+def build_interaction_matrix(data):
+    """Aggregate duplicate (user, item) pairs and build the CSR matrix directly."""
+    started = time.perf_counter()
+    user_ids, rows = np.unique(data.user_ids, return_inverse=True)
+    item_ids, cols = np.unique(data.item_ids, return_inverse=True)
+    n_users, n_items = len(user_ids), len(item_ids)
+
+    # one int64 key per pair; unique keys come back sorted by (row, col), i.e. CSR order
+    pair = rows.astype(np.int64) * n_items + cols
+    keys, inverse = np.unique(pair, return_inverse=True)
+    values = np.bincount(inverse.ravel(), weights=data.weights, minlength=len(keys)).astype(np.float32)
+    del pair, inverse
+
+    key_rows = keys // max(n_items, 1)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key_rows, minlength=n_users), out=indptr[1:])
+    indices = (keys - key_rows * n_items).astype(np.int32)
+    matrix = csr_matrix((values, indices, indptr), shape=(n_users, n_items))
+
+    print(f"Built {n_users}x{n_items} interaction matrix ({len(keys)} pairs from {len(data)} events) "
+          f"in {time.perf_counter() - started:.2f}s, peak RSS {peak_rss_mb():.0f} MiB")
+    return InteractionMatrix(matrix, user_ids, item_ids)
@@ -0,0 +1,402 @@
+"""
+Functionality of this module:
+Cosine top-K neighbor engines shared by the training scripts. Every engine returns
+(distances, indices) shaped like sklearn's NearestNeighbors.kneighbors: one row per sample,
+nearest first, the sample itself included, distance = 1 - cosine similarity.
+    sklearn  - NearestNeighbors(metric="cosine", algorithm="brute") on the whole matrix
+    blocked  - L2-normalized sparse products computed block by block under a memory budget,
+               streaming top-K via argpartition, optionally across worker processes
+    ivf      - approximate: rows are sketched by a random projection, partitioned by spherical
+               k-means (about 2 * sqrt(n) lists) and each row joins its nearest few lists;
+               exact cosines are computed only inside a list, so the work grows like
+               n^1.5 instead of n^2. Rows that met fewer than K others are padded with
+               themselves (dropped when the rows are stored).
+Approximate engines print a recall@K report against exact neighbors of a row sample
+(KNN_RECALL_SAMPLE rows, 0 disables). Self-check against sklearn / recall check:
+    python -m scripts.knn_engines --self-check
+    python -m scripts.knn_engines --recall synthetic|item|user [--lists 0,500] [--probes 2,3,5]
+                                  [--sample 1000] [--out recall.json]
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix, random as sparse_random
+from sklearn.neighbors import NearestNeighbors
+
+ENGINES = ("sklearn", "blocked", "ivf")
+APPROXIMATE_ENGINES = ("ivf",)
+DEFAULT_MEMORY_MB = int(os.getenv("KNN_MEMORY_MB", "512"))
+DEFAULT_WORKERS = int(os.getenv("KNN_WORKERS", "1"))
+# IVF: partitions (0 = 2 * sqrt(n)), partitions each sample joins, random-projection sketch width
+IVF_LISTS = int(os.getenv("KNN_IVF_LISTS", "0"))
+IVF_PROBES = int(os.getenv("KNN_IVF_PROBES", "3"))
+IVF_DIM = int(os.getenv("KNN_IVF_DIM", "64"))
+# rows compared against exact neighbors after an approximate run
+RECALL_SAMPLE = int(os.getenv("KNN_RECALL_SAMPLE", "1000"))
+
+
+# ------------------------------
+# sklearn (reference)
+# ------------------------------
+def sklearn_kneighbors(X, n_neighbors):
+    nn = NearestNeighbors(n_neighbors=n_neighbors, metric="cosine", algorithm="brute", n_jobs=-1)
+    nn.fit(X)
+    return nn.kneighbors(X, return_distance=True)
+
+
+# ------------------------------
+# Blocked sparse top-K
+# ------------------------------
+def l2_normalize_rows(X):
+    X = csr_matrix(X, dtype=np.float32)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    inv = np.zeros_like(norms)
+    nz = norms > 0
+    inv[nz] = 1.0 / norms[nz]
+    return csr_matrix(X.multiply(inv[:, None]), dtype=np.float32)
+
+
+def block_rows_for_budget(n_samples, memory_mb):
+    # a dense (rows x n_samples) float32 similarity block plus argpartition scratch (~3 copies)
+    per_row = max(1, n_samples) * 4 * 3
+    return max(1, int(memory_mb * 1024 * 1024 // per_row))
+
+
+def topk_block(Xn, XnT, start, end, k):
+    """Top-``k`` neighbors (by cosine) of rows ``start:end``; nearest first."""
+    return topk_from_sims((Xn[start:end] @ XnT).toarray(), k)
+
+
+def topk_from_sims(sims, k):
+    """``(distances, indices)`` of the ``k`` largest entries of each row of a dense similarity block."""
+    m, n = sims.shape
+    rows = np.arange(m)
+    # a zero vector has similarity 0 with everything, itself included (sklearn agrees)
+    if k < n:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), (m, n)).copy()
+    part_sims = sims[rows[:, None], part]
+    # nearest first; among equal similarities prefer the lower index for determinism
+    order = np.lexsort((part, -part_sims), axis=1)
+    idx = np.take_along_axis(part, order, axis=1)
+    dist = 1.0 - np.take_along_axis(part_sims, order, axis=1).astype(np.float64)
+    return np.clip(dist, 0.0, 2.0), idx
+
+
+_worker_state = {}
+
+
+def _init_worker(Xn, k):
+    _worker_state["Xn"] = Xn
+    _worker_state["XnT"] = Xn.T.tocsr()
+    _worker_state["k"] = k
+
+
+def _worker_block(bounds):
+    start, end = bounds
+    return start, topk_block(_worker_state["Xn"], _worker_state["XnT"], start, end, _worker_state["k"])
+
+
+def blocked_kneighbors(X, n_neighbors, memory_mb=DEFAULT_MEMORY_MB, workers=DEFAULT_WORKERS):
+    Xn = l2_normalize_rows(X)
+    n = Xn.shape[0]
+    k = min(n_neighbors, n)
+    step = block_rows_for_budget(n, memory_mb / max(1, workers))
+    blocks = [(lo, min(n, lo + step)) for lo in range(0, n, step)]
+
+    distances = np.empty((n, k), dtype=np.float64)
+    indices = np.empty((n, k), dtype=np.int64)
+    if workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(Xn, k)) as ex:
+            for start, (dist, idx) in ex.map(_worker_block, blocks):
+                distances[start:start + len(idx)] = dist
+                indices[start:start + len(idx)] = idx
+    else:
+        XnT = Xn.T.tocsr()
+        for start, end in blocks:
+            distances[start:end], indices[start:end] = topk_block(Xn, XnT, start, end, k)
+    return distances, indices
+
+
+# ------------------------------
+# Inverted-file partitions (approximate)
+# ------------------------------
+def sketch_rows(Xn, dim, rng):
+    """Dense random-projection sketch of the rows, re-normalized (cosines are roughly kept)."""
+    R = rng.standard_normal((Xn.shape[1], dim)).astype(np.float32) / np.sqrt(dim)
+    S = np.asarray(Xn @ R, dtype=np.float32)
+    norms = np.linalg.norm(S, axis=1, keepdims=True)
+    return S / np.maximum(norms, 1e-12)
+
+
+def train_centroids(S, n_lists, iters, rng, sample=50000):
+    """Spherical k-means on a sample of the sketch."""
+    S = S[rng.choice(len(S), size=min(sample, len(S)), replace=False)]
+    C = S[rng.choice(len(S), size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(S @ C.T, axis=1)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, S)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        moved = norms[:, 0] > 0
+        C[moved] = sums[moved] / norms[moved]
+    return C
+
+
+def ivf_lists(S, C, probes, memory_mb):
+    """Members of every list: each row joins the lists of its ``probes`` nearest centroids."""
+    n = len(S)
+    top = np.empty((n, probes), dtype=np.int64)
+    step = max(1, int(memory_mb * 1024 * 1024 // (len(C) * 4 * 3)))
+    for lo in range(0, n, step):
+        sims = S[lo:lo + step] @ C.T
+        top[lo:lo + step] = np.argpartition(-sims, probes - 1, axis=1)[:, :probes]
+    flat = top.ravel()
+    order = np.argsort(flat, kind="stable")
+    owners = order // probes
+    bounds = np.flatnonzero(np.r_[True, flat[order][1:] != flat[order][:-1], True])
+    return [owners[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def merge_topk(best_sims, best_idx, rows, sims, cols, k):
+    """Fold a ``(len(rows), len(cols))`` similarity block into the running top-``k`` of ``rows``."""
+    kk = min(k, sims.shape[1])
+    part = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+    cand_sims = np.concatenate([best_sims[rows], np.take_along_axis(sims, part, axis=1)], axis=1)
+    cand_idx = np.concatenate([best_idx[rows], cols[part]], axis=1)
+    # a neighbor met again through another list must not take two slots
+    order = np.argsort(cand_idx, axis=1, kind="stable")
+    cand_idx = np.take_along_axis(cand_idx, order, axis=1)
+    cand_sims = np.take_along_axis(cand_sims, order, axis=1)
+    dup = np.zeros(cand_idx.shape, dtype=bool)
+    dup[:, 1:] = (cand_idx[:, 1:] == cand_idx[:, :-1]) & (cand_idx[:, 1:] >= 0)
+    # an empty slot, not a worse copy: a row with fewer than k candidates keeps it
+    cand_sims[dup] = -np.inf
+    cand_idx[dup] = -1
+    keep = np.argpartition(-cand_sims, k - 1, axis=1)[:, :k]
+    best_sims[rows] = np.take_along_axis(cand_sims, keep, axis=1)
+    best_idx[rows] = np.take_along_axis(cand_idx, keep, axis=1)
+
+
+def ivf_kneighbors(X, n_neighbors, lists=IVF_LISTS, probes=IVF_PROBES, dim=IVF_DIM, iters=10,
+                   memory_mb=DEFAULT_MEMORY_MB, seed=0):
+    Xn = l2_normalize_rows(X)
+    n = Xn.shape[0]
+    k = min(n_neighbors, n)
+    rng = np.random.default_rng(seed)
+    n_lists = min(n, lists if lists > 0 else max(1, int(round(2 * np.sqrt(n)))))
+    probes = min(probes, n_lists)
+
+    S = sketch_rows(Xn, dim, rng)
+    members = ivf_lists(S, train_centroids(S, n_lists, iters, rng), probes, memory_mb)
+    del S
+
+    best_sims = np.full((n, k), -np.inf, dtype=np.float32)
+    best_idx = np.full((n, k), -1, dtype=np.int64)
+    for rows in members:
+        block = Xn[rows]
+        blockT = block.T.tocsr()
+        # exact cosines inside the list, a row block at a time under the memory budget
+        step = block_rows_for_budget(len(rows), memory_mb)
+        for lo in range(0, len(rows), step):
+            sims = (block[lo:lo + step] @ blockT).toarray()
+            merge_topk(best_sims, best_idx, rows[lo:lo + step], sims, rows, k)
+
+    # nearest first, equal similarities by lower index (like the exact engines); rows that
+    # met fewer than k others are padded with themselves at distance 1
+    order = np.lexsort((best_idx, -best_sims), axis=1)
+    best_idx = np.take_along_axis(best_idx, order, axis=1)
+    best_sims = np.take_along_axis(best_sims, order, axis=1)
+    empty = best_idx < 0
+    best_idx[empty] = np.broadcast_to(np.arange(n)[:, None], (n, k))[empty]
+    distances = np.where(empty, 1.0, np.clip(1.0 - best_sims.astype(np.float64), 0.0, 2.0))
+    return distances, best_idx
+
+
+# ------------------------------
+# Recall@K against exact neighbors
+# ------------------------------
+def recall_at_k(X, distances, indices, sample=RECALL_SAMPLE, memory_mb=DEFAULT_MEMORY_MB, seed=0, atol=1e-6):
+    """Recall@K of approximate ``(distances, indices)`` on a random row sample.
+
+    Self-matches are ignored. A returned neighbor counts as a hit when its
+    similarity reaches the exact K-th best (so ties at the cut-off are not
+    penalized). Returns a report dict including the exact-search timing.
+    """
+    Xn = l2_normalize_rows(X)
+    n, k = indices.shape
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+    XnT = Xn.T.tocsr()
+
+    started = time.perf_counter()
+    step = block_rows_for_budget(n, memory_mb)
+    exact = [topk_from_sims((Xn[rows[lo:lo + step]] @ XnT).toarray(), k) for lo in range(0, len(rows), step)]
+    exact_s = time.perf_counter() - started
+    ref_d = np.concatenate([d for d, _ in exact])
+    ref_i = np.concatenate([i for _, i in exact])
+
+    recalls = []
+    for r, row in enumerate(rows):
+        ref = 1.0 - ref_d[r][ref_i[r] != row]
+        if len(ref) == 0 or ref.max() <= 0:
+            continue  # no neighbor with any overlap: nothing to recall
+        got = 1.0 - distances[row][indices[row] != row]
+        hits = min(len(ref), int(np.count_nonzero(got >= ref.min() - atol)))
+        recalls.append(hits / len(ref))
+    recalls = np.asarray(recalls)
+    return {
+        "k": k,
+        "sample_rows": len(rows),
+        "scored_rows": len(recalls),
+        "recall_at_k": float(recalls.mean()) if len(recalls) else None,
+        "recall_p10": float(np.percentile(recalls, 10)) if len(recalls) else None,
+        "full_recall_share": float(np.mean(recalls == 1.0)) if len(recalls) else None,
+        "exact_sample_s": exact_s,
+        "exact_full_estimate_s": exact_s * n / max(1, len(rows)),
+    }
+
+
+def print_recall(report, engine, elapsed_s=None):
+    took = f" in {elapsed_s:.1f}s" if elapsed_s is not None else ""
+    print(f"{engine}{took}: recall@{report['k'] - 1}={report['recall_at_k']:.3f} "
+          f"(p10 {report['recall_p10']:.3f}, {report['scored_rows']} rows); "
+          f"exact search estimated at {report['exact_full_estimate_s']:.1f}s")
+
+
+# ------------------------------
+# Dispatch + self-check
+# ------------------------------
+def kneighbors(X, n_neighbors, engine="sklearn", memory_mb=DEFAULT_MEMORY_MB, workers=DEFAULT_WORKERS):
+    n_neighbors = min(n_neighbors, X.shape[0])
+    if engine == "sklearn":
+        return sklearn_kneighbors(X, n_neighbors)
+    if engine == "blocked":
+        return blocked_kneighbors(X, n_neighbors, memory_mb=memory_mb, workers=workers)
+    if engine == "ivf":
+        started = time.perf_counter()
+        distances, indices = ivf_kneighbors(X, n_neighbors, memory_mb=memory_mb)
+        elapsed = time.perf_counter() - started
+        if RECALL_SAMPLE > 0:
+            report = recall_at_k(X, distances, indices, RECALL_SAMPLE, memory_mb=memory_mb)
+            if report["recall_at_k"] is not None:
+                print_recall(report, engine, elapsed)
+        return distances, indices
+    raise ValueError(f"Unknown KNN engine '{engine}' (expected one of {', '.join(ENGINES)})")
+
+
+def self_check(n_samples=400, n_features=300, density=0.03, n_neighbors=11, seed=0,
+               memory_mb=1, workers=2, atol=1e-5):
+    """Compare the blocked engine with sklearn on random sparse data.
+
+    Neighbor *distances* must match row by row; neighbor sets may only differ
+    where distances tie at the K-th position. IVF on tiny lists must return
+    distinct neighbors with exact distances.
+    """
+    X = sparse_random(n_samples, n_features, density=density, format="csr",
+                      random_state=seed, dtype=np.float64)
+    ref_d, ref_i = sklearn_kneighbors(X, n_neighbors)
+    got_d, got_i = blocked_kneighbors(X, n_neighbors, memory_mb=memory_mb, workers=workers)
+
+    dist_ok = np.allclose(np.sort(ref_d, axis=1), np.sort(got_d, axis=1), atol=atol)
+    Xd = l2_normalize_rows(X).toarray().astype(np.float64)
+    full_d = 1.0 - Xd @ Xd.T
+    set_mismatch = 0
+    for r in range(n_samples):
+        diff = np.array(sorted(set(ref_i[r]) ^ set(got_i[r])), dtype=np.int64)
+        # only acceptable when every differing neighbor sits at the cut-off distance
+        if len(diff) and not np.allclose(full_d[r, diff], ref_d[r].max(), atol=atol):
+            set_mismatch += 1
+    print(f"self-check: distances {'match' if dist_ok else 'DIFFER'}, "
+          f"{set_mismatch} rows with non-tie neighbor differences")
+
+    # IVF with lists so small that some rows meet fewer than k others: every returned
+    # neighbor must be distinct and carry its exact distance, the rest self-padding
+    ivf_d, ivf_i = ivf_kneighbors(X, n_neighbors, lists=max(1, n_samples // 4), probes=2, dim=16,
+                                  memory_mb=memory_mb, seed=seed)
+    ivf_bad = 0
+    for r in range(n_samples):
+        other = ivf_i[r] != r
+        nbrs = ivf_i[r][other]
+        if len(np.unique(nbrs)) != len(nbrs) or not np.allclose(
+                ivf_d[r][other], np.clip(full_d[r, nbrs], 0.0, 2.0), atol=atol):
+            ivf_bad += 1
+    short = np.mean(np.sum(ivf_i != np.arange(n_samples)[:, None], axis=1) < n_neighbors - 1)
+    print(f"self-check: ivf {ivf_bad} rows with repeated neighbors or wrong distances "
+          f"({short:.0%} of rows short of k)")
+    return dist_ok and set_mismatch == 0 and ivf_bad == 0
+
+
+def clustered_matrix(n_samples=20000, n_features=5000, n_clusters=200, per_row=20, noise=0.2, seed=0):
+    """Sparse interaction-like rows drawn around cluster "tastes" (real neighbors exist)."""
+    rng = np.random.default_rng(seed)
+    tastes = rng.integers(0, n_features, size=(n_clusters, per_row * 2))
+    cluster = rng.integers(0, n_clusters, size=n_samples)
+    cols = tastes[cluster[:, None], rng.integers(0, per_row * 2, size=(n_samples, per_row))]
+    random_cols = rng.integers(0, n_features, size=(n_samples, per_row))
+    cols = np.where(rng.random((n_samples, per_row)) < noise, random_cols, cols)
+    rows = np.repeat(np.arange(n_samples), per_row)
+    X = csr_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols.ravel())), shape=(n_samples, n_features))
+    X.sum_duplicates()
+    return X
+
+
+def recall_check(X, n_neighbors=11, lists=IVF_LISTS, probes=IVF_PROBES, dim=IVF_DIM,
+                 sample=RECALL_SAMPLE, memory_mb=DEFAULT_MEMORY_MB):
+    """IVF timing and recall@K on ``X`` for one parameter setting."""
+    started = time.perf_counter()
+    distances, indices = ivf_kneighbors(X, n_neighbors, lists=lists, probes=probes, dim=dim, memory_mb=memory_mb)
+    elapsed = time.perf_counter() - started
+    report = recall_at_k(X, distances, indices, sample, memory_mb=memory_mb)
+    report.update({"engine": "ivf", "samples": X.shape[0], "features": X.shape[1], "lists": lists,
+                   "probes": probes, "dim": dim, "ivf_s": elapsed})
+    if report["recall_at_k"] is not None:
+        print_recall(report, f"ivf lists={lists or 'auto'} probes={probes}", elapsed)
+    return report
+
+
+def load_matrix(target):
+    # interaction matrix straight from the database: items as rows for "item", users for "user"
+    from app.db import SessionLocal
+    from scripts.interactions import build_interaction_matrix, load_interactions
+
+    db = SessionLocal()
+    try:
+        im = build_interaction_matrix(load_interactions(db))
+    finally:
+        db.close()
+    return im.matrix.T.tocsr() if target == "item" else im.matrix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--self-check", action="store_true")
+    parser.add_argument("--samples", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--recall", choices=("synthetic", "item", "user"),
+                        help="IVF recall@K vs exact search on clustered random data or the DB matrix")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", default=str(IVF_LISTS), help="comma-separated values to sweep (0 = auto)")
+    parser.add_argument("--probes", default=str(IVF_PROBES), help="comma-separated values to sweep")
+    parser.add_argument("--dim", type=int, default=IVF_DIM)
+    parser.add_argument("--sample", type=int, default=RECALL_SAMPLE)
+    parser.add_argument("--out", help="write the recall reports as JSON")
+    args = parser.parse_args()
+    if args.self_check:
+        raise SystemExit(0 if self_check(n_samples=args.samples, workers=args.workers) else 1)
+    if args.recall:
+        X = clustered_matrix() if args.recall == "synthetic" else load_matrix(args.recall)
+        reports = [recall_check(X, args.k + 1, lists=int(lists), probes=int(probes), dim=args.dim,
+                                sample=args.sample)
+                   for lists in args.lists.split(",") for probes in args.probes.split(",")]
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(reports, f, indent=2)
+            print(f"Wrote {args.out}")
+        raise SystemExit(0)
+    parser.print_help()
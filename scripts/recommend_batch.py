@@ -0,0 +1,135 @@
+"""
+Functionality of this script:
+Bulk hybrid recommendations for many (user, location) pairs, e.g. to precompute push/email
+campaigns. Requests are read from a CSV or JSONL file (user_id, lat, lon[, radius_km]) and
+scored batch by batch with the same pipeline as POST /recommend/products:batch: one profile
+query per batch, one candidate fetch per geo cell and vectorized item-CF per cell. Results
+stream to JSONL (one object per request) or Parquet (one row per recommended product;
+needs pyarrow). Throughput is reported per batch.
+Usage:
+    python -m scripts.recommend_batch requests.csv --out recs.jsonl [--limit 20] [--radius-km 5]
+                                      [--batch-size 5000]
+"""
+
+import argparse
+import csv
+import json
+import time
+from app.db import SessionLocal
+from app.services.batch_recommendation import recommend_products_batch
+from app.services.scoring import get_weight_profile
+from app.services.shop_locator import get_shop_locator
+from app.services.similarity_index import load_item_index
+from app.services.user_cf import load_user_cf_model
+
+PARQUET_COLUMNS = ("user_id", "lat", "lon", "rank", "product_id", "shop_id", "category_id", "score", "cf_score")
+
+
+def read_requests(path, radius_km):
+    """Yield ``(user_id, lat, lon, radius_km)`` from a CSV (with header) or JSONL file."""
+    with open(path, newline="") as f:
+        rows = (json.loads(line) for line in f if line.strip()) if path.endswith(".jsonl") else csv.DictReader(f)
+        for r in rows:
+            yield (int(r["user_id"]), float(r["lat"]), float(r["lon"]),
+                   float(r.get("radius_km") or radius_km))
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class JsonlSink:
+    def __init__(self, path):
+        self.f = open(path, "w")
+
+    def write(self, request, recs):
+        user_id, lat, lon, _ = request
+        self.f.write(json.dumps({"user_id": user_id, "lat": lat, "lon": lon, "recommended_products": recs}))
+        self.f.write("\n")
+
+    def flush_batch(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetSink:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use a .jsonl path instead.")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("user_id", pa.int64()), ("lat", pa.float64()), ("lon", pa.float64()), ("rank", pa.int32()),
+            ("product_id", pa.int64()), ("shop_id", pa.int64()), ("category_id", pa.int64()),
+            ("score", pa.float64()), ("cf_score", pa.float64()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.columns = {c: [] for c in PARQUET_COLUMNS}
+
+    def write(self, request, recs):
+        user_id, lat, lon, _ = request
+        for rank, r in enumerate(recs, 1):
+            for name, value in (("user_id", user_id), ("lat", lat), ("lon", lon), ("rank", rank),
+                                ("product_id", r["product_id"]), ("shop_id", r["shop_id"]),
+                                ("category_id", r["category_id"]), ("score", r["score"]),
+                                ("cf_score", r["cf_score"])):
+                self.columns[name].append(value)
+
+    def flush_batch(self):
+        # one row group per batch keeps memory bounded by the batch size
+        self.writer.write_table(self.pa.table(self.columns, schema=self.schema))
+        self.columns = {c: [] for c in PARQUET_COLUMNS}
+
+    def close(self):
+        self.writer.close()
+
+
+def run(input_path, out_path, limit=20, radius_km=5.0, batch_size=5000):
+    db = SessionLocal()
+    load_item_index(db)
+    get_shop_locator().refresh(db)
+    if get_weight_profile().user_cf > 0:
+        load_user_cf_model(db)
+
+    sink = ParquetSink(out_path) if out_path.endswith(".parquet") else JsonlSink(out_path)
+    started = time.perf_counter()
+    total = products = 0
+    try:
+        for n, batch in enumerate(batched(read_requests(input_path, radius_km), batch_size), 1):
+            t0 = time.perf_counter()
+            for p, _, recs in recommend_products_batch(db, batch, limit):
+                sink.write(batch[p], recs)
+                products += len(recs)
+            sink.flush_batch()
+            total += len(batch)
+            elapsed = time.perf_counter() - t0
+            print(f"batch {n}: {len(batch)} requests in {elapsed:.2f}s "
+                  f"({len(batch) / max(elapsed, 1e-9):.0f} req/s), total {total} "
+                  f"({total / (time.perf_counter() - started):.0f} req/s overall)")
+    finally:
+        sink.close()
+        db.close()
+    print(f"Wrote {total} requests / {products} recommendations to {out_path} "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="CSV (with header) or .jsonl of user_id, lat, lon[, radius_km]")
+    parser.add_argument("--out", default="recommendations.jsonl", help=".jsonl or .parquet")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--radius-km", type=float, default=5.0, help="radius for rows without radius_km")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    run(args.input, args.out, args.limit, args.radius_km, args.batch_size)
@@ -1,26 +1,56 @@
 """
 Functionality of this script:
-Produce top-N item recommendations for a specific user_id using item_similarity table.
+Produce top-N item recommendations for one or many users from item-item similarities: the
+sum of the neighbor scores of the items a user has seen, seen items excluded, with the top
+trending products as the fallback for users without any.
+Two sources:
+    - the database (item_similarity, events, products), a few queries per user,
+    - a local snapshot file (--snapshot) holding the item neighbors, every user's seen items
+      (inside INTERACTION_WINDOW_DAYS), the global trending top-N and product details. All
+      users of a run are scored at once as one sparse product (seen x neighbors), so
+      thousands of users take seconds and no database connection.
+Build the snapshot with --build-snapshot (neighbors come from MODEL_DIR/item_similarity.knn,
+or item_similarity when no artifact is published).
 Usage:
-    python scripts/recommend_item_knn.py <user_id> [--limit 5]
+    python -m scripts.recommend_item_knn <user_id> [<user_id> ...] [--limit 5]
+    python -m scripts.recommend_item_knn --build-snapshot [--snapshot models/recommend_snapshot.npz]
+                                         [--trending-n 1000]
+    python -m scripts.recommend_item_knn --snapshot models/recommend_snapshot.npz
+                                         [<user_id> ...] [--users-file users.txt] [--out recs.jsonl]
 """
 
 import argparse
+import json
+import os
+import time
 from collections import defaultdict
+import numpy as np
+from scipy.sparse import csr_matrix
 from sqlalchemy import text
+from app.config import MODEL_DIR
 from app.db import SessionLocal
+from app.services.interaction_decay import window_sql
+from app.services.similarity_index import ItemSimilarityIndex, load_item_index
+from app.services.user_profile import get_user_profile
+
+DEFAULT_SNAPSHOT = MODEL_DIR / "recommend_snapshot.npz"
+TRENDING_N = 1000
+
+TRENDING_QUERY = text("SELECT id, name FROM products ORDER BY weekly_sales DESC, daily_views DESC, id LIMIT :l")
+
+# distinct (user, product) pairs of the profile events, grouped by user
+SEEN_ITEMS_QUERY = text(f"""
+    SELECT user_id, product_id FROM product_view_events WHERE {window_sql("created_at")}
+    UNION
+    SELECT user_id, product_id FROM purchase_events WHERE {window_sql("created_at")}
+""")
+
+PRODUCTS_QUERY = text("SELECT id, name, shop_id, category_id FROM products ORDER BY id")
+
+_trending = {}  # limit -> rows; the fallback is the same for every cold user of a run
 
 def get_user_seen_items(db, user_id):
-    q = text("""
-        SELECT DISTINCT product_id
-        FROM (
-            SELECT product_id FROM product_view_events WHERE user_id = :u
-            UNION
-            SELECT product_id FROM purchase_events WHERE user_id = :u
-        ) x
-    """)
-    rows = db.execute(q, {"u": user_id}).fetchall()
-    return set(r[0] for r in rows)
+    return set(get_user_profile(db, user_id).seen_items)
 
 def get_similar_items_for_items(db, item_ids):
     if not item_ids:
@@ -47,13 +77,16 @@ def get_product_details(db, pids):
     rows = db.execute(q, {"ids": list(pids)}).fetchall()
     return {r[0]: {"name": r[1], "shop_id": r[2], "category_id": r[3]} for r in rows}
 
+def get_trending_fallback(db, limit):
+    if limit not in _trending:
+        _trending[limit] = db.execute(TRENDING_QUERY, {"l": limit}).fetchall()
+    return [{"product_id": r[0], "product_name": r[1], "score": None} for r in _trending[limit]]
+
 def recommend_top_k(db, user_id, limit=5):
     seen = get_user_seen_items(db, user_id)
     if not seen:
         # fallback to top trending products
-        q = text("SELECT id, name FROM products ORDER BY weekly_sales DESC, daily_views DESC LIMIT :l")
-        rows = db.execute(q, {"l": limit}).fetchall()
-        return [{"product_id": r[0], "product_name": r[1], "score": None} for r in rows]
+        return get_trending_fallback(db, limit)
 
     similar = get_similar_items_for_items(db, list(seen))
     score_agg = defaultdict(float)
@@ -65,9 +98,7 @@ def recommend_top_k(db, user_id, limit=5):
             score_agg[sim_id] += score
 
     if not score_agg:
-        q = text("SELECT id, name FROM products ORDER BY weekly_sales DESC, daily_views DESC LIMIT :l")
-        rows = db.execute(q, {"l": limit}).fetchall()
-        return [{"product_id": r[0], "product_name": r[1], "score": None} for r in rows]
+        return get_trending_fallback(db, limit)
 
     ranked = sorted(score_agg.items(), key=lambda x: x[1], reverse=True)[:limit]
     pids = [pid for pid, _ in ranked]
@@ -85,15 +116,188 @@ def recommend_top_k(db, user_id, limit=5):
         })
     return results
 
+class LocalSnapshot:
+    """Everything recommend_top_k reads, as arrays over a dense product index.
+
+    Products are sorted by id (``product_ids[i]`` is product ``i``); ``neighbors`` and
+    ``seen`` are CSR matrices over that index (item x item scores, user x item), the
+    rows of ``seen`` follow the sorted ``user_ids``. ``trending`` holds product indices
+    in fallback order. Names are one utf-8 blob cut at ``name_offsets``.
+    """
+
+    def __init__(self, product_ids, shop_ids, category_ids, name_blob, name_offsets,
+                 neighbors, user_ids, seen, trending, version=None):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.shop_ids = np.asarray(shop_ids, dtype=np.int64)
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)  # -1 = none
+        self.name_blob = bytes(name_blob)
+        self.name_offsets = np.asarray(name_offsets, dtype=np.int64)
+        self.neighbors = csr_matrix(neighbors, dtype=np.float64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.seen = csr_matrix(seen, dtype=np.float64)
+        self.trending = np.asarray(trending, dtype=np.int64)
+        self.version = version
+
+    def index_of(self, ids):
+        """Dense indices of product ids; -1 for unknown products."""
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(self.product_ids, ids)
+        pos[pos >= len(self.product_ids)] = 0
+        return np.where(self.product_ids[pos] == ids, pos, -1) if len(self.product_ids) else np.full(len(ids), -1)
+
+    def name(self, i):
+        return self.name_blob[self.name_offsets[i]:self.name_offsets[i + 1]].decode()
+
+    @classmethod
+    def build(cls, db, trending_n=TRENDING_N):
+        products = db.execute(PRODUCTS_QUERY).fetchall()
+        product_ids = np.array([r[0] for r in products], dtype=np.int64)
+        names = [(r[1] or "").encode() for r in products]
+        name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(n) for n in names], out=name_offsets[1:])
+        snap = cls(product_ids, [r[2] for r in products],
+                   [-1 if r[3] is None else r[3] for r in products],
+                   b"".join(names), name_offsets, csr_matrix((len(products), len(products))),
+                   [], csr_matrix((0, len(products))), [])
+
+        index = load_item_index(db) or ItemSimilarityIndex.empty()
+        keys, nbrs, scores = index.triplets()
+        rows, cols = snap.index_of(keys), snap.index_of(nbrs)
+        ok = (rows >= 0) & (cols >= 0)
+        n = len(product_ids)
+        snap.neighbors = csr_matrix((scores[ok].astype(np.float64), (rows[ok], cols[ok])), shape=(n, n))
+        snap.version = index.version
+
+        pairs = np.array(db.execute(SEEN_ITEMS_QUERY).fetchall(), dtype=np.int64).reshape(-1, 2)
+        user_ids, user_rows = np.unique(pairs[:, 0], return_inverse=True)
+        cols = snap.index_of(pairs[:, 1])
+        ok = cols >= 0
+        snap.user_ids = user_ids
+        snap.seen = csr_matrix((np.ones(int(ok.sum())), (user_rows.ravel()[ok], cols[ok])), shape=(len(user_ids), n))
+        snap.seen.data[:] = 1.0  # a user counts each seen item once
+
+        trending = db.execute(TRENDING_QUERY, {"l": trending_n}).fetchall()
+        snap.trending = snap.index_of([r[0] for r in trending])
+        return snap
+
+    def save(self, path):
+        path = os.fspath(path)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            np.savez(f, product_ids=self.product_ids, shop_ids=self.shop_ids, category_ids=self.category_ids,
+                     name_blob=np.frombuffer(self.name_blob, dtype=np.uint8), name_offsets=self.name_offsets,
+                     nb_data=self.neighbors.data, nb_indices=self.neighbors.indices, nb_indptr=self.neighbors.indptr,
+                     user_ids=self.user_ids, seen_indices=self.seen.indices, seen_indptr=self.seen.indptr,
+                     trending=self.trending, version=np.array(self.version or ""))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            n = len(z["product_ids"])
+            neighbors = csr_matrix((z["nb_data"], z["nb_indices"], z["nb_indptr"]), shape=(n, n))
+            seen = csr_matrix((np.ones(len(z["seen_indices"])), z["seen_indices"], z["seen_indptr"]),
+                              shape=(len(z["user_ids"]), n))
+            return cls(z["product_ids"], z["shop_ids"], z["category_ids"], z["name_blob"].tobytes(),
+                       z["name_offsets"], neighbors, z["user_ids"], seen, z["trending"],
+                       version=str(z["version"]) or None)
+
+    def recommend(self, user_ids, limit=5):
+        """Recommendations of every user in ``user_ids`` (same order), like :func:`recommend_top_k`."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        pos = np.searchsorted(self.user_ids, user_ids)
+        pos[pos >= len(self.user_ids)] = 0
+        known = (self.user_ids[pos] == user_ids) if len(self.user_ids) else np.zeros(len(user_ids), dtype=bool)
+
+        # one sparse product for all users: row u = summed neighbor scores of u's seen items
+        seen = self.seen[pos[known]]
+        scores = (seen @ self.neighbors).tocsr()
+        scores = scores - scores.multiply(seen)  # seen items are never recommended
+        scores.eliminate_zeros()
+        coo = scores.tocoo()
+        r, c, v = coo.row, coo.col, coo.data
+        order = np.lexsort((c, -v, r))  # per user: best score first, lower product id on ties
+        r, c, v = r[order], c[order], v[order]
+        first = np.searchsorted(r, np.arange(seen.shape[0]))
+        keep = np.arange(len(r)) - first[r] < limit
+        r, c, v = r[keep], c[keep], v[keep]
+        bounds = np.searchsorted(r, np.arange(seen.shape[0] + 1))
+
+        fallback = [{"product_id": int(self.product_ids[i]), "product_name": self.name(i), "score": None}
+                    for i in self.trending[:limit] if i >= 0]
+        out, row = [], 0
+        for is_known in known:
+            if not is_known:
+                out.append(fallback)
+                continue
+            lo, hi = bounds[row], bounds[row + 1]
+            row += 1
+            if lo == hi:
+                out.append(fallback)
+                continue
+            out.append([{
+                "product_id": int(self.product_ids[i]),
+                "product_name": self.name(i),
+                "shop_id": int(self.shop_ids[i]),
+                "category_id": None if self.category_ids[i] < 0 else int(self.category_ids[i]),
+                "score": round(float(s), 6),
+            } for i, s in zip(c[lo:hi], v[lo:hi])])
+        return out
+
+def read_user_ids(path):
+    """User ids from a file, one per line (a header line such as ``user_id`` is skipped)."""
+    with open(path) as f:
+        return [int(line.split(",")[0]) for line in f if line.strip() and line.split(",")[0].strip().isdigit()]
+
+def print_recs(user_id, recs, limit):
+    print(f"Top {limit} recommendations for user {user_id}:")
+    for i, r in enumerate(recs, 1):
+        print(f"{i}. {r['product_name']} (id={r['product_id']}) score={r['score']}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("user_id", type=int)
+    parser.add_argument("user_ids", type=int, nargs="*")
+    parser.add_argument("--users-file", help="one user id per line")
     parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--snapshot", help="score from this local snapshot instead of the database")
+    parser.add_argument("--build-snapshot", action="store_true", help="write the snapshot (--snapshot path) and exit")
+    parser.add_argument("--trending-n", type=int, default=TRENDING_N)
+    parser.add_argument("--out", help="write JSONL ({user_id, recommendations}) instead of printing")
     args = parser.parse_args()
 
-    db = SessionLocal()
-    recs = recommend_top_k(db, args.user_id, args.limit)
-    print(f"Top {args.limit} recommendations for user {args.user_id}:")
-    for i, r in enumerate(recs, 1):
-        print(f"{i}. {r['product_name']} (id={r['product_id']}) score={r['score']}")
-    db.close()
\ No newline at end of file
+    if args.build_snapshot:
+        path = args.snapshot or DEFAULT_SNAPSHOT
+        started = time.perf_counter()
+        db = SessionLocal()
+        snap = LocalSnapshot.build(db, args.trending_n)
+        db.close()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        snap.save(path)
+        print(f"Snapshot {path}: {len(snap.product_ids)} products, {snap.neighbors.nnz} neighbor pairs, "
+              f"{len(snap.user_ids)} users, {snap.seen.nnz} seen pairs in {time.perf_counter() - started:.2f}s")
+        raise SystemExit(0)
+
+    user_ids = list(args.user_ids) + (read_user_ids(args.users_file) if args.users_file else [])
+    if not user_ids:
+        parser.error("give user ids, --users-file or --build-snapshot")
+
+    started = time.perf_counter()
+    if args.snapshot:
+        snap = LocalSnapshot.load(args.snapshot)
+        loaded = time.perf_counter()
+        results = snap.recommend(user_ids, args.limit)
+        print(f"Scored {len(user_ids)} users from {args.snapshot} (model {snap.version}) in "
+              f"{time.perf_counter() - loaded:.2f}s (load {loaded - started:.2f}s)")
+    else:
+        db = SessionLocal()
+        results = [recommend_top_k(db, u, args.limit) for u in user_ids]
+        db.close()
+        print(f"Scored {len(user_ids)} users from the database in {time.perf_counter() - started:.2f}s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            for user_id, recs in zip(user_ids, results):
+                f.write(json.dumps({"user_id": user_id, "recommendations": recs}) + "\n")
+    else:
+        for user_id, recs in zip(user_ids, results):
+            print_recs(user_id, recs, args.limit)
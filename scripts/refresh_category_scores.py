@@ -0,0 +1,67 @@
+"""
+Functionality of this script:
+Maintain user_category_scores, the decayed per-user/per-category event weights served as
+category affinities when USER_CATEGORY_SCORES_ENABLED is set. The event writer behind
+POST /events/* folds new events in as they are flushed; this job handles what it cannot:
+    - events leaving the lookback window (INTERACTION_WINDOW_DAYS) since the last run are
+      subtracted, so the aggregates always cover exactly the window,
+    - aggregates that decayed below USER_CATEGORY_MIN_SCORE are deleted.
+--full rebuilds the table from the events inside the window; run it once when enabling the
+feature, after changing the decay/window settings and after loading events out-of-band.
+Usage:
+    python -m scripts.refresh_category_scores [--full]
+"""
+
+import argparse
+import time
+from datetime import timedelta
+from sqlalchemy import text
+from app.db import SessionLocal
+from app.services.interaction_decay import (
+    EXPIRE_CATEGORY_SCORES_SQL,
+    PRUNE_CATEGORY_SCORES_SQL,
+    REBUILD_CATEGORY_SCORES_SQL,
+    USER_CATEGORY_MIN_SCORE,
+    window_seconds,
+)
+from scripts.refresh_trending import get_watermark, set_watermark
+
+JOB_NAME = "refresh_category_scores"
+
+def refresh_category_scores(db, full=False):
+    started = time.perf_counter()
+    run_ts = db.execute(text("SELECT now()")).scalar()
+    window = window_seconds()
+    # the watermark is the window start of the previous run: events before it are out already
+    boundary = run_ts - timedelta(seconds=window) if window is not None else None
+    since = None if full else get_watermark(db, JOB_NAME)
+
+    if full or (window is not None and since is None):
+        # writers keep upserting while this runs; the lock makes them wait for the swap
+        db.execute(text("LOCK TABLE user_category_scores IN EXCLUSIVE MODE"))
+        db.execute(text("DELETE FROM user_category_scores"))
+        touched = db.execute(REBUILD_CATEGORY_SCORES_SQL, {"as_of": run_ts}).rowcount
+        mode = "full"
+    elif window is not None and since < boundary:
+        touched = db.execute(EXPIRE_CATEGORY_SCORES_SQL,
+                             {"since": since, "until": boundary, "as_of": run_ts}).rowcount
+        mode = f"expired events in [{since}, {boundary})"
+    else:
+        touched = 0
+        mode = "nothing expired" if window is not None else "no window"
+    pruned = db.execute(PRUNE_CATEGORY_SCORES_SQL, {"as_of": run_ts, "min_score": USER_CATEGORY_MIN_SCORE}).rowcount
+    set_watermark(db, JOB_NAME, boundary, touched)
+    db.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"Category scores refresh ({mode}): {touched} rows updated, {pruned} pruned in {elapsed:.3f}s")
+    return {"rows_touched": touched, "rows_pruned": pruned, "elapsed_s": elapsed, "watermark": boundary}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="rebuild from the events inside the window")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    refresh_category_scores(db, full=args.full)
+    db.close()
@@ -0,0 +1,73 @@
+"""
+Functionality of this script:
+Incrementally refresh products.trending_score (the squashed trending component used by the
+hybrid recommender). Only products never scored, or whose updated_at moved past the stored
+watermark, are recomputed. A trigger on products (scripts/schema.sql) bumps updated_at on
+every daily_views/weekly_sales change; --full is only needed for edits made with triggers
+disabled (e.g. COPY restores or session_replication_role = replica).
+Usage:
+    python -m scripts.refresh_trending [--full] [--overlap-s 60]
+"""
+
+import argparse
+import time
+from sqlalchemy import text
+from app.db import SessionLocal
+from app.services.scoring import TRENDING_SQL
+
+JOB_NAME = "refresh_trending"
+
+def get_watermark(db, job_name):
+    row = db.execute(text("SELECT watermark FROM recsys_job_state WHERE job_name = :j"),
+                     {"j": job_name}).fetchone()
+    return row[0] if row else None
+
+def set_watermark(db, job_name, watermark, rows_touched):
+    db.execute(text("""
+        INSERT INTO recsys_job_state (job_name, watermark, last_run_at, rows_touched)
+        VALUES (:j, :w, now(), :n)
+        ON CONFLICT (job_name) DO UPDATE
+        SET watermark = EXCLUDED.watermark,
+            last_run_at = EXCLUDED.last_run_at,
+            rows_touched = EXCLUDED.rows_touched
+    """), {"j": job_name, "w": watermark, "n": rows_touched})
+
+def refresh_trending(db, full=False, overlap_s=60):
+    started = time.perf_counter()
+    # rows committed while we run carry updated_at <= this timestamp at the latest;
+    # the overlap re-checks rows from transactions that were still open
+    run_ts = db.execute(text("SELECT now()")).scalar()
+    watermark = None if full else get_watermark(db, JOB_NAME)
+
+    if watermark is None:
+        where = "TRUE"
+        params = {}
+    else:
+        where = ("p.trending_score IS NULL "
+                 "OR p.updated_at > CAST(:wm AS timestamptz) - make_interval(secs => :overlap)")
+        params = {"wm": watermark, "overlap": float(overlap_s)}
+
+    res = db.execute(text(f"""
+        UPDATE products p
+        SET trending_score = {TRENDING_SQL},
+            trending_refreshed_at = now()
+        WHERE {where}
+    """), params)
+    touched = res.rowcount
+    set_watermark(db, JOB_NAME, run_ts, touched)
+    db.commit()
+
+    elapsed = time.perf_counter() - started
+    mode = "full" if watermark is None else f"incremental since {watermark}"
+    print(f"Trending refresh ({mode}): {touched} rows touched in {elapsed:.3f}s")
+    return {"rows_touched": touched, "elapsed_s": elapsed, "watermark": run_ts}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="recompute every product")
+    parser.add_argument("--overlap-s", type=float, default=60.0)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    refresh_trending(db, full=args.full, overlap_s=args.overlap_s)
+    db.close()
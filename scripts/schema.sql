@@ -55,6 +55,28 @@ CREATE TABLE IF NOT EXISTS products (
   updated_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- Precomputed trending component t/(1+t), t = ln(1+daily_views) + ln(1+weekly_sales).
+-- Maintained incrementally by scripts/refresh_trending.py; NULL means "not computed yet".
+ALTER TABLE products ADD COLUMN IF NOT EXISTS trending_score DOUBLE PRECISION;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS trending_refreshed_at TIMESTAMPTZ;
+
+-- Any write to the counters bumps updated_at, so the incremental refresh sees it even
+-- when the writer (rollover jobs, bulk loads) does not set updated_at itself.
+CREATE OR REPLACE FUNCTION products_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_counters_touch ON products;
+CREATE TRIGGER trg_products_counters_touch
+  BEFORE UPDATE OF daily_views, weekly_sales ON products
+  FOR EACH ROW
+  WHEN (OLD.daily_views IS DISTINCT FROM NEW.daily_views
+        OR OLD.weekly_sales IS DISTINCT FROM NEW.weekly_sales)
+  EXECUTE FUNCTION products_touch_updated_at();
+
 -- Event tracking for personalization
 CREATE TABLE IF NOT EXISTS product_view_events (
   id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -78,6 +100,8 @@ CREATE INDEX IF NOT EXISTS idx_shops_location_gix ON shops USING GIST (location)
 -- Product lookups
 CREATE INDEX IF NOT EXISTS idx_products_shop_id ON products(shop_id);
 CREATE INDEX IF NOT EXISTS idx_products_category_id ON products(category_id);
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products(updated_at);
+CREATE INDEX IF NOT EXISTS idx_products_trending_pending ON products(id) WHERE trending_score IS NULL;
 -- Event time-series + lookups
 CREATE INDEX IF NOT EXISTS idx_pve_user_id_created_at ON product_view_events(user_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_pe_user_id_created_at ON purchase_events(user_id, created_at DESC);
@@ -108,4 +132,23 @@ CREATE TABLE IF NOT EXISTS user_similarity (
     score FLOAT NOT NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_user_similarity_user ON user_similarity(user_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_user_similarity_user ON user_similarity(user_id);
+
+-- Decayed per-user category affinities: sum of the user's event weights as of `as_of`
+-- (read as score * decay(now - as_of)). Folded in by the event writer, expired and
+-- pruned by scripts/refresh_category_scores.py.
+CREATE TABLE IF NOT EXISTS user_category_scores (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category_id INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+    score DOUBLE PRECISION NOT NULL,
+    as_of TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (user_id, category_id)
+);
+
+-- Watermarks of incremental maintenance jobs (trending refresh, incremental training, ...)
+CREATE TABLE IF NOT EXISTS recsys_job_state (
+    job_name VARCHAR(64) PRIMARY KEY,
+    watermark TIMESTAMPTZ,
+    last_run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    rows_touched BIGINT NOT NULL DEFAULT 0
+);
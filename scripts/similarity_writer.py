@@ -0,0 +1,209 @@
+"""
+Functionality of this module:
+Stream KNN neighbor rows into item_similarity / user_similarity without per-row Python objects.
+Rows are encoded straight from NumPy arrays into PostgreSQL's binary COPY format, loaded into
+a staging table, and swapped in atomically so readers never see a partially filled table.
+The same neighbors are published as the memory-mapped artifact the API serves from.
+"""
+
+import os
+import struct
+import time
+import numpy as np
+from sqlalchemy import text
+from app.config import MODEL_DIR
+from app.services.similarity_index import ITEM_INDEX_FILE, USER_INDEX_FILE, ItemSimilarityIndex
+
+# table -> (key column, neighbor column, referenced table, {index name: column})
+SIMILARITY_TABLES = {
+    "item_similarity": ("item_id", "similar_item_id", "products", {
+        "idx_item_similarity_item": "item_id",
+        "idx_item_similarity_similar_item": "similar_item_id",
+    }),
+    "user_similarity": ("user_id", "similar_user_id", "users", {
+        "idx_user_similarity_user": "user_id",
+    }),
+}
+
+# table -> (artifact file under MODEL_DIR, artifact kind)
+INDEX_ARTIFACTS = {
+    "item_similarity": (ITEM_INDEX_FILE, "item"),
+    "user_similarity": (USER_INDEX_FILE, "user"),
+}
+
+CHUNK_ROWS = 256 * 1024
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+# one tuple: field count, then (length, value) for int4, int4, float8 -- all big-endian
+_TUPLE_DTYPE = np.dtype([
+    ("nfields", ">i2"),
+    ("len_key", ">i4"), ("key", ">i4"),
+    ("len_nbr", ">i4"), ("nbr", ">i4"),
+    ("len_score", ">i4"), ("score", ">f8"),
+])
+
+
+# ------------------------------
+# Row generation
+# ------------------------------
+def neighbor_rows(indices, distances, ids, chunk_rows=CHUNK_ROWS, start=0):
+    """Yield ``(key_ids, neighbor_ids, scores)`` array chunks from kneighbors output.
+
+    ``indices``/``distances`` are ``(n, k)`` arrays of dense neighbor indices and
+    cosine distances; self-matches are dropped and ``score = 1 - distance``.
+    ``start`` offsets the row numbers when the arrays cover a block of rows.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    n, k = indices.shape
+    step = max(1, chunk_rows // max(k, 1))
+    for lo in range(0, n, step):
+        hi = min(n, lo + step)
+        rows = np.repeat(np.arange(start + lo, start + hi), k)
+        cols = np.asarray(indices[lo:hi]).ravel()
+        keep = cols != rows
+        yield ids[rows[keep]], ids[cols[keep]], 1.0 - np.asarray(distances[lo:hi], dtype=np.float64).ravel()[keep]
+
+
+def encode_copy_rows(keys, nbrs, scores):
+    buf = np.empty(len(keys), dtype=_TUPLE_DTYPE)
+    buf["nfields"] = 3
+    buf["len_key"] = 4
+    buf["key"] = keys
+    buf["len_nbr"] = 4
+    buf["nbr"] = nbrs
+    buf["len_score"] = 8
+    buf["score"] = scores
+    return buf.tobytes()
+
+
+class _CopyStream:
+    """File-like object feeding binary COPY data chunk by chunk to ``copy_expert``."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = [_COPY_HEADER]
+        self._done = False
+        self.rows = 0
+
+    def _next_block(self):
+        try:
+            keys, nbrs, scores = next(self._chunks)
+        except StopIteration:
+            self._done = True
+            return _COPY_TRAILER
+        self.rows += len(keys)
+        return encode_copy_rows(keys, nbrs, scores)
+
+    def read(self, size=-1):
+        # hand out whole encoded chunks; copy_expert accepts reads larger than `size`
+        if self._pending:
+            return self._pending.pop()
+        if self._done:
+            return b""
+        return self._next_block()
+
+
+# ------------------------------
+# Staging load + atomic swap
+# ------------------------------
+def replace_similarity_table(db, table, chunks):
+    """Bulk-load ``chunks`` into ``table`` via a staging table and swap it in atomically."""
+    key_col, nbr_col, ref_table, indexes = SIMILARITY_TABLES[table]
+    staging = f"{table}_staging"
+    old = f"{table}_old"
+    started = time.perf_counter()
+
+    conn = db.connection()
+    conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+    conn.execute(text(f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY)"))
+
+    stream = _CopyStream(iter(chunks))
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {staging} ({key_col}, {nbr_col}, score) FROM STDIN WITH (FORMAT binary)",
+        stream, size=1024 * 1024,
+    )
+    cursor.close()
+    loaded = time.perf_counter()
+
+    # indexes and constraints after the load: much cheaper than maintaining them per row
+    conn.execute(text(f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY (id)"))
+    for name, col in indexes.items():
+        conn.execute(text(f"CREATE INDEX {name}_staging ON {staging}({col})"))
+    for col in (key_col, nbr_col):
+        conn.execute(text(f"""
+            ALTER TABLE {staging} ADD CONSTRAINT {table}_{col}_fkey
+            FOREIGN KEY ({col}) REFERENCES {ref_table}(id) ON DELETE CASCADE NOT VALID
+        """))
+
+    # the swap: readers block on the lock for the duration of a few catalog updates and
+    # then see the complete new table
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"ALTER TABLE {staging} RENAME TO {table}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {staging}_pkey TO {table}_pkey"))
+    for name in indexes:
+        conn.execute(text(f"ALTER INDEX {name}_staging RENAME TO {name}"))
+    db.commit()
+    swapped = time.perf_counter()
+
+    # validate the foreign keys after the swap: VALIDATE CONSTRAINT only takes a SHARE
+    # UPDATE EXCLUSIVE lock, so readers keep going. Products deleted while the model was
+    # trained left neighbor rows behind that would fail it; drop those first.
+    conn = db.connection()
+    for col in (key_col, nbr_col):
+        conn.execute(text(f"""
+            DELETE FROM {table} t
+            WHERE NOT EXISTS (SELECT 1 FROM {ref_table} r WHERE r.id = t.{col})
+        """))
+        conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{col}_fkey"))
+    db.commit()
+
+    done = time.perf_counter()
+    print(f"Loaded {stream.rows} rows into {table} "
+          f"(copy {loaded - started:.2f}s, index+swap {swapped - loaded:.2f}s, "
+          f"validate {done - swapped:.2f}s)")
+    return stream.rows
+
+
+def replace_similarity_rows(db, table, key_ids, chunks):
+    """Replace the neighbor rows of ``key_ids`` only, in one transaction.
+
+    Used by incremental training: readers see either all old or all new rows
+    for the affected keys.
+    """
+    key_col, nbr_col, _, _ = SIMILARITY_TABLES[table]
+    started = time.perf_counter()
+
+    conn = db.connection()
+    deleted = conn.execute(text(f"DELETE FROM {table} WHERE {key_col} = ANY(:ids)"),
+                           {"ids": [int(k) for k in key_ids]}).rowcount
+
+    stream = _CopyStream(iter(chunks))
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({key_col}, {nbr_col}, score) FROM STDIN WITH (FORMAT binary)",
+        stream, size=1024 * 1024,
+    )
+    cursor.close()
+    db.commit()
+
+    print(f"Replaced rows of {len(key_ids)} keys in {table}: "
+          f"-{deleted} +{stream.rows} in {time.perf_counter() - started:.2f}s")
+    return stream.rows
+
+
+# ------------------------------
+# Serving artifact
+# ------------------------------
+def publish_index(table, indices, distances, ids):
+    """Publish the neighbors stored in ``table`` as its artifact; the API hot-swaps it."""
+    filename, kind = INDEX_ARTIFACTS[table]
+    keys, nbrs, scores = (np.concatenate(c) for c in zip(*neighbor_rows(indices, distances, ids)))
+    index = ItemSimilarityIndex.from_triplets(keys, nbrs, scores, version=time.strftime("%Y%m%dT%H%M%S"))
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    index.save(MODEL_DIR / filename, kind=kind)
+    print(f"Published {kind} index ({len(index)} {kind}s, {index.nnz} neighbors) to {MODEL_DIR}")
+    return index
@@ -0,0 +1,337 @@
+"""
+Functionality of this script:
+Incrementally refresh item_similarity from events newer than the last run instead of retraining
+from scratch. Between runs it keeps, in MODEL_DIR/item_knn_state.npz, the user-item matrix M
+with its per-entry event counts N, the item co-occurrence matrix C = M^T M (whose diagonal holds the squared item norms) and the
+last consumed event ids. A run:
+    1) loads only view/purchase events with id above the stored watermarks, plus the ids
+       below them that were still missing (uncommitted) at earlier runs,
+    2) folds them into M and C (C += M^T D + D^T M + D^T D for the delta D),
+    3) recomputes top-K neighbors only for items whose similarities can have changed
+       (items in the delta and every item co-occurring with them),
+    4) replaces just those rows in item_similarity and in the published item index.
+The first run (or --full) bootstraps the state from all events.
+With time decay (INTERACTION_HALF_LIFE_DAYS) M and C are stored decayed to the previous run and
+are rescaled (by f and f^2) before the delta is added; cosines are scale-invariant, so this
+alone changes no neighbor list. With a lookback window (INTERACTION_WINDOW_DAYS) the events
+that left the window since the previous run are folded in as a negative delta; entries whose
+events have all expired are removed by their counts, not by their (round-off) values.
+Usage:
+    python -m scripts.train_item_knn_incremental [--k 10] [--full] [--hole-ttl-s 3600]
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from sqlalchemy import text
+from app.config import MODEL_DIR
+from app.db import SessionLocal
+from app.services.interaction_decay import (
+    INTERACTION_HALF_LIFE_DAYS,
+    INTERACTION_WINDOW_DAYS,
+    decay_factor,
+    window_seconds,
+)
+from app.services.similarity_index import ITEM_INDEX_FILE, ItemSimilarityIndex
+from scripts.interactions import Interactions, load_expired_interactions, load_interactions, missing_event_ids
+from scripts.refresh_trending import set_watermark
+from scripts.similarity_writer import replace_similarity_rows, replace_similarity_table
+
+TOP_K = 10
+STATE_FILE = "item_knn_state.npz"
+JOB_NAME = "train_item_knn_incremental"
+# How long an id missing below a watermark is looked up again: the longest an event
+# transaction may stay open before its rows are lost to the incremental model
+HOLE_TTL_S = 3600.0
+
+
+# ------------------------------
+# State
+# ------------------------------
+class IncrementalState:
+    def __init__(self, user_ids, item_ids, M, C, last_view_id=0, last_purchase_id=0, as_of=0.0, window_start=0.0,
+                 half_life_days=INTERACTION_HALF_LIFE_DAYS, window_days=INTERACTION_WINDOW_DAYS, N=None,
+                 holes=None):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)  # dense row -> users.id
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)  # dense col -> products.id
+        self.M = csr_matrix(M, dtype=np.float64)
+        self.C = csr_matrix(C, dtype=np.float64)
+        # events per (user, item) in M; None in state files written before it was kept
+        self.N = None if N is None else csr_matrix(N, dtype=np.int32)
+        self.last_view_id = int(last_view_id)
+        self.last_purchase_id = int(last_purchase_id)
+        self.as_of = float(as_of)                # epoch seconds M and C are decayed to (0 = unknown)
+        self.window_start = float(window_start)  # epoch seconds; older events are out of M (0 = none)
+        self.half_life_days = float(half_life_days)
+        self.window_days = float(window_days)
+        # per event table (views, purchases): ids missing below the watermark and when each
+        # was first missed (epoch seconds)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        self.holes = list(holes) if holes is not None else [empty, empty]
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], csr_matrix((0, 0)), csr_matrix((0, 0)), N=csr_matrix((0, 0), dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            M = csr_matrix((z["M_data"], z["M_indices"], z["M_indptr"]), shape=tuple(z["M_shape"]))
+            C = csr_matrix((z["C_data"], z["C_indices"], z["C_indptr"]), shape=tuple(z["C_shape"]))
+            # state files written before decay/window support: no decay, whole history
+            extra = {k: float(z[k]) for k in ("as_of", "window_start", "half_life_days", "window_days")
+                     if k in z.files}
+            extra.setdefault("half_life_days", 0.0)
+            extra.setdefault("window_days", 0.0)
+            if "N_data" in z.files:
+                extra["N"] = csr_matrix((z["N_data"], z["N_indices"], z["N_indptr"]), shape=tuple(z["M_shape"]))
+            if "view_holes" in z.files:
+                extra["holes"] = [(z["view_holes"], z["view_holes_seen"]),
+                                  (z["purchase_holes"], z["purchase_holes_seen"])]
+            return cls(z["user_ids"], z["item_ids"], M, C, int(z["last_view_id"]), int(z["last_purchase_id"]),
+                       **extra)
+
+    def save(self, path):
+        path = os.fspath(path)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            np.savez(f, user_ids=self.user_ids, item_ids=self.item_ids,
+                     M_data=self.M.data, M_indices=self.M.indices, M_indptr=self.M.indptr,
+                     M_shape=np.array(self.M.shape),
+                     C_data=self.C.data, C_indices=self.C.indices, C_indptr=self.C.indptr,
+                     C_shape=np.array(self.C.shape),
+                     N_data=self.N.data, N_indices=self.N.indices, N_indptr=self.N.indptr,
+                     last_view_id=self.last_view_id, last_purchase_id=self.last_purchase_id,
+                     as_of=self.as_of, window_start=self.window_start,
+                     half_life_days=self.half_life_days, window_days=self.window_days,
+                     view_holes=self.holes[0][0], view_holes_seen=self.holes[0][1],
+                     purchase_holes=self.holes[1][0], purchase_holes_seen=self.holes[1][1])
+        os.replace(tmp, path)
+
+
+def _extend_ids(known, raw):
+    """Dense indices of ``raw`` ids, appending unseen ids to ``known``."""
+    known = np.asarray(known, dtype=np.int64)
+    raw = np.asarray(raw, dtype=np.int64)
+    new = np.setdiff1d(np.unique(raw), known, assume_unique=True)
+    ids = np.concatenate([known, new])
+    sorter = np.argsort(ids, kind="stable")
+    return ids, sorter[np.searchsorted(ids, raw, sorter=sorter)]
+
+
+def _resize(mat, shape):
+    mat = mat.tocoo()
+    return coo_matrix((mat.data, (mat.row, mat.col)), shape=shape).tocsr()
+
+
+# ------------------------------
+# Applying deltas
+# ------------------------------
+def _clear_emptied(state, touched):
+    """Drop the M and C entries whose events have all expired.
+
+    Expired events cancel only up to float32 round-off, and a decayed entry that
+    is still valid can be smaller than that residue, so emptiness is decided by
+    the exact event counts N: an M entry is gone when its count is 0, a C entry
+    (i, j) when no user has events on both i and j any more. Only the rows and
+    columns of ``touched`` items can have changed.
+    """
+    state.N.eliminate_zeros()
+    present = state.N.astype(bool)
+    state.M = state.M.multiply(present).tocsr()
+
+    B = present.astype(np.float64)
+    shared = B[:, touched].T.tocsr() @ B  # users having both items, rows = touched items
+    pos = np.full(state.C.shape[0], -1, dtype=np.int64)
+    pos[touched] = np.arange(len(touched))
+    C = state.C.tocoo()
+    # (i, j) is looked up in the row of whichever item was touched (the counts are symmetric)
+    key = np.where(pos[C.row] >= 0, pos[C.row], pos[C.col])
+    other = np.where(pos[C.row] >= 0, C.col, C.row)
+    sel = np.flatnonzero(key >= 0)
+    if len(sel):  # none left when every co-occurrence of the touched items cancelled exactly
+        gone = sel[np.asarray(shared[key[sel], other[sel]]).ravel() == 0]
+        C.data[gone] = 0
+    state.C = C.tocsr()
+    state.C.eliminate_zeros()
+
+
+def decay_state(state, as_of):
+    """Bring M and C from ``state.as_of`` to ``as_of`` (epoch seconds)."""
+    if state.as_of > 0:
+        f = float(decay_factor(as_of - state.as_of))
+        if f != 1.0:
+            state.M = state.M * f
+            state.C = state.C * (f * f)
+    state.as_of = as_of
+
+
+def concat_interactions(a, b):
+    return Interactions(np.concatenate([a.user_ids, b.user_ids]), np.concatenate([a.item_ids, b.item_ids]),
+                        np.concatenate([a.weights, b.weights]), max(a.last_view_id, b.last_view_id),
+                        max(a.last_purchase_id, b.last_purchase_id), as_of=a.as_of)
+
+
+def apply_events(state, data):
+    """Fold loaded ``Interactions`` into M and C; returns the dense indices of touched items."""
+    user_ids, rows = _extend_ids(state.user_ids, data.user_ids)
+    item_ids, cols = _extend_ids(state.item_ids, data.item_ids)
+    shape = (len(user_ids), len(item_ids))
+
+    M_old = _resize(state.M, shape)
+    D = coo_matrix((data.weights.astype(np.float64), (rows, cols)), shape=shape).tocsr()
+    cross = M_old.T @ D
+    state.C = _resize(state.C, (shape[1], shape[1])) + cross + cross.T + D.T @ D
+    state.M = M_old + D
+    # one row per event: +1 for new events, -1 for expired ones
+    state.N = _resize(state.N, shape) + coo_matrix(
+        (np.sign(data.weights).astype(np.int32), (rows, cols)), shape=shape).tocsr()
+    if (data.weights < 0).any():
+        _clear_emptied(state, np.unique(cols))
+    state.user_ids, state.item_ids = user_ids, item_ids
+
+    state.last_view_id = max(state.last_view_id, data.last_view_id)
+    state.last_purchase_id = max(state.last_purchase_id, data.last_purchase_id)
+    return np.unique(cols)
+
+
+# ------------------------------
+# Neighbors from co-occurrence
+# ------------------------------
+def affected_items(C, touched, C_before=None):
+    """Touched items plus everything that co-occurs with them before or after the update.
+
+    For any other item j, C[j, t] == 0 for every touched t both before and after
+    the update, so none of its similarities (and hence its top-K) changed. The
+    co-occurrences before matter once events expire: an item whose only link to a
+    touched item is gone still lists that item as a neighbor.
+    """
+    if len(touched) == 0:
+        return touched
+    cols = [C[touched].tocoo().col]
+    if C_before is not None:
+        old = touched[touched < C_before.shape[0]]  # items new in this run had no links
+        cols.append(C_before[old].tocoo().col)
+    return np.union1d(touched, np.concatenate(cols))
+
+
+def topk_from_cooccurrence(C, rows, k):
+    """Cosine top-``k`` neighbors (self excluded, similarity > 0) of the given item rows."""
+    norms = np.sqrt(np.maximum(C.diagonal(), 0))
+    inv = np.zeros_like(norms)
+    inv[norms > 0] = 1.0 / norms[norms > 0]
+
+    sub = C[rows].tocoo()
+    r, c = sub.row, sub.col
+    sims = sub.data * inv[rows][r] * inv[c]
+    keep = (c != rows[r]) & (sims > 0)
+    r, c, sims = r[keep], c[keep], sims[keep]
+
+    order = np.lexsort((c, -sims, r))
+    r, c, sims = r[order], c[order], sims[order]
+    first = np.searchsorted(r, np.arange(len(rows)))
+    rank = np.arange(len(r)) - first[r]
+    top = rank < k
+    return rows[r[top]], c[top], np.minimum(sims[top], 1.0)
+
+
+# ------------------------------
+# Run
+# ------------------------------
+def run(k=TOP_K, full=False, hole_ttl_s=HOLE_TTL_S, chunk_items=50000):
+    started = time.perf_counter()
+    state_path = MODEL_DIR / STATE_FILE
+    bootstrap = full or not state_path.exists()
+    state = IncrementalState.empty() if bootstrap else IncrementalState.load(state_path)
+    if (state.half_life_days, state.window_days) != (INTERACTION_HALF_LIFE_DAYS, INTERACTION_WINDOW_DAYS):
+        print(f"Decay/window settings changed (half-life {state.half_life_days} -> {INTERACTION_HALF_LIFE_DAYS} days, "
+              f"window {state.window_days} -> {INTERACTION_WINDOW_DAYS} days); rebuilding from all events.")
+        bootstrap = True
+        state = IncrementalState.empty()
+    elif state.N is None:
+        print("State has no event counts (written by an older version); rebuilding from all events.")
+        bootstrap = True
+        state = IncrementalState.empty()
+
+    db = SessionLocal()
+    # one snapshot for the loads and the hole scan: a row committed in between would be
+    # neither loaded nor tracked as missing
+    db.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+    as_of = db.execute(text("SELECT now()")).scalar()
+    window = window_seconds()
+    (view_holes, _), (purchase_holes, _) = state.holes
+    # events that left the lookback window since the last run (loaded with the old watermarks)
+    expired = None
+    if window is not None and not bootstrap and state.window_start > 0:
+        expired = load_expired_interactions(db, state.last_view_id, state.last_purchase_id,
+                                            datetime.fromtimestamp(state.window_start, timezone.utc),
+                                            datetime.fromtimestamp(as_of.timestamp() - window, timezone.utc),
+                                            as_of, view_holes=view_holes, purchase_holes=purchase_holes)
+    data = load_interactions(db, state.last_view_id, state.last_purchase_id, as_of=as_of,
+                             view_holes=view_holes, purchase_holes=purchase_holes)
+    # ids below the new watermarks that are not visible yet: looked up again next run
+    state.holes = [missing_event_ids(db, src, after, upto, *state.holes[src], as_of.timestamp(), hole_ttl_s)
+                   for src, (after, upto) in enumerate(((state.last_view_id, data.last_view_id),
+                                                        (state.last_purchase_id, data.last_purchase_id)))]
+    if expired is not None and len(expired):
+        data = concat_interactions(data, expired)
+    decay_state(state, as_of.timestamp())
+    state.window_start = as_of.timestamp() - window if window is not None else 0.0
+    if not len(data) and not bootstrap:
+        print("No new events since the last run; item_similarity is up to date.")
+        db.close()
+        return
+    C_before = state.C  # apply_events replaces C, it does not modify it
+    touched = apply_events(state, data)
+    loaded = time.perf_counter()
+
+    targets = np.arange(len(state.item_ids)) if bootstrap else affected_items(state.C, touched, C_before)
+    print(f"events={len(data)} touched_items={len(touched)} "
+          f"recomputing={len(targets)}/{len(state.item_ids)} items")
+
+    parts = [topk_from_cooccurrence(state.C, targets[lo:lo + chunk_items], k)
+             for lo in range(0, len(targets), chunk_items)]
+    if parts:
+        src, dst, scores = (np.concatenate(p) for p in zip(*parts))
+    else:
+        src = dst = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float64)
+    keys, nbrs = state.item_ids[src], state.item_ids[dst]
+    computed = time.perf_counter()
+
+    chunks = [(keys, nbrs, scores)]
+    if bootstrap:
+        rows = replace_similarity_table(db, "item_similarity", chunks)
+    else:
+        rows = replace_similarity_rows(db, "item_similarity", state.item_ids[targets], chunks)
+    set_watermark(db, JOB_NAME, None, rows)
+    db.commit()
+    db.close()
+
+    # keep the published in-memory index in step with the table
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    index_path = MODEL_DIR / ITEM_INDEX_FILE
+    version = time.strftime("%Y%m%dT%H%M%S")
+    if bootstrap or not index_path.exists():
+        index = ItemSimilarityIndex.from_triplets(keys, nbrs, scores, version=version)
+    else:
+        index = ItemSimilarityIndex.load(index_path).replace_items(
+            state.item_ids[targets], keys, nbrs, scores, version=version)
+    index.save(index_path)
+    state.save(state_path)
+
+    print(f"Incremental item KNN done: load {loaded - started:.2f}s, "
+          f"neighbors {computed - loaded:.2f}s, total {time.perf_counter() - started:.2f}s "
+          f"(watermarks view={state.last_view_id} purchase={state.last_purchase_id})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--full", action="store_true", help="rebuild the state from all events")
+    parser.add_argument("--hole-ttl-s", type=float, default=HOLE_TTL_S,
+                        help="how long event ids missing below the watermarks are looked up again")
+    args = parser.parse_args()
+    run(k=args.k, full=args.full, hole_ttl_s=args.hole_ttl_s)
@@ -0,0 +1,48 @@
+"""
+Functionality of this script:
+Train item- and user-based KNN from a single load of the interaction tables. The events are
+streamed once into a shared interaction matrix, which both trainers then use.
+Usage:
+    python -m scripts.train_knn [--only item|user] [--k 10] [--engine blocked] [--memory-mb 512] [--workers 1]
+"""
+
+import argparse
+import time
+from app.db import SessionLocal
+from scripts.interactions import build_interaction_matrix, load_interactions, peak_rss_mb
+from scripts.knn_engines import DEFAULT_MEMORY_MB, DEFAULT_WORKERS, ENGINES
+from scripts.train_item_knn import TOP_K, train_item_similarity
+from scripts.train_user_knn import train_user_similarity
+
+def train_all(k_neighbors=TOP_K, targets=("item", "user"), engine="sklearn",
+              memory_mb=DEFAULT_MEMORY_MB, workers=DEFAULT_WORKERS):
+    started = time.perf_counter()
+    db = SessionLocal()
+    data = load_interactions(db)
+    if not len(data):
+        print("No interaction data found. Nothing to train.")
+        db.close()
+        return
+
+    im = build_interaction_matrix(data)
+    del data
+    print(f"user_count={len(im.user_ids)}, item_count={len(im.item_ids)}")
+    if "item" in targets:
+        train_item_similarity(db, im, k_neighbors, engine=engine, memory_mb=memory_mb, workers=workers)
+    if "user" in targets:
+        train_user_similarity(db, im, k_neighbors, engine=engine, memory_mb=memory_mb, workers=workers)
+    db.close()
+    print(f"Training done in {time.perf_counter() - started:.2f}s, peak RSS {peak_rss_mb():.0f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", choices=("item", "user"), help="train just one of the models")
+    parser.add_argument("--k", type=int, default=TOP_K, help="neighbors to keep per row")
+    parser.add_argument("--engine", choices=ENGINES, default="sklearn")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help="similarity block budget for the blocked engine")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="worker processes for the blocked engine")
+    args = parser.parse_args()
+    targets = (args.only,) if args.only else ("item", "user")
+    train_all(args.k, targets, engine=args.engine, memory_mb=args.memory_mb, workers=args.workers)
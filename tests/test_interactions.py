@@ -0,0 +1,25 @@
+import numpy as np
+
+from scripts.interactions import merge_holes
+
+
+def test_new_gaps_become_holes():
+    ids, seen = merge_holes([], [], [(5, 7), (10, 10)], [], now=100.0, ttl_s=60)
+    assert ids.tolist() == [5, 6, 7, 10]
+    assert seen.tolist() == [100.0] * 4
+
+
+def test_holes_that_show_up_are_dropped():
+    ids, seen = merge_holes([5, 6, 7], [90.0, 90.0, 90.0], [(12, 12)], [6], now=100.0, ttl_s=60)
+    assert ids.tolist() == [5, 7, 12]
+    assert seen.tolist() == [90.0, 90.0, 100.0]  # old holes keep when they were first missed
+
+
+def test_holes_are_given_up_after_the_ttl():
+    ids, _ = merge_holes([5, 20], [10.0, 90.0], [], [], now=100.0, ttl_s=60)
+    assert ids.tolist() == [20]
+
+
+def test_sequence_jumps_are_not_tracked():
+    ids, _ = merge_holes([], [], [(1, 1000), (2000, 2001)], [], now=0.0, ttl_s=60, max_gap=100)
+    assert ids.tolist() == [2000, 2001]
@@ -0,0 +1,69 @@
+import numpy as np
+
+from app.services.geo import geodesic_distance_m
+from app.services.shop_locator import GridShopLocator, ShopColumns
+
+
+def shops(lats, lons):
+    return [{"id": i + 1, "name": f"shop {i + 1}", "address": None, "lat": float(la), "lon": float(lo)}
+            for i, (la, lo) in enumerate(zip(lats, lons))]
+
+
+def brute_force(rows, lat, lon, radius_km):
+    # Vincenty distance to every shop, no grid
+    return ShopColumns(rows).nearest(lat, lon, float(radius_km) * 1000)
+
+
+def assert_matches(rows, queries, cell_deg=0.05):
+    grid = GridShopLocator(rows, cell_deg=cell_deg)
+    for lat, lon, radius_km in queries:
+        assert grid.nearby(None, lat, lon, radius_km) == brute_force(rows, lat, lon, radius_km)
+
+
+def test_random_shops_match_brute_force():
+    rng = np.random.default_rng(0)
+    rows = shops(rng.uniform(40, 41, 2000), rng.uniform(-74, -73, 2000))
+    queries = [(float(la), float(lo), float(r)) for la, lo, r in
+               zip(rng.uniform(40, 41, 30), rng.uniform(-74, -73, 30), rng.uniform(0.5, 30, 30))]
+    assert_matches(rows, queries)
+
+
+def test_shops_on_the_radius_boundary():
+    # shops straddling the radius by a few millimeters, all around the query point
+    lat, lon, radius_km = 48.85, 2.35, 3.0
+    rng = np.random.default_rng(1)
+    bearings = rng.uniform(0, 2 * np.pi, 400)
+    approx = np.column_stack([lat + np.cos(bearings) * 0.027, lon + np.sin(bearings) * 0.041])
+    # rescale each offset so its geodesic length lands on radius +- 5 mm
+    target = radius_km * 1000 + rng.choice([-0.005, 0.0, 0.005], len(bearings))
+    for _ in range(4):
+        d = geodesic_distance_m(lat, lon, approx[:, 0], approx[:, 1])
+        approx = np.array([lat, lon]) + (approx - np.array([lat, lon])) * (target / d)[:, None]
+    rows = shops(approx[:, 0], approx[:, 1])
+    inside = brute_force(rows, lat, lon, radius_km)
+    assert 0 < len(inside) < len(rows)
+    assert_matches(rows, [(lat, lon, radius_km)])
+
+
+def test_antimeridian():
+    rng = np.random.default_rng(2)
+    lons = np.concatenate([rng.uniform(179.5, 180.0, 300), rng.uniform(-180.0, -179.5, 300)])
+    rows = shops(rng.uniform(-17.5, -16.5, 600), lons)
+    queries = [(-17.0, 179.99, 20.0), (-17.0, -179.99, 20.0), (-17.0, 180.0, 5.0), (-17.2, -179.8, 40.0)]
+    assert_matches(rows, queries)
+    assert {r["longitude"] > 0 for r in brute_force(rows, -17.0, 179.99, 20.0)} == {True, False}
+
+
+def test_near_the_poles():
+    rng = np.random.default_rng(3)
+    for sign in (1, -1):
+        rows = shops(sign * rng.uniform(89.0, 90.0, 800), rng.uniform(-180, 180, 800))
+        queries = [(sign * 89.95, 10.0, 15.0), (sign * 89.999, -170.0, 50.0), (sign * 89.5, 90.0, 60.0)]
+        assert_matches(rows, queries, cell_deg=0.5)
+
+
+def test_load_rows_swaps_the_snapshot():
+    grid = GridShopLocator(shops([10.0], [10.0]))
+    assert len(grid.nearby(None, 10.0, 10.0, 1.0)) == 1
+    grid.load_rows(shops([10.0, 10.001], [10.0, 10.001]))
+    assert [r["id"] for r in grid.nearby(None, 10.0, 10.0, 1.0)] == [1, 2]
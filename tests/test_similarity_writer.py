@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+import scripts.similarity_writer as writer
+from app.services.similarity_index import ItemSimilarityIndex
+
+
+@pytest.mark.parametrize("table", ["item_similarity", "user_similarity"])
+def test_publish_index_round_trip(tmp_path, monkeypatch, table):
+    monkeypatch.setattr(writer, "MODEL_DIR", tmp_path)
+    ids = np.array([10, 20, 30])
+    indices = np.array([[0, 1, 2], [1, 0, 2], [2, 1, 0]])
+    distances = np.array([[0.0, 0.2, 0.5], [0.0, 0.2, 0.4], [0.0, 0.4, 0.5]])
+    writer.publish_index(table, indices, distances, ids)
+
+    filename, kind = writer.INDEX_ARTIFACTS[table]
+    index = ItemSimilarityIndex.load(tmp_path / filename, kind=kind)
+    assert len(index) == 3 and index.nnz == 6  # self-matches dropped
@@ -0,0 +1,116 @@
+import numpy as np
+
+from app.services.interaction_decay import decay_factor
+from scripts.interactions import Interactions
+from scripts.train_item_knn_incremental import (
+    IncrementalState,
+    affected_items,
+    apply_events,
+    concat_interactions,
+    topk_from_cooccurrence,
+)
+
+
+def events(users, items, weights):
+    return Interactions(np.asarray(users, dtype=np.int32), np.asarray(items, dtype=np.int32),
+                        np.asarray(weights, dtype=np.float32))
+
+
+def dense(state, user_ids, item_ids):
+    """M, C and N of ``state`` laid out over the given id orders."""
+    u = np.searchsorted(user_ids, state.user_ids)
+    i = np.searchsorted(item_ids, state.item_ids)
+    M = np.zeros((len(user_ids), len(item_ids)))
+    C = np.zeros((len(item_ids), len(item_ids)))
+    N = np.zeros((len(user_ids), len(item_ids)), dtype=np.int64)
+    M[np.ix_(u, i)] = state.M.toarray()
+    C[np.ix_(i, i)] = state.C.toarray()
+    N[np.ix_(u, i)] = state.N.toarray()
+    return M, C, N
+
+
+def test_expiring_every_event_empties_the_state():
+    state = IncrementalState.empty()
+    apply_events(state, events([1, 1, 2], [10, 20, 20], [1, 1, 1]))
+    apply_events(state, events([1, 1, 2], [10, 20, 20], [-1, -1, -1]))
+    assert state.M.nnz == 0
+    assert state.C.nnz == 0
+    assert state.N.nnz == 0
+
+
+def test_expiring_all_co_occurrences_of_the_touched_items():
+    state = IncrementalState.empty()
+    apply_events(state, events([1, 1, 2, 2], [10, 20, 30, 40], [1, 1, 1, 1]))
+    apply_events(state, events([1, 1], [10, 20], [-1, -1]))
+    M, C, _ = dense(state, state.user_ids, state.item_ids)
+    assert state.C.nnz == 4  # only user 2's items 30 and 40 are left
+    assert C[:2].sum() == 0 and M[0].sum() == 0
+
+
+def test_items_losing_their_last_link_are_recomputed():
+    state = IncrementalState.empty()
+    apply_events(state, events([1, 1, 2, 2], [10, 20, 20, 40], [1, 1, 1, 1]))
+    C_before = state.C
+    touched = apply_events(state, events([1], [20], [-1]))  # the only 10-20 link expires
+    affected = state.item_ids[affected_items(state.C, touched, C_before)]
+    assert sorted(affected) == [10, 20, 40]
+
+    src, dst, _ = topk_from_cooccurrence(state.C, np.flatnonzero(state.item_ids == 10), 10)
+    assert len(dst) == 0  # item 10 is recomputed to no neighbors, not left pointing at 20
+
+
+def test_decayed_window_matches_rebuild():
+    # a 1-day half-life makes valid entries far smaller than the float32 residue of
+    # the expired ones; the incremental state must still match a full rebuild
+    half_life, window = 1.0, 40 * 86400
+    rng = np.random.default_rng(1)
+    n = 3000
+    ts = np.sort(rng.uniform(0, 100 * 86400, n))
+    users = rng.integers(1, 60, n)
+    items = rng.integers(1, 80, n)
+    base = np.where(rng.random(n) < 0.2, 3.0, 1.0)
+
+    def weighted(mask, at, sign=1.0):
+        return events(users[mask], items[mask], sign * base[mask] * decay_factor(at - ts[mask], half_life))
+
+    state = IncrementalState.empty()
+    previous = None
+    for at in (50 * 86400, 60 * 86400, 75 * 86400, 100 * 86400):
+        if previous is not None:
+            f = float(decay_factor(at - previous, half_life))
+            state.M, state.C = state.M * f, state.C * (f * f)
+            delta = concat_interactions(weighted((ts > previous) & (ts <= at) & (ts >= at - window), at),
+                                        weighted((ts >= previous - window) & (ts < at - window), at, -1.0))
+        else:
+            delta = weighted((ts <= at) & (ts >= at - window), at)
+        apply_events(state, delta)
+        previous = at
+
+    rebuilt = IncrementalState.empty()
+    apply_events(rebuilt, weighted((ts <= previous) & (ts >= previous - window), previous))
+
+    user_ids = np.union1d(state.user_ids, rebuilt.user_ids)
+    item_ids = np.union1d(state.item_ids, rebuilt.item_ids)
+    M, C, N = dense(state, user_ids, item_ids)
+    M_ref, C_ref, N_ref = dense(rebuilt, user_ids, item_ids)
+    np.testing.assert_array_equal(N, N_ref)
+    np.testing.assert_array_equal(C != 0, C_ref != 0)
+    np.testing.assert_allclose(C, C_ref, rtol=1e-6)
+    np.testing.assert_allclose(M, M_ref, rtol=1e-6)
+
+    def pairs(st):
+        src, dst, _ = topk_from_cooccurrence(st.C, np.arange(len(st.item_ids)), 10)
+        return sorted(zip(st.item_ids[src], st.item_ids[dst]))
+
+    assert pairs(state) == pairs(rebuilt)
+
+
+def test_state_round_trip_keeps_holes(tmp_path):
+    state = IncrementalState.empty()
+    apply_events(state, events([1, 2], [10, 20], [1, 1]))
+    state.holes = [(np.array([3, 4]), np.array([10.0, 11.0])), (np.array([7]), np.array([12.0]))]
+    state.save(tmp_path / "state.npz")
+    loaded = IncrementalState.load(tmp_path / "state.npz")
+    assert [h.tolist() for h, _ in loaded.holes] == [[3, 4], [7]]
+    assert [s.tolist() for _, s in loaded.holes] == [[10.0, 11.0], [12.0]]
+    assert (loaded.N != state.N).nnz == 0
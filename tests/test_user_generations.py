@@ -0,0 +1,47 @@
+import os
+
+from app.services.response_cache import ResponseCache
+from app.services.user_generations import bump_user_generation, user_generation
+from app.services.user_profile import UserProfile, UserProfileCache
+
+
+def in_child(fn):
+    """Run ``fn`` in a forked worker and wait for it, like app.serve's workers."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            fn()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def test_a_bump_in_another_worker_is_seen():
+    before = user_generation(41)
+    in_child(lambda: bump_user_generation(41))
+    assert user_generation(41) == before + 1
+
+
+def test_profile_invalidated_by_another_worker_is_a_miss():
+    cache = UserProfileCache(ttl_s=60)
+    cache.put(UserProfile(42, [1, 2], {3: 1.0}))
+    assert cache.get(42) is not None
+    in_child(lambda: bump_user_generation(42))
+    assert cache.get(42) is None
+
+
+def test_profile_loaded_before_an_event_is_not_cached_over_it():
+    cache = UserProfileCache(ttl_s=60)
+    generation = user_generation(43)  # read before the load
+    bump_user_generation(43)          # an event commits while the profile loads
+    cache.put(UserProfile(43, [], {}), generation)
+    assert cache.get(43) is None
+
+
+def test_response_invalidated_by_another_worker_changes_the_key():
+    cache = ResponseCache(ttl_s=60)
+    key, _ = cache.key(44, 10.0, 10.0, 5.0, 20)
+    cache.put(key, ([1], [0.5]))
+    in_child(lambda: ResponseCache(ttl_s=60).invalidate_user(44))
+    new_key, _ = cache.key(44, 10.0, 10.0, 5.0, 20)
+    assert new_key != key and cache.get(new_key) is None